@@ -0,0 +1,136 @@
+"""
+Run the benchmark suite and compare results between commits.
+
+    python -m benchmarks run [engine shell ...] [-o results.json]
+    python -m benchmarks compare base.json new.json [--threshold 0.1]
+
+`run` executes the `run()` function of every `bench_<name>` module (or only the given ones)
+and writes the results with the commit they were measured on.
+`compare` prints the change of the median of each benchmark and exits with code 1
+when one of them is slower than `threshold` (relative).
+"""
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import platform
+import subprocess
+import sys
+import time
+import typing
+
+from .common import report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def discover() -> list[str]:
+    return sorted(
+        m.name[len("bench_") :]
+        for m in pkgutil.iter_modules([os.path.dirname(__file__)])
+        if m.name.startswith("bench_")
+    )
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def run(names: list[str], output: typing.Optional[str]):
+    results = []
+    for name in names or discover():
+        module = importlib.import_module(f".bench_{name}", __package__)
+        print(f"# {name}", file=sys.stderr)
+        module_results = module.run()
+        report(module_results, as_json=False)
+        results.extend(module_results)
+
+    data = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.time(),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    base_results = {r["name"]: r for r in base["results"]}
+    width = max([len(r["name"]) for r in new["results"]] + [4])
+    print(
+        f"{'name':<{width}}  {base['commit'] or '?':>12.12}  {new['commit'] or '?':>12.12}  change"
+    )
+    regressions = 0
+    for r in new["results"]:
+        old = base_results.get(r["name"])
+        if old is None:
+            print(
+                f"{r['name']:<{width}}  {'-':>12}  {r['median']:>10.1f}{r['unit']}  new"
+            )
+            continue
+
+        change = r["median"] / old["median"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{r['name']:<{width}}  {old['median']:>10.1f}{old['unit']}  {r['median']:>10.1f}{r['unit']}  {change:+7.1%}{flag}"
+        )
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("names", nargs="*", help=f"one of {', '.join(discover())}")
+    run_parser.add_argument("-o", "--output", help="write the results to this file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown reported as a regression (default: 0.1)",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args.names, args.output)
+    else:
+        sys.exit(compare(args.base, args.new, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
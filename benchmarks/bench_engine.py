@@ -0,0 +1,103 @@
+"""
+Overhead of the step loop (`Workflow.run`/`Step.run`) on synthetic workflows using the no-op action:
+
+* wide: many top-level steps
+* deep: a chain of nested child steps
+* rules: steps with a rule and many conditional commands
+* *-async: the same with the asyncio engine (`Workflow.arun`)
+* io-async: thousands of steps waiting on (simulated) I/O at the same time
+
+Usage: python -m benchmarks.bench_engine [--json]
+"""
+import asyncio
+import sys
+import typing
+
+from vonzy.schema import Workflow
+
+from .common import bench, report
+
+NOOP = {"name": "benchmarks.noop", "params": {"value": "{env.HOME}"}}
+
+
+def make_step(step_id: str, **kwargs) -> dict[str, typing.Any]:
+    return {"id": step_id, "name": f"Step {step_id}", "use": NOOP} | kwargs
+
+
+def wide(count: int = 500) -> Workflow:
+    return Workflow(
+        name="wide",
+        steps=[make_step(f"s{i}", commands=["echo {env.HOME}"]) for i in range(count)],
+    )
+
+
+def deep(depth: int = 100) -> Workflow:
+    step = make_step(f"s{depth}")
+    for i in reversed(range(depth)):
+        step = make_step(f"s{i}", steps=[step])
+    return Workflow(name="deep", steps=[step])
+
+
+def rules(count: int = 100, commands: int = 10) -> Workflow:
+    steps = [make_step("first")]
+    for i in range(count):
+        steps.append(
+            make_step(
+                f"s{i}",
+                rule='steps.first.result.status == "success"',
+                commands=[
+                    {
+                        "rule": f'steps.first.result.status != "error" and {j} > 0',
+                        "cmd": "true",
+                    }
+                    for j in range(commands)
+                ],
+            )
+        )
+    return Workflow(name="rules", steps=steps)
+
+
+def io_bound(count: int = 2000, delay: float = 0.1) -> Workflow:
+    use = {"name": "benchmarks.noop", "params": {"delay": delay}}
+    return Workflow(
+        name="io",
+        steps=[make_step(f"s{i}", use=use, commands=["wait"]) for i in range(count)],
+    )
+
+
+def run_async(workflow: Workflow) -> list:
+    async def consume():
+        return [r async for r in workflow.arun()]
+
+    return asyncio.run(consume())
+
+
+def run() -> list[dict]:
+    # the engine recurses once per nesting level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    results = []
+    for name, workflow in [("wide", wide()), ("deep", deep()), ("rules", rules())]:
+        steps = len(list(workflow.run())) - 1
+        result = bench(
+            f"engine/{name}", lambda: list(workflow.run()), number=3, repeat=5
+        )
+        result["steps"] = steps
+        result["per_step_us"] = result["median"] / steps
+        results.append(result)
+
+        result = bench(
+            f"engine/{name}-async", lambda: run_async(workflow), number=3, repeat=5
+        )
+        result["steps"] = steps
+        result["per_step_us"] = result["median"] / steps
+        results.append(result)
+
+    workflow = io_bound()
+    result = bench("engine/io-async", lambda: run_async(workflow), number=1, repeat=3)
+    result["steps"] = len(workflow.steps)
+    results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
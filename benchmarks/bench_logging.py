@@ -0,0 +1,77 @@
+"""
+Cost of a log call on the calling thread: a filtered-out debug call with a large argument,
+and an info call rendered by the Rich console directly vs through the logging pipeline.
+
+Usage: python -m benchmarks.bench_logging [--json]
+"""
+import io
+import logging
+import tempfile
+
+from rich.console import Console
+from rich.logging import RichHandler
+
+from vonzy.logger import JsonLinesHandler, LogPipeline, _QueueHandler
+
+from .common import bench, report
+
+CONTEXT = {f"key{i}": list(range(20)) for i in range(200)}
+
+
+def _console_handler() -> RichHandler:
+    return RichHandler(console=Console(file=io.StringIO(), width=120), show_path=False)
+
+
+def run() -> list[dict]:
+    logger = logging.getLogger("vonzy.bench")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    results = [
+        bench(
+            "logging/debug-filtered-fstring",
+            lambda: logger.debug(f"Step context: {CONTEXT}"),
+            number=200,
+        ),
+        bench(
+            "logging/debug-filtered-lazy",
+            lambda: logger.debug("Step context: %s", CONTEXT),
+            number=20000,
+        ),
+    ]
+
+    handler = _console_handler()
+    logger.addHandler(handler)
+    results.append(
+        bench(
+            "logging/info-console-sync",
+            lambda: logger.info("Step %r finished with status=%s", "build", "success"),
+            number=500,
+        )
+    )
+    logger.removeHandler(handler)
+
+    with tempfile.NamedTemporaryFile(suffix=".jsonl") as f:
+        pipeline = LogPipeline([_console_handler(), JsonLinesHandler(f.name)])
+        pipeline.start()
+        handler = _QueueHandler(pipeline)
+        logger.addHandler(handler)
+        try:
+            results.append(
+                bench(
+                    "logging/info-pipeline",
+                    lambda: logger.info(
+                        "Step %r finished with status=%s", "build", "success"
+                    ),
+                    number=500,
+                )
+            )
+            pipeline.flush()
+        finally:
+            logger.removeHandler(handler)
+            pipeline.stop()
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,83 @@
+"""
+Loading a synthetic workflow with 5k steps: pure python YAML loader (the old behaviour) vs libyaml,
+and a hit in the parsed-workflow cache.
+
+Usage: python -m benchmarks.bench_parse [--json]
+"""
+import io
+import tempfile
+
+import oyaml
+import yaml
+
+from vonzy.cache import WorkflowCache
+from vonzy.schema import Workflow
+
+from .common import bench, report
+
+
+def make_workflow(steps: int = 5000, children: int = 4) -> str:
+    """
+    Generate a workflow with `steps` steps in total, every top-level step having `children` child steps.
+    """
+
+    lines = ["name: synthetic", "steps:"]
+    parents = steps // (children + 1)
+    for i in range(parents):
+        lines += [
+            f"  - id: s{i}",
+            f"    name: 'Step {i}'",
+            "    rule: 'inputs.enabled'" if i % 2 else "    rule: null",
+            "    use:",
+            "      name: vonzy.actions.shell",
+            "      params: {debug: true, cwd: '{env.HOME}'}",
+            "    commands:",
+            "      - echo {inputs.project}",
+            "      - rule: 'steps.s0.result.status == \"success\"'",
+            "        cmd: make build",
+            "    steps:",
+        ]
+        for j in range(children):
+            lines += [
+                f"      - id: c{j}",
+                f"        name: 'Child {i}.{j}'",
+                "        use: vonzy.actions.shell",
+                "        commands: [true]",
+            ]
+    return "\n".join(lines) + "\n"
+
+
+def parse(content: bytes, *, use_cache: bool) -> Workflow:
+    f = io.BytesIO(content)
+    f.name = "synthetic.yml"
+    return Workflow.parse_config(f, use_cache=use_cache)
+
+
+def run() -> list[dict]:
+    content = make_workflow().encode()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = WorkflowCache(tmpdir)
+        key = cache.make_key(content)
+        cache.store(key, parse(content, use_cache=False))
+        return [
+            bench(
+                "parse/oyaml-load", lambda: oyaml.safe_load(content), number=1, repeat=3
+            ),
+            bench(
+                "parse/libyaml-load",
+                lambda: yaml.load(content, Loader=yaml.CSafeLoader),
+                number=1,
+                repeat=3,
+            ),
+            bench(
+                "parse/load+validate",
+                lambda: parse(content, use_cache=False),
+                number=1,
+                repeat=3,
+            ),
+            bench("parse/cache-hit", lambda: cache.load(key), number=1, repeat=3),
+        ]
+
+
+if __name__ == "__main__":
+    report(run())
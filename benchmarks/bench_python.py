@@ -0,0 +1,55 @@
+"""
+Cost of a tiny python step: `python -c` through the shell action vs the python action
+with the inline, thread and process (reused pool) executors.
+
+Usage: python -m benchmarks.bench_python [--json]
+"""
+import sys
+
+from vonzy.actions.python import Action, executor_pool
+from vonzy.actions.shell import Action as ShellAction
+
+from .common import bench, report
+
+
+def work(n: int = 1000) -> int:
+    return sum(range(n))
+
+
+def run() -> list[dict]:
+    shell = ShellAction(reuse_session=True)
+    shell.initialize()
+    actions = {
+        executor: Action(function="benchmarks.bench_python:work", executor=executor)
+        for executor in ("inline", "thread", "process")
+    }
+    for action in actions.values():
+        action.initialize()
+        # start the pools before measuring
+        action.execute("work")
+
+    try:
+        results = [
+            bench(
+                "python/shell-python-c",
+                lambda: shell.execute(f"{sys.executable} -c 'print(sum(range(1000)))'"),
+                number=10,
+                repeat=3,
+            )
+        ]
+        for executor, action in actions.items():
+            results.append(
+                bench(
+                    f"python/{executor}",
+                    lambda: action.execute("work"),
+                    number=500 if executor == "inline" else 100,
+                )
+            )
+    finally:
+        shell.cleanup()
+        executor_pool.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
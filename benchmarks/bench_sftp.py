@@ -0,0 +1,92 @@
+"""
+Cost of the sftp action against a local in-process server (see `benchmarks.sshserver`): the first upload
+of a tree with one and several SFTP channels, a sync of the unchanged tree with the remote manifest
+vs a scan of the remote tree (what a sync without an index pays every time) and a sync with one changed file.
+
+Usage: python -m benchmarks.bench_sftp [--json]
+"""
+import os
+import shutil
+import tempfile
+
+from vonzy.actions.sftp import Action
+from vonzy.sshpool import ssh_pool
+
+from .common import bench, report
+from .sshserver import PASSWORD, SSHServer
+
+DIRS = 20
+FILES_PER_DIR = 50
+FILE_SIZE = 4096
+
+
+def make_tree(root: str):
+    for d in range(DIRS):
+        directory = os.path.join(root, f"dir{d}")
+        os.makedirs(directory)
+        for f in range(FILES_PER_DIR):
+            with open(os.path.join(directory, f"file{f}.txt"), "wb") as fp:
+                fp.write(os.urandom(FILE_SIZE))
+
+
+def run() -> list[dict]:
+    with SSHServer() as server, tempfile.TemporaryDirectory(
+        prefix="vonzy-bench-"
+    ) as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        destination = os.path.join(tmpdir, "destination")
+        make_tree(source)
+
+        def sync(**kwargs):
+            action = Action(
+                ssh_host="127.0.0.1",
+                ssh_port=server.port,
+                ssh_user="bench",
+                ssh_password=PASSWORD,
+                source=source,
+                destination=destination,
+                index_dir=os.path.join(tmpdir, "index"),
+                **kwargs,
+            )
+            action.initialize()
+            action.cleanup()
+
+        def initial(parallel: int):
+            shutil.rmtree(destination, ignore_errors=True)
+            sync(parallel=parallel)
+
+        changed = os.path.join(source, "dir0", "file0.txt")
+
+        def one_changed():
+            with open(changed, "wb") as fp:
+                fp.write(os.urandom(FILE_SIZE))
+            sync()
+
+        files = DIRS * FILES_PER_DIR
+        try:
+            results = [
+                bench(
+                    f"sftp/initial-{files}-parallel-1",
+                    lambda: initial(1),
+                    number=1,
+                    repeat=3,
+                ),
+                bench(
+                    f"sftp/initial-{files}-parallel-4",
+                    lambda: initial(4),
+                    number=1,
+                    repeat=3,
+                ),
+                bench("sftp/unchanged-manifest", sync, number=5),
+                bench(
+                    "sftp/unchanged-remote-scan", lambda: sync(verify=True), number=5
+                ),
+                bench("sftp/one-changed", one_changed, number=5),
+            ]
+        finally:
+            ssh_pool.close_all()
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,48 @@
+"""
+Command latency of the shell action: commands per second on one warm shell session,
+and the cost of a chatty command (1MB of output) on the pty and subprocess backends.
+
+Usage: python -m benchmarks.bench_shell [--json]
+"""
+from vonzy.actions.shell import Action, ShellSession
+
+from .common import bench, report
+
+CHATTY_CMD = "yes 0123456789012345678901234567890123456789 | head -c 1000000"
+
+
+def run() -> list[dict]:
+    session = ShellSession()
+    action = Action()
+    action.initialize()
+    subprocess_action = Action(backend="subprocess")
+    subprocess_action.initialize()
+    try:
+        results = [
+            bench("shell/session-true", lambda: session.run("true"), number=500),
+            bench(
+                "shell/session-echo",
+                lambda: session.run("echo hello", lambda line: None),
+                number=500,
+            ),
+            bench("shell/action-execute", lambda: action.execute("true"), number=500),
+            bench("shell/pty-chatty", lambda: action.execute(CHATTY_CMD), number=5),
+            bench(
+                "shell/subprocess-chatty",
+                lambda: subprocess_action.execute(CHATTY_CMD),
+                number=5,
+            ),
+            bench("shell/spawn", lambda: ShellSession().close(), number=3, repeat=3),
+        ]
+    finally:
+        session.close()
+        action.cleanup()
+        subprocess_action.cleanup()
+
+    for r in results:
+        r["commands_per_second"] = 1e6 / r["median"]
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
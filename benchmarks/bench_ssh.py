@@ -0,0 +1,85 @@
+"""
+Latency of the ssh action against a local in-process server (see `benchmarks.sshserver`):
+connection setup with and without the pool, one command on a warm connection,
+a command fanned out to several hosts and a list of commands run one by one vs in pipeline mode.
+
+Usage: python -m benchmarks.bench_ssh [--json]
+"""
+from vonzy.actions.ssh import Action
+from vonzy.sshpool import SSHConnectionPool, ssh_pool
+
+from .common import bench, report
+from .sshserver import PASSWORD, SSHServer
+
+FAN_OUT = 8
+PIPELINE = ["true"] * 10
+
+
+def run() -> list[dict]:
+    with SSHServer() as server:
+        settings = {
+            "ssh_host": "127.0.0.1",
+            "ssh_port": server.port,
+            "ssh_user": "bench",
+            "ssh_password": PASSWORD,
+        }
+
+        def connect():
+            SSHConnectionPool().acquire(
+                "127.0.0.1", server.port, "bench", password=PASSWORD
+            ).close()
+
+        def action_cycle():
+            action = Action(**settings)
+            action.initialize()
+            action.execute("true")
+            action.cleanup()
+
+        warm = Action(**settings)
+        warm.initialize()
+        fan_out = Action(
+            hosts=[
+                {"name": f"host{i}", "ssh_host": "127.0.0.1", "ssh_port": server.port}
+                for i in range(FAN_OUT)
+            ],
+            ssh_user="bench",
+            ssh_password=PASSWORD,
+            parallel=FAN_OUT,
+        )
+        fan_out.initialize()
+        pipelined = Action(**settings, pipeline=True)
+        pipelined.initialize()
+        try:
+            results = [
+                bench("ssh/connect", connect, number=5, repeat=3),
+                bench("ssh/pooled-action", action_cycle, number=50),
+                bench("ssh/exec", lambda: warm.execute("true"), number=50),
+                bench(
+                    f"ssh/fan-out-{FAN_OUT}",
+                    lambda: fan_out.execute("true"),
+                    number=20,
+                ),
+                bench(
+                    f"ssh/separate-{len(PIPELINE)}",
+                    lambda: [warm.execute(cmd) for cmd in PIPELINE],
+                    number=10,
+                ),
+                bench(
+                    f"ssh/pipeline-{len(PIPELINE)}",
+                    lambda: pipelined.execute(PIPELINE),
+                    number=10,
+                ),
+            ]
+        finally:
+            pipelined.cleanup()
+            warm.cleanup()
+            fan_out.cleanup()
+            ssh_pool.close_all()
+
+    for r in results:
+        r["commands_per_second"] = 1e6 / r["median"]
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,122 @@
+"""
+CLI startup cost, measured with `python -X importtime`.
+
+The import of the CLI is measured against the import of a standard library module in the same run, so
+the tracked baseline in `startup_baseline.json` is a ratio that doesn't depend on the machine.
+Fails (exit code 1) when that ratio got higher than the baseline (plus its tolerance) or when the CLI
+pulls in a module that should only be imported on demand.
+
+Usage: python -m benchmarks.bench_startup [--json] [--update-baseline]
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "startup_baseline.json")
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+PROBE = "import sys, {module}; print(','.join(sorted(sys.modules)), file=sys.stdout)"
+# imported by a fresh interpreter in every round, to scale the CLI import time to the machine
+REFERENCE_MODULE = "asyncio"
+
+
+def measure(module: str = "vonzy.__main__") -> tuple[int, set[str]]:
+    """
+    Import `module` in a fresh interpreter and return its cumulative import time (us) and the loaded modules.
+    """
+
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            PROBE.format(module=module),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = 0
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and match.group(4) == module:
+            cumulative = int(match.group(2))
+    return cumulative, set(proc.stdout.strip().split(","))
+
+
+def run(rounds: int = 7) -> list[dict]:
+    samples = []
+    reference_samples = []
+    modules: set[str] = set()
+    for _ in range(rounds):
+        cumulative, modules = measure()
+        samples.append(cumulative)
+        reference_samples.append(measure(REFERENCE_MODULE)[0])
+
+    median = statistics.median(samples)
+    reference = statistics.median(reference_samples)
+    return [
+        {
+            "name": "startup/import-cli",
+            "unit": "us",
+            "number": 1,
+            "repeat": rounds,
+            "min": min(samples),
+            "median": median,
+            "max": max(samples),
+            "reference": reference,
+            "ratio": median / reference,
+            "modules": sorted(modules),
+        }
+    ]
+
+
+def check(result: dict, baseline: dict) -> list[str]:
+    errors = []
+    limit = baseline["import_ratio"] * (1 + baseline["tolerance"])
+    if result["ratio"] > limit:
+        errors.append(
+            f"CLI import took {result['ratio']:.2f}x the {REFERENCE_MODULE} import, "
+            f"baseline is {baseline['import_ratio']}x (limit {limit:.2f}x)"
+        )
+
+    loaded = set(result["modules"])
+    for module in baseline["lazy_modules"]:
+        if module in loaded:
+            errors.append(f"{module!r} is imported at startup")
+    return errors
+
+
+def main():
+    result = run()[0]
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+
+    if "--update-baseline" in sys.argv:
+        baseline["import_ratio"] = round(result["ratio"], 2)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+
+    errors = check(result, baseline)
+    if "--json" in sys.argv:
+        result = dict(result, errors=errors)
+        result.pop("modules")
+        print(json.dumps([result], indent=2))
+    else:
+        print(
+            f"{result['name']}  median={result['median']:.0f}us  min={result['min']:.0f}us  "
+            f"{REFERENCE_MODULE}={result['reference']:.0f}us  ratio={result['ratio']:.2f}  baseline={baseline['import_ratio']}"
+        )
+        for error in errors:
+            print("FAIL:", error)
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Per-render cost of `render_step_context` and rule evaluation, uncached (the old behaviour) vs cached.
+
+Usage: python -m benchmarks.bench_templates [--json]
+"""
+import string
+from ast import literal_eval
+
+import jinja2
+
+from vonzy.datatype import AttrDict
+from vonzy.results import ResultStore
+from vonzy.schema import StepContext, StepResult
+from vonzy.utils import evaluate_rule, render_step_context
+
+from .common import bench, report
+
+JINJA_TEMPLATE = '{{ "/home/" ~ inputs.user ~ "/" ~ inputs.project if inputs.user != "root" else "/root/" ~ inputs.project }}'
+FORMAT_TEMPLATE = "cd {inputs.project} && echo {env.HOME}"
+RULE = 'steps.upload.result.status == "success" and inputs.user != "root"'
+DEPTH = 50
+DEEP_TEMPLATE = "{steps." + ".".join(f"s{i}" for i in range(DEPTH)) + ".result.status}"
+OLD_RULE_TEMPLATE = "{{ True if $expr else False }}"
+
+
+def make_context() -> StepContext:
+    sc = StepContext(
+        env=AttrDict(HOME="/root", PATH="/usr/bin"),
+        inputs=AttrDict(user="deploy", project="sample1"),
+    )
+    sc.steps = ResultStore()
+    sc.steps.set(("upload",), StepResult.construct(status="success"))
+    path = ()
+    for i in range(DEPTH):
+        path = (*path, f"s{i}")
+        sc.steps.set(path, StepResult.construct(status="success"))
+    return sc
+
+
+def old_render(template: str, sc: StepContext) -> str:
+    if template.startswith("{{") and template.endswith("}}"):
+        return jinja2.Template(template).render(sc.to_context())
+    return template.format(**AttrDict(sc.to_context()))
+
+
+def old_rule(expr: str, sc: StepContext) -> bool:
+    rule_expr = string.Template(OLD_RULE_TEMPLATE).substitute(expr=expr)
+    return literal_eval(jinja2.Template(rule_expr).render(sc.to_context()))
+
+
+def run() -> list[dict]:
+    sc = make_context()
+    return [
+        bench("jinja/uncached", lambda: old_render(JINJA_TEMPLATE, sc), number=200),
+        bench("jinja/cached", lambda: render_step_context(JINJA_TEMPLATE, sc)),
+        bench("format/uncached", lambda: old_render(FORMAT_TEMPLATE, sc)),
+        bench("format/cached", lambda: render_step_context(FORMAT_TEMPLATE, sc)),
+        bench("format/deep-path", lambda: render_step_context(DEEP_TEMPLATE, sc)),
+        bench("rule/uncached", lambda: old_rule(RULE, sc), number=200),
+        bench("rule/compiled", lambda: evaluate_rule(RULE, sc)),
+    ]
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,46 @@
+import json
+import statistics
+import sys
+import time
+import typing
+
+
+def bench(
+    name: str,
+    fn: typing.Callable[[], typing.Any],
+    *,
+    number: int = 1000,
+    repeat: int = 5,
+) -> dict[str, typing.Any]:
+    """
+    Call `fn` `number` times per round, `repeat` rounds, and report the per-call cost in microseconds.
+    """
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+
+    return {
+        "name": name,
+        "unit": "us",
+        "number": number,
+        "repeat": repeat,
+        "min": min(rounds),
+        "median": statistics.median(rounds),
+        "max": max(rounds),
+    }
+
+
+def report(results: list[dict[str, typing.Any]], *, as_json: bool = False):
+    if as_json or "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+        return
+
+    width = max(len(r["name"]) for r in results)
+    for r in results:
+        print(
+            f"{r['name']:<{width}}  median={r['median']:>10.2f}{r['unit']}  min={r['min']:>10.2f}{r['unit']}"
+        )
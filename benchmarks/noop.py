@@ -0,0 +1,34 @@
+"""
+An action that does nothing (or only waits `delay` seconds), to measure the overhead of the engine itself.
+"""
+import asyncio
+import time
+import typing
+
+from vonzy.actions.base import BaseAction
+
+
+class Action(BaseAction):
+    value: typing.Optional[str] = None
+    # simulated I/O wait of every command
+    delay: float = 0
+
+    def initialize(self) -> None:
+        pass
+
+    def cleanup(self):
+        pass
+
+    def execute(self, *args, context=None) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+
+    async def ainitialize(self) -> None:
+        pass
+
+    async def acleanup(self):
+        pass
+
+    async def aexecute(self, *args, context=None) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
@@ -0,0 +1,191 @@
+"""
+A minimal in-process SSH server, a stand-in for a real host in the ssh benchmarks.
+
+It accepts any user with the password `PASSWORD`, runs exec requests with the local shell
+and serves the local filesystem over SFTP.
+"""
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+PASSWORD = "vonzy"
+
+
+class _Server(paramiko.ServerInterface):
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        if password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel: paramiko.Channel, command) -> bool:
+        threading.Thread(
+            target=self._exec, args=(channel, command), daemon=True
+        ).start()
+        return True
+
+    @staticmethod
+    def _exec(channel: paramiko.Channel, command: bytes):
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        for chunk in iter(lambda: process.stdout.read1(65536), b""):
+            channel.sendall(chunk)
+        channel.send_exit_status(process.wait())
+        # only send EOF, the client closes the channel. Closing it here could overtake the reply
+        # to the exec request (sent by the transport thread after `check_channel_exec_request` returns).
+        channel.shutdown_write()
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self.filename, attr)
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+def _sftp_errors(fn):
+    def wrapper(*args):
+        try:
+            return fn(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    return wrapper
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    @_sftp_errors
+    def list_folder(self, path):
+        entries = []
+        for name in os.listdir(path):
+            attr = paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+            attr.filename = name
+            entries.append(attr)
+        return entries
+
+    @_sftp_errors
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    @_sftp_errors
+    def lstat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+
+    @_sftp_errors
+    def open(self, path, flags, attr):
+        fd = os.open(path, flags, 0o666)
+        if flags & os.O_CREAT and attr is not None:
+            attr._flags &= ~attr.FLAG_PERMISSIONS
+            paramiko.SFTPServer.set_file_attr(path, attr)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    @_sftp_errors
+    def remove(self, path):
+        os.remove(path)
+        return paramiko.SFTP_OK
+
+    @_sftp_errors
+    def rename(self, oldpath, newpath):
+        if os.path.exists(newpath):
+            return paramiko.SFTP_FAILURE
+        os.rename(oldpath, newpath)
+        return paramiko.SFTP_OK
+
+    @_sftp_errors
+    def posix_rename(self, oldpath, newpath):
+        os.rename(oldpath, newpath)
+        return paramiko.SFTP_OK
+
+    @_sftp_errors
+    def mkdir(self, path, attr):
+        os.mkdir(path)
+        if attr is not None:
+            paramiko.SFTPServer.set_file_attr(path, attr)
+        return paramiko.SFTP_OK
+
+    @_sftp_errors
+    def rmdir(self, path):
+        os.rmdir(path)
+        return paramiko.SFTP_OK
+
+    @_sftp_errors
+    def chattr(self, path, attr):
+        paramiko.SFTPServer.set_file_attr(path, attr)
+        return paramiko.SFTP_OK
+
+
+class SSHServer:
+    """
+    Listens on 127.0.0.1 (a random port unless `port` is given) in a daemon thread.
+    """
+
+    def __init__(self, port: int = 0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", port))
+        self._transports: list[paramiko.Transport] = []
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self) -> "SSHServer":
+        self._socket.listen(128)
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPServer)
+            transport.start_server(server=_Server())
+            self._transports.append(transport)
+
+    def stop(self):
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def __enter__(self) -> "SSHServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# keep the caches and journals of the tests out of the user's cache directory
+os.environ.setdefault("VONZY_CACHE_DIR", tempfile.mkdtemp(prefix="vonzy-tests-"))
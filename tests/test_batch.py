@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import textwrap
+import unittest
+
+from typer.testing import CliRunner
+
+from vonzy.__main__ import app
+
+WORKFLOW = """
+name: batch
+inputs:
+  - key: tenant
+    description: Tenant
+    type: text
+  - key: token
+    description: API token
+    type: password
+steps:
+  - id: hello
+    name: Hello
+    use:
+      name: vonzy.actions.python
+      params:
+        function: os.getcwd
+"""
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.workflow = os.path.join(tmpdir.name, "workflow.yml")
+        with open(self.workflow, "w") as f:
+            f.write(textwrap.dedent(WORKFLOW))
+        self.input_file = os.path.join(tmpdir.name, "inputs.jsonl")
+
+    def run_batch(self, *input_sets: dict):
+        with open(self.input_file, "w") as f:
+            for values in input_sets:
+                f.write(json.dumps(values) + "\n")
+        return CliRunner().invoke(
+            app, ["-c", self.workflow, "run-batch", self.input_file, "--no-cache"]
+        )
+
+    def test_password_inputs_are_masked(self):
+        result = self.run_batch(
+            {"tenant": "acme", "token": "hunter2"},
+            {"tenant": "initech", "token": "swordfish"},
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("tenant=acme", result.output)
+        self.assertIn("token=***", result.output)
+        self.assertNotIn("hunter2", result.output)
+        self.assertNotIn("swordfish", result.output)
+
+    def test_failed_instance_does_not_show_password(self):
+        result = self.run_batch({"tenant": "acme", "token": "hunter2", "other": 1})
+
+        self.assertEqual(result.exit_code, 1, result.output)
+        self.assertIn("Unknown inputs other", result.output)
+        self.assertNotIn("hunter2", result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import textwrap
+import unittest
+
+from vonzy.cache import StepCache
+from vonzy.schema import Workflow
+
+WORKFLOW = """
+name: cache
+steps:
+  - id: build
+    name: Build
+    cache: {}
+    use:
+      name: vonzy.actions.python
+      params:
+        function: os.getcwd
+  - id: deploy
+    name: Deploy
+    rule: 'steps.build.result.status == "success"'
+    use:
+      name: vonzy.actions.python
+      params:
+        function: os.getcwd
+"""
+
+
+class StepCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache = StepCache(os.path.join(self.tmpdir, "steps"))
+
+    def load(self, name: str) -> Workflow:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(textwrap.dedent(WORKFLOW))
+        with open(path, "rb") as f:
+            return Workflow.parse_config(f, use_cache=False)
+
+    def run_workflow(self, workflow: Workflow) -> dict:
+        results = workflow.run(cache=self.cache, inputs={}, raise_errors=True)
+        return {result.step.id: result for result in results if result is not None}
+
+    def test_step_depending_on_cached_step_runs(self):
+        workflow = self.load("workflow.yml")
+
+        first = self.run_workflow(workflow)
+        second = self.run_workflow(workflow)
+
+        self.assertFalse(first["build"].cached)
+        self.assertEqual(second["build"].status, "success")
+        self.assertTrue(second["build"].cached)
+        self.assertEqual(second["build"].value, os.getcwd())
+        self.assertEqual(second["deploy"].status, "success")
+
+    def test_workflows_do_not_share_entries(self):
+        self.run_workflow(self.load("first.yml"))
+        results = self.run_workflow(self.load("second.yml"))
+
+        self.assertEqual(results["build"].status, "success")
+        self.assertFalse(results["build"].cached)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from vonzy.constants import OUTPUT_BUFFER_SIZE, OUTPUT_TAIL_SIZE
+from vonzy.schema import Workflow
+
+STEPS = 40
+# every step prints more than fits in memory, so its output goes to a temporary file
+OUTPUT_SIZE = OUTPUT_BUFFER_SIZE + 64 * 1024
+
+STEP = """
+  - id: step{idx}
+    name: Step {idx}
+    use:
+      name: vonzy.actions.shell
+      params:
+        backend: subprocess
+    commands:
+      - yes | head -c {size}
+"""
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+@unittest.skipUnless(os.path.isdir("/proc/self/fd"), "needs /proc")
+class OutputBufferTest(unittest.TestCase):
+    def test_finished_steps_do_not_keep_files_open(self):
+        steps = "".join(STEP.format(idx=idx, size=OUTPUT_SIZE) for idx in range(STEPS))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "workflow.yml")
+            with open(path, "w") as f:
+                f.write("name: output\nsteps:" + steps)
+            with open(path, "rb") as f:
+                workflow = Workflow.parse_config(f, use_cache=False)
+
+        async def run():
+            return [result async for result in workflow.arun(inputs={})]
+
+        before = open_fds()
+        results = [result for result in asyncio.run(run()) if result is not None]
+        after = open_fds()
+
+        self.assertEqual(len(results), STEPS)
+        self.assertLess(after - before, 10)
+        for result in results:
+            self.assertEqual(result.status, "success")
+            self.assertTrue(result.output.spilled)
+            self.assertLessEqual(len(result.output._memory), OUTPUT_TAIL_SIZE)
+        # the whole output is still there, read back from the file
+        self.assertEqual(len(results[-1].stdout), OUTPUT_SIZE)
+        self.assertEqual(results[-1].output.tail(10), "y\n" * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
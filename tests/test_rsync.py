@@ -0,0 +1,49 @@
+import unittest
+
+from vonzy.actions.rsync import STATS_PATTERNS, parse_stats
+
+# `rsync --stats --no-human-readable` output of two shards
+SHARDS = [
+    """
+Number of files: 1235 (reg: 1200, dir: 35)
+Number of created files: 0
+Number of regular files transferred: 1200
+Total file size: 2345678901 bytes
+Total transferred file size: 2345678901 bytes
+Total bytes sent: 2346012345
+Total bytes received: 23456
+""",
+    """
+Number of files: 1 (reg: 1)
+Number of regular files transferred: 1
+Total transferred file size: 1024 bytes
+Total bytes sent: 1180
+""",
+]
+
+
+class RsyncStatsTest(unittest.TestCase):
+    def test_stats_are_summed(self):
+        stats = {key: 0 for key in STATS_PATTERNS}
+        for output in SHARDS:
+            for line in output.splitlines(keepends=True):
+                parse_stats(line, stats)
+
+        self.assertEqual(
+            stats,
+            {
+                "files": 1201,
+                "files_transferred": 1201,
+                "bytes_transferred": 2345679925,
+                "bytes_sent": 2346013525,
+            },
+        )
+
+    def test_thousands_separators(self):
+        stats = {key: 0 for key in STATS_PATTERNS}
+        parse_stats("Total bytes sent: 1,234,567\n", stats)
+        self.assertEqual(stats["bytes_sent"], 1234567)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import stat
+import tempfile
+import unittest
+
+from vonzy.server import Server
+
+
+class ServerTest(unittest.TestCase):
+    def test_socket_is_private(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            server = Server(os.path.join(tmpdir, "vonzy.sock"))
+
+            async def check():
+                task = asyncio.create_task(server.serve())
+                while not os.path.exists(server.socket_path):
+                    await asyncio.sleep(0.01)
+                mode = os.stat(server.socket_path).st_mode
+                server._stopped.set()
+                await task
+                return mode
+
+            umask = os.umask(0o022)
+            try:
+                mode = asyncio.run(check())
+                self.assertEqual(os.umask(0o022), 0o022)
+            finally:
+                os.umask(umask)
+
+        self.assertTrue(stat.S_ISSOCK(mode))
+        self.assertEqual(stat.S_IMODE(mode) & 0o077, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
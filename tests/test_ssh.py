@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from vonzy.actions.ssh import Action, load_inventory
+
+
+class InventoryTest(unittest.TestCase):
+    def write(self, content: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=".yml")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        return path
+
+    def test_duplicate_labels_are_rejected(self):
+        path = self.write("- web1\n- ssh_host: web1\n  ssh_port: 2222\n")
+        with self.assertRaisesRegex(RuntimeError, "Duplicate host 'web1'"):
+            load_inventory(path)
+
+    def test_duplicate_labels_across_sources_are_rejected(self):
+        path = self.write("- web1\n")
+        action = Action(hosts=["web1"], inventory=path)
+        with self.assertRaisesRegex(RuntimeError, "Duplicate host 'web1'"):
+            action.get_hosts()
+
+    def test_named_hosts_and_hidden_address(self):
+        path = self.write("- web1\n- name: web1-admin\n  ssh_host: web1\n")
+        hosts = load_inventory(path)
+
+        self.assertEqual([host.label for host in hosts], ["web1", "web1-admin"])
+        self.assertNotIn("web1", repr(hosts[1]).replace("web1-admin", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
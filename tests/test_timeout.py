@@ -0,0 +1,48 @@
+import asyncio
+import os
+import tempfile
+import textwrap
+import time
+import unittest
+
+from vonzy.schema import Workflow
+
+WORKFLOW = """
+name: timeout
+steps:
+  - id: slow
+    name: Slow
+    timeout: 1
+    use:
+      name: vonzy.actions.shell
+      params:
+        backend: pty
+    commands:
+      - sleep 30
+"""
+
+
+class StepTimeoutTest(unittest.TestCase):
+    def test_blocking_shell_step_times_out(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "workflow.yml")
+            with open(path, "w") as f:
+                f.write(textwrap.dedent(WORKFLOW))
+            with open(path, "rb") as f:
+                workflow = Workflow.parse_config(f, use_cache=False)
+
+        async def run():
+            return [result async for result in workflow.arun(inputs={})]
+
+        start = time.monotonic()
+        results = asyncio.run(run())
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 3)
+        [result] = [r for r in results if r is not None]
+        self.assertEqual(result.status, "error")
+        self.assertIsInstance(result.value, TimeoutError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+
+from vonzy.schema import Workflow
+from vonzy.watch import WatchPlan, watch
+
+WORKFLOW = """
+name: watch
+steps:
+  - id: build
+    name: Build
+    watch:
+      - {src}/**
+    use:
+      name: vonzy.actions.python
+      params:
+        function: os.getcwd
+  - id: deploy
+    name: Deploy
+    rule: 'steps.build.result.status == "success"'
+    use:
+      name: vonzy.actions.python
+      params:
+        function: os.getcwd
+"""
+
+
+class Stop(Exception):
+    pass
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.src = os.path.join(tmpdir.name, "src")
+        os.mkdir(self.src)
+        path = os.path.join(tmpdir.name, "workflow.yml")
+        with open(path, "w") as f:
+            f.write(textwrap.dedent(WORKFLOW).format(src=self.src))
+        with open(path, "rb") as f:
+            self.workflow = Workflow.parse_config(f, use_cache=False)
+
+    def test_rule_references_are_dependents(self):
+        plan = WatchPlan(self.workflow.steps, self.workflow.dependency_graph())
+
+        changed = {os.path.join(self.src, "main.c")}
+        self.assertEqual(plan.affected(changed), ["build", "deploy"])
+
+    def test_changes_made_by_the_run_are_ignored(self):
+        cycles = []
+
+        def run(workflow, step_ids, context):
+            cycles.append((time.monotonic(), step_ids))
+            if len(cycles) > 1:
+                raise Stop()
+            # eg. a build output under the watched directory
+            with open(os.path.join(self.src, "output.o"), "w") as f:
+                f.write("built")
+
+        def edit():
+            with open(os.path.join(self.src, "main.c"), "w") as f:
+                f.write("int main;")
+
+        timer = threading.Timer(0.5, edit)
+        start = time.monotonic()
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with self.assertRaises(Stop):
+            watch(self.workflow, run=run, debounce=0.05)
+
+        self.assertEqual(cycles[0][1], None)
+        # rerun for the edit, not for the file written by the first run
+        self.assertGreaterEqual(cycles[1][0] - start, 0.5)
+        self.assertEqual(cycles[1][1], ["build", "deploy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
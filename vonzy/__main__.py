@@ -1,11 +1,16 @@
 import functools
+import time
 import typing
 
 from click import Context as ClickContext
-from rich import print, tree
-from typer import Context, FileText, Option, Typer
+from rich import print
+from typer import Argument, Context, Exit, FileText, Option, Typer
 
-from .schema import Step, Workflow
+from .constants import BATCH_WORKERS, LOG_CONSOLE, LOG_FILE, WATCH_DEBOUNCE
+from .logger import setup_logging
+
+if typing.TYPE_CHECKING:
+    from .schema import Step, Workflow
 
 try:
     from dotenv import load_dotenv
@@ -28,6 +33,8 @@ def required_workflow(fn):
                 ctx = value
                 break
         if isinstance(ctx, ClickContext):
+            from .schema import Workflow
+
             workflow = ctx.obj
             if not isinstance(workflow, Workflow):
                 print(
@@ -43,12 +50,30 @@ def required_workflow(fn):
 def main(
     ctx: Context,
     config: FileText = Option(None, "-c", "--config", help="Configuration file"),
+    log_file: typing.Optional[str] = Option(
+        LOG_FILE,
+        "--log-file",
+        help="Also write the logs to this file as JSON lines [env: VONZY_LOG_FILE]",
+    ),
+    console_log: bool = Option(
+        LOG_CONSOLE,
+        "--console-log/--no-console-log",
+        help="Show the logs in the console [env: VONZY_LOG_CONSOLE=0 to disable]",
+    ),
 ):
+    if log_file or not console_log:
+        setup_logging(console=console_log, log_file=log_file)
     if not config:
         return
 
+    from .schema import Workflow
+
+    setup_logging(console=console_log, log_file=log_file)
     try:
+        start = time.perf_counter_ns()
         workflow = Workflow.parse_config(config)
+        # tracing is enabled later by `run --trace`, keep the timing of the workflow loading for it.
+        ctx.meta["vonzy.load_ns"] = (start, time.perf_counter_ns())
         ctx.obj = workflow
     except Exception as e:
         print("Error:", e)
@@ -71,6 +96,49 @@ def run(
         "--env",
         help="Environment variables file (dotenv format)",
     ),
+    jobs: typing.Optional[int] = Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Maximum number of steps to run concurrently [default: 1, unlimited with --async]",
+    ),
+    use_async: bool = Option(
+        False,
+        "--async",
+        help="Run the steps with the asyncio engine (enforces the step timeouts)",
+    ),
+    no_cache: bool = Option(
+        False,
+        "--no-cache",
+        help="Run every step, ignoring and not updating the step cache",
+    ),
+    refresh: bool = Option(
+        False,
+        "--refresh",
+        help="Run every step and replace its cached result",
+    ),
+    trace: typing.Optional[str] = Option(
+        None,
+        "--trace",
+        help="Write a Chrome trace-event JSON file with the timing of the run",
+    ),
+    resume: typing.Optional[str] = Option(
+        None,
+        "--resume",
+        help="Resume a run (its id, or 'last'), the steps that completed in it don't run again",
+    ),
+    no_journal: bool = Option(
+        False,
+        "--no-journal",
+        help="Don't record the step results of the run (it can't be resumed)",
+    ),
+    with_deps: bool = Option(
+        False,
+        "-d",
+        "--with-deps",
+        help="Also run the steps that the steps selected with '-s' depend on",
+    ),
 ):
     """
     Run workflow
@@ -85,8 +153,368 @@ def run(
     for f in env_file:
         load_dotenv(f, override=True)
 
-    workflow: Workflow = ctx.obj
-    list(workflow.run(step_ids=step_ids))
+    from .cache import StepCache
+    from .errors import InvalidJournal
+    from .journal import RunJournal
+
+    workflow: "Workflow" = ctx.obj
+    if step_ids and with_deps:
+        step_ids = workflow.dependency_graph().closure(step_ids)
+
+    journal = None
+    if resume:
+        run_id = resume
+        if resume == "last":
+            run_id = RunJournal.latest(workflow._source_file)
+            if run_id is None:
+                print(f"Error: no previous run of {workflow._source_file!r}")
+                ctx.abort()
+        try:
+            journal = RunJournal.load(run_id)
+        except InvalidJournal as e:
+            print("Error:", e)
+            ctx.abort()
+    elif not no_journal:
+        journal = RunJournal.create()
+
+    if trace:
+        from .tracing import tracer
+
+        tracer.enable()
+        tracer.add(
+            "workflow.load", *ctx.meta["vonzy.load_ns"], source=workflow._source_file
+        )
+
+    cache = None if no_cache else StepCache(refresh=refresh)
+    completed = False
+    try:
+        if use_async:
+            import asyncio
+
+            async def consume():
+                async for _ in workflow.arun(
+                    step_ids=step_ids or None, jobs=jobs, cache=cache, journal=journal
+                ):
+                    pass
+
+            try:
+                asyncio.run(consume())
+            except KeyboardInterrupt:
+                pass
+        else:
+            list(
+                workflow.run(
+                    step_ids=step_ids or None,
+                    jobs=jobs or 1,
+                    cache=cache,
+                    journal=journal,
+                )
+            )
+        completed = journal is None or journal.completed(
+            step_ids or [step.id for step in workflow.steps]
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+            if not completed and journal.header is not None:
+                print(
+                    f"Run {journal.run_id!r} did not complete, continue it with `run --resume {journal.run_id}`"
+                )
+        if trace:
+            tracer.export(trace)
+            print(f"Trace written to {trace!r}")
+
+
+@app.command("run-batch")
+@required_workflow
+def run_batch(
+    ctx: Context,
+    input_file: str = Argument(
+        ..., help="Input sets, a CSV file with a header line or a JSON-lines file"
+    ),
+    step_ids: typing.Optional[list[str]] = Option(
+        None,
+        "-s",
+        "--step",
+        help="Step IDs to run",
+    ),
+    env_file: typing.Optional[list[str]] = Option(
+        None,
+        "-e",
+        "--env",
+        help="Environment variables file (dotenv format)",
+    ),
+    workers: int = Option(
+        BATCH_WORKERS,
+        "-w",
+        "--workers",
+        min=1,
+        help="Number of workflow instances running at the same time",
+    ),
+    no_cache: bool = Option(
+        False,
+        "--no-cache",
+        help="Run every step, ignoring and not updating the step cache",
+    ),
+):
+    """
+    Run the workflow once for every set of inputs of INPUT_FILE, without prompting
+    """
+
+    if load_dotenv is None and env_file:
+        print(
+            f"Error: you used the '-e' option but you haven't installed the python-dotenv module."
+        )
+        ctx.abort()
+
+    for f in env_file:
+        load_dotenv(f, override=True)
+
+    from rich.table import Table
+
+    from .batch import read_input_sets
+    from .batch import run_batch as run_instances
+    from .cache import StepCache
+    from .errors import InvalidInput
+
+    workflow: "Workflow" = ctx.obj
+    try:
+        input_sets = read_input_sets(input_file)
+    except (OSError, InvalidInput) as e:
+        print("Error:", e)
+        ctx.abort()
+
+    cache = None if no_cache else StepCache()
+    start = time.perf_counter()
+    summaries = sorted(
+        run_instances(
+            workflow,
+            input_sets,
+            workers=workers,
+            step_ids=step_ids or None,
+            cache=cache,
+        ),
+        key=lambda summary: summary.index,
+    )
+    elapsed = time.perf_counter() - start
+
+    table = Table(title=f"{workflow.name!r}: {len(summaries)} instances")
+    for column in ("#", "inputs", "status", "steps", "duration"):
+        table.add_column(column)
+    for summary in summaries:
+        inputs = ", ".join(
+            f"{k}={v}" for k, v in workflow.mask_inputs(summary.inputs).items()
+        )
+        steps = ", ".join(
+            f"{n} {status}" for status, n in sorted(summary.statuses.items())
+        )
+        status = (
+            "[green]ok[/green]"
+            if summary.ok
+            else f"[red]{summary.error or 'failed'}[/red]"
+        )
+        table.add_row(
+            str(summary.index), inputs, status, steps, f"{summary.duration:.2f}s"
+        )
+    print(table)
+
+    failed = sum(not summary.ok for summary in summaries)
+    rate = len(summaries) / elapsed if elapsed else 0.0
+    print(
+        f"{len(summaries)} instances in {elapsed:.2f}s ({rate:.2f}/s) with {workers} workers, {failed} failed"
+    )
+    if failed:
+        raise Exit(1)
+
+
+@app.command()
+@required_workflow
+def plan(
+    ctx: Context,
+    step_ids: typing.Optional[list[str]] = Option(
+        None,
+        "-s",
+        "--step",
+        help="Step IDs to run",
+    ),
+    with_deps: bool = Option(
+        False,
+        "-d",
+        "--with-deps",
+        help="Also run the steps that the steps selected with '-s' depend on",
+    ),
+):
+    """
+    Show the steps that would run, their dependencies and the values their templates and rules use
+    """
+
+    from rich import tree
+
+    workflow: "Workflow" = ctx.obj
+    graph = workflow.dependency_graph()
+    if step_ids and with_deps:
+        step_ids = graph.closure(step_ids)
+    selected = set(step_ids or graph.analyses)
+
+    from .scheduler import topological_order
+
+    ordered = topological_order(workflow.steps)
+    skipped = [step.id for step in ordered if step.id not in selected]
+    comp = tree.Tree(
+        f"Plan of the {workflow.name!r} workflow: {len(ordered) - len(skipped)} steps to run, {len(skipped)} skipped"
+    )
+    for step in ordered:
+        analysis = graph.analyses[step.id]
+        if step.id in selected:
+            label = f"[bold]{step.id}[/bold] {step.name!r}"
+        else:
+            label = f"[dim]{step.id} {step.name!r} (skipped, not selected)[/dim]"
+        node = comp.add(label)
+        if step.needs:
+            node.add(f"needs: {', '.join(step.needs)}")
+        uses = sorted(analysis.uses - set(step.needs))
+        if uses:
+            node.add(f"uses the results of: {', '.join(uses)}")
+        for root in ("inputs", "env"):
+            keys = sorted(
+                {
+                    ref[1]
+                    for ref in analysis.references
+                    if ref[0] == root and len(ref) > 1
+                }
+            )
+            if keys:
+                node.add(f"{root}: {', '.join(keys)}")
+        if step.rule:
+            node.add(f"runs if: {step.rule}")
+        if step.steps:
+            node.add(f"{len(step.steps)} child steps")
+
+    print(comp)
+    for warning in graph.warnings():
+        print(f"[yellow]Warning:[/yellow] {warning}")
+
+
+@app.command()
+@required_workflow
+def watch(
+    ctx: Context,
+    step_ids: typing.Optional[list[str]] = Option(
+        None,
+        "-s",
+        "--step",
+        help="Step IDs to run",
+    ),
+    env_file: typing.Optional[list[str]] = Option(
+        None,
+        "-e",
+        "--env",
+        help="Environment variables file (dotenv format)",
+    ),
+    jobs: typing.Optional[int] = Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Maximum number of steps to run concurrently [default: 1, unlimited with --async]",
+    ),
+    use_async: bool = Option(
+        False,
+        "--async",
+        help="Run the steps with the asyncio engine (enforces the step timeouts)",
+    ),
+    no_cache: bool = Option(
+        False,
+        "--no-cache",
+        help="Run every step, ignoring and not updating the step cache",
+    ),
+    debounce: float = Option(
+        WATCH_DEBOUNCE,
+        "--debounce",
+        min=0,
+        help="Seconds without changes before the affected steps rerun",
+    ),
+    poll: bool = Option(
+        False,
+        "--poll",
+        help="Poll the files instead of using inotify",
+    ),
+):
+    """
+    Run the workflow, then rerun the steps whose `watch` paths change (and the steps that need them)
+    """
+
+    if load_dotenv is None and env_file:
+        print(
+            f"Error: you used the '-e' option but you haven't installed the python-dotenv module."
+        )
+        ctx.abort()
+
+    for f in env_file:
+        load_dotenv(f, override=True)
+
+    from .cache import StepCache
+    from .watch import watch as watch_workflow
+
+    cache = None if no_cache else StepCache()
+
+    def run_cycle(workflow: "Workflow", ids: typing.Optional[list[str]], context):
+        if use_async:
+            import asyncio
+
+            async def consume():
+                async for _ in workflow.arun(
+                    step_ids=ids, jobs=jobs, cache=cache, context=context
+                ):
+                    pass
+
+            asyncio.run(consume())
+        else:
+            list(
+                workflow.run(step_ids=ids, jobs=jobs or 1, cache=cache, context=context)
+            )
+
+    try:
+        watch_workflow(
+            ctx.obj, step_ids or None, run=run_cycle, debounce=debounce, polling=poll
+        )
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        print("Error:", e)
+        ctx.abort()
+
+
+@app.command()
+def serve(
+    ctx: Context,
+    socket_path: typing.Optional[str] = Option(
+        None,
+        "--socket",
+        help="Unix socket to listen on [default: $VONZY_SOCKET or $XDG_RUNTIME_DIR/vonzy.sock]",
+    ),
+):
+    """
+    Keep workflows, actions and connections warm and run workflows for `vonzy-client`
+    """
+
+    import asyncio
+
+    from .constants import SOCKET_PATH
+    from .server import Server
+
+    server = Server(socket_path or SOCKET_PATH)
+    if ctx.obj is not None:
+        # the workflow given with `-c` is ready before the first request
+        server.add_workflow(ctx.obj)
+
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print("Error:", e)
+        ctx.abort()
 
 
 @app.command()
@@ -98,10 +526,12 @@ def steps(
     Show workflow steps
     """
 
-    workflow: Workflow = ctx.obj
+    from rich import tree
+
+    workflow: "Workflow" = ctx.obj
     comp = tree.Tree(f"List of steps in the {workflow.name!r} workflow")
 
-    def _add_to_root(tr: tree.Tree, label: str, children: list[Step]):
+    def _add_to_root(tr: tree.Tree, label: str, children: list["Step"]):
         r = tr.add(label)
         for c in children:
             _add_to_root(r, c.name, c.steps)
@@ -117,3 +547,7 @@ def steps(
         print(comp)
     else:
         print(f"0 steps found in {workflow._source_file!r}")
+
+
+if __name__ == "__main__":
+    app()
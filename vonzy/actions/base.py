@@ -1,13 +1,76 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
 import typing
+import uuid
 from abc import ABC, abstractmethod
 
 from pydantic import BaseModel
 
 if typing.TYPE_CHECKING:
+    from vonzy.output import OutputBuffer
     from vonzy.schema import StepContext
 
 T = typing.TypeVar("T")
 
+# token of the step tree (a top-level step and its child steps, in one run) the running action belongs to,
+# the state actions share between the steps of a tree (eg. named shell sessions) is keyed by it
+step_tree: contextvars.ContextVar[typing.Optional[str]] = contextvars.ContextVar(
+    "vonzy_step_tree", default=None
+)
+# called with the token when a step tree finishes, see `on_step_tree_end`
+_tree_end_callbacks: list[typing.Callable[[str], None]] = []
+
+
+def on_step_tree_end(fn: typing.Callable[[str], None]) -> typing.Callable[[str], None]:
+    """
+    Register `fn` to release the state of a step tree when it finishes.
+    """
+
+    _tree_end_callbacks.append(fn)
+    return fn
+
+
+@contextlib.contextmanager
+def step_tree_scope() -> typing.Iterator[str]:
+    """
+    Run a step tree: the actions see a new `step_tree` token until the block exits.
+    """
+
+    token = uuid.uuid4().hex
+    previous = step_tree.get()
+    step_tree.set(token)
+    try:
+        yield token
+    finally:
+        step_tree.set(previous)
+        for fn in _tree_end_callbacks:
+            fn(token)
+
+
+async def run_in_thread(
+    fn: typing.Callable[[], T],
+    *,
+    abort: typing.Optional[typing.Callable[[], None]] = None
+) -> T:
+    """
+    Run `fn` in a worker thread. A thread can't be cancelled: when the task is (eg. by `Step.timeout`),
+    `abort` is called to make the blocking call of `fn` fail and the cancellation is raised once `fn` returned.
+    """
+
+    future = asyncio.ensure_future(asyncio.to_thread(fn))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if abort is not None and not future.done():
+            abort()
+        await asyncio.wait([future])
+        if not future.cancelled():
+            # retrieved so it isn't reported as unhandled, the cancellation wins
+            future.exception()
+        raise
+
 
 class BaseAction(ABC, BaseModel):
     @abstractmethod
@@ -24,6 +87,50 @@ class BaseAction(ABC, BaseModel):
     ) -> None:
         pass
 
+    # The async engine (`Workflow.arun`) calls the `a*` methods. By default they run the blocking methods
+    # in a worker thread (see `run_in_thread`), actions doing their I/O with asyncio override them.
+
+    async def ainitialize(self) -> None:
+        await run_in_thread(self.initialize, abort=self.abort)
+
+    async def acleanup(self):
+        return await run_in_thread(self.cleanup)
+
+    async def aexecute(
+        self, *args, context: typing.Optional[dict[typing.Any, typing.Any]] = None
+    ) -> None:
+        return await run_in_thread(
+            functools.partial(self.execute, *args, context=context), abort=self.abort
+        )
+
+    def abort(self):
+        """
+        Make the blocking call running in a worker thread (`initialize` or `execute`) fail soon,
+        eg. by closing its process or channel. Called from the event loop when the step times out
+        or is cancelled, `cleanup` runs once the call returned.
+        """
+
+    def get_result(self) -> typing.Any:
+        """
+        Value stored in `StepResult.value` after the action finished successfully.
+        """
+
+        return None
+
+    def get_output(self) -> typing.Optional["OutputBuffer"]:
+        """
+        Output captured while the action ran, exposed as `StepResult.stdout`.
+        """
+
+        return None
+
+    def get_exit_code(self) -> typing.Optional[int]:
+        """
+        Exit code of the last command, exposed as `StepResult.exit_code`.
+        """
+
+        return None
+
     def handle_commands(
         self, commands: T, *, context: typing.Optional["StepContext"] = None
     ) -> T:
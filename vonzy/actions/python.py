@@ -0,0 +1,267 @@
+import asyncio
+import atexit
+import functools
+import inspect
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from importlib import import_module
+
+from pydantic import Field, PrivateAttr, validator
+
+from ..constants import PYTHON_POOL_SIZE
+from ..logger import log
+from .base import BaseAction
+
+if typing.TYPE_CHECKING:
+    from ..schema import StepContext
+
+
+def load_function(path: str) -> typing.Callable:
+    """
+    Import a function from its dotted path, `package.module:function` or `package.module.function`.
+    """
+
+    if ":" in path:
+        module_name, _, attr = path.partition(":")
+    else:
+        module_name, _, attr = path.rpartition(".")
+
+    if not module_name or not attr:
+        raise RuntimeError(f"{__name__}: Invalid function path {path!r}")
+
+    obj: typing.Any = import_module(module_name)
+    for name in attr.split("."):
+        obj = getattr(obj, name)
+
+    if not callable(obj):
+        raise RuntimeError(f"{__name__}: {path!r} is not callable")
+    return obj
+
+
+def accepts_context(fn: typing.Callable) -> bool:
+    try:
+        parameters = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        p.name == "context" or p.kind == inspect.Parameter.VAR_KEYWORD
+        for p in parameters
+    )
+
+
+def call_function(path: str, args: list, kwargs: dict) -> typing.Any:
+    """
+    Call the function at `path`, coroutine functions are run to completion.
+    This is what the worker processes run, so everything it gets and returns must be picklable.
+    """
+
+    rv = load_function(path)(*args, **kwargs)
+    if inspect.isawaitable(rv):
+        rv = asyncio.run(_await(rv))
+    return rv
+
+
+async def _await(awaitable: typing.Awaitable) -> typing.Any:
+    return await awaitable
+
+
+def context_snapshot(context: "StepContext") -> dict[str, typing.Any]:
+    """
+    A picklable copy of the step context for the worker processes: the environment, the inputs and the
+    status, value and exit code of the steps that already ran (eg. `context["steps"]["build"]["result"]["value"]`).
+    """
+
+    def steps(view) -> dict[str, typing.Any]:
+        data = {}
+        for key in view:
+            child = view[key]
+            result = child.result
+            data[key] = steps(child)
+            data[key]["result"] = {
+                "status": result.status,
+                "value": result.value,
+                "exit_code": result.exit_code,
+            }
+        return data
+
+    ctx = context.to_context()
+    return {
+        "env": dict(ctx["env"] or {}),
+        "inputs": dict(ctx["inputs"] or {}),
+        "steps": steps(ctx["steps"]) if ctx["steps"] is not None else {},
+    }
+
+
+class ExecutorPool:
+    """
+    Process-wide thread and process pools shared by the python actions.
+    The pools are created on first use and kept until exit, so the worker processes are reused between steps.
+    """
+
+    def __init__(self, *, max_workers: typing.Optional[int] = PYTHON_POOL_SIZE):
+        self.max_workers = max_workers
+        self._threads: typing.Optional[ThreadPoolExecutor] = None
+        self._processes: typing.Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get(self, kind: str) -> Executor:
+        with self._lock:
+            if kind == "thread":
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="vonzy-python"
+                    )
+                return self._threads
+
+            if self._processes is None:
+                # the workers are started by a fork server instead of forking this (multi-threaded) process
+                methods = multiprocessing.get_all_start_methods()
+                method = "forkserver" if "forkserver" in methods else "spawn"
+                log.debug("Starting the python process pool (%s)", method)
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+            return self._processes
+
+    def discard(self, pool: Executor):
+        """
+        Forget a pool that can't be used anymore (eg. a worker process died), the next `get` creates a new one.
+        """
+
+        with self._lock:
+            if pool is self._processes:
+                self._processes = None
+            elif pool is self._threads:
+                self._threads = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            pools = [self._threads, self._processes]
+            self._threads = self._processes = None
+
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+
+executor_pool = ExecutorPool()
+atexit.register(executor_pool.shutdown)
+
+
+class Action(BaseAction):
+    # eg. `mypackage.tasks:build` or `mypackage.tasks.build`
+    function: str
+    args: list[typing.Any] = Field(default_factory=list)
+    kwargs: dict[str, typing.Any] = Field(default_factory=dict)
+    # `inline` calls the function in the step, `thread` and `process` in a shared pool (see `ExecutorPool`).
+    # In the `process` pool the arguments and the return value must be picklable and the function gets
+    # a snapshot of the step context (see `context_snapshot`).
+    executor: typing.Literal["inline", "thread", "process"] = "inline"
+
+    _function: typing.Optional[typing.Callable] = PrivateAttr(None)
+    _result: typing.Any = PrivateAttr(None)
+
+    @validator("function")
+    def _validate_function(cls, v: str):
+        if ":" not in v and "." not in v:
+            raise ValueError("expected a dotted path, eg. 'package.module:function'")
+        return v
+
+    def initialize(self) -> None:
+        # fail before running anything if the function can't be imported
+        self._function = load_function(self.function)
+
+    def cleanup(self):
+        pass
+
+    def get_result(self) -> typing.Any:
+        return self._result
+
+    def handle_commands(
+        self,
+        commands: list[typing.Any],
+        *,
+        context: typing.Optional["StepContext"] = None,
+    ) -> list[str]:
+        if commands:
+            raise RuntimeError(
+                f"{__name__}: commands are not supported, use 'args' and 'kwargs'"
+            )
+        # the function call is the only "command" of the step
+        return [self.function]
+
+    def _prepare_call(
+        self, context: typing.Optional["StepContext"]
+    ) -> tuple[list[typing.Any], dict[str, typing.Any]]:
+        kwargs = dict(self.kwargs)
+        if (
+            context is not None
+            and "context" not in kwargs
+            and accepts_context(self._function)
+        ):
+            if self.executor == "process":
+                kwargs["context"] = context_snapshot(context)
+            else:
+                kwargs["context"] = context
+        return list(self.args), kwargs
+
+    def execute(
+        self, cmd: str, *, context: typing.Optional["StepContext"] = None
+    ) -> typing.Any:
+        args, kwargs = self._prepare_call(context)
+        log.debug("Calling %r (%s)", self.function, self.executor)
+        if self.executor == "inline":
+            self._result = self._function(*args, **kwargs)
+            if inspect.isawaitable(self._result):
+                self._result = asyncio.run(_await(self._result))
+        else:
+            pool = executor_pool.get(self.executor)
+            try:
+                self._result = pool.submit(
+                    call_function, self.function, args, kwargs
+                ).result()
+            except BrokenExecutor:
+                executor_pool.discard(pool)
+                raise
+        return self._result
+
+    async def ainitialize(self) -> None:
+        self.initialize()
+
+    async def acleanup(self):
+        pass
+
+    async def aexecute(
+        self, cmd: str, *, context: typing.Optional["StepContext"] = None
+    ) -> typing.Any:
+        args, kwargs = self._prepare_call(context)
+        log.debug("Calling %r (%s)", self.function, self.executor)
+        if self.executor == "inline":
+            # coroutine functions run on the event loop, the others in a thread so they don't block it
+            if inspect.iscoroutinefunction(self._function):
+                rv = self._function(*args, **kwargs)
+            else:
+                rv = await asyncio.to_thread(self._function, *args, **kwargs)
+            if inspect.isawaitable(rv):
+                rv = await rv
+            self._result = rv
+        else:
+            loop = asyncio.get_running_loop()
+            pool = executor_pool.get(self.executor)
+            try:
+                self._result = await loop.run_in_executor(
+                    pool, functools.partial(call_function, self.function, args, kwargs)
+                )
+            except BrokenExecutor:
+                executor_pool.discard(pool)
+                raise
+        return self._result
@@ -1,14 +1,126 @@
+import fnmatch
+import heapq
+import os
+import re
 import shlex
 import shutil
+import tempfile
+import threading
 import typing
+from concurrent.futures import ThreadPoolExecutor
 
-from pydantic import Field, SecretStr
+from pydantic import Field, PrivateAttr, SecretStr, validator
 
+from ..logger import log
 from .shell import Action as ShellAction
+from .shell import ShellSession, clean
 
 if typing.TYPE_CHECKING:
     pass
 
+# Per-file overhead (in bytes) used to balance the shards, small files are dominated by latency, not size.
+FILE_COST = 64 * 1024
+DELETE_OPTIONS = ("--delete", "--del")
+RELATIVE_OPTIONS = ("-R", "--relative")
+# `--stats` output, the numbers are printed without units with `--no-human-readable` (see `STATS_ARGS`)
+STATS_ARGS = ("--stats", "--no-human-readable")
+STATS_PATTERNS = {
+    "files": re.compile(r"Number of files: [\d,]+ \(reg: ([\d,]+)"),
+    "files_transferred": re.compile(r"Number of regular files transferred: ([\d,]+)"),
+    "bytes_transferred": re.compile(r"Total transferred file size: ([\d,]+)"),
+    "bytes_sent": re.compile(r"Total bytes sent: ([\d,]+)"),
+}
+
+
+def parse_stats(line: str, stats: dict[str, int]):
+    """
+    Add the `--stats` numbers found in `line` to `stats`.
+    """
+
+    for key, pattern in STATS_PATTERNS.items():
+        match = pattern.search(line)
+        if match:
+            stats[key] += int(match.group(1).replace(",", ""))
+
+
+def shard_files(files: list[tuple[str, int]], count: int) -> list[list[str]]:
+    """
+    Split `(path, size)` pairs into `count` shards of about the same cost (size + `FILE_COST` per file).
+    """
+
+    shards: list[list[str]] = [[] for _ in range(count)]
+    heap = [(0, idx) for idx in range(count)]
+    for path, size in sorted(files, key=lambda f: f[1], reverse=True):
+        cost, idx = heapq.heappop(heap)
+        shards[idx].append(path)
+        heapq.heappush(heap, (cost + size + FILE_COST, idx))
+    return [sorted(shard) for shard in shards if shard]
+
+
+def is_excluded(path: str, patterns: list[str]) -> bool:
+    """
+    Whether `path` (relative to the source) matches one of the rsync-like exclude `patterns`:
+    a pattern starting with "/" is anchored at the source, the others match the name or the path.
+    """
+
+    name = os.path.basename(path)
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if pattern.startswith("/"):
+            if fnmatch.fnmatch(path, pattern.lstrip("/")):
+                return True
+        elif fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+            return True
+    return False
+
+
+def walk_files(
+    root: str, excludes: list[str], *, follow_symlinks: bool = False
+) -> typing.Iterator[tuple[str, os.stat_result]]:
+    """
+    Yield the files under `root` (their path relative to `root` and their stat), without the excluded ones.
+    """
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        reldir = "" if reldir == "." else reldir
+        dirnames[:] = [
+            d for d in dirnames if not is_excluded(os.path.join(reldir, d), excludes)
+        ]
+        for name in filenames:
+            path = os.path.join(reldir, name)
+            if is_excluded(path, excludes):
+                continue
+            try:
+                st = os.stat(
+                    os.path.join(dirpath, name), follow_symlinks=follow_symlinks
+                )
+            except OSError:
+                continue
+            yield path, st
+
+
+def walk_dirs(root: str, excludes: list[str]) -> typing.Iterator[str]:
+    """
+    Yield the directories under `root` (relative to `root`), without the excluded ones.
+    """
+
+    for dirpath, dirnames, _ in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        reldir = "" if reldir == "." else reldir
+        dirnames[:] = [
+            d for d in dirnames if not is_excluded(os.path.join(reldir, d), excludes)
+        ]
+        for name in dirnames:
+            yield os.path.join(reldir, name)
+
+
+def _parents(path: str) -> typing.Iterator[str]:
+    path = os.path.dirname(path)
+    while path:
+        yield path
+        path = os.path.dirname(path)
+
 
 class Action(ShellAction):
     ssh_user: SecretStr
@@ -19,8 +131,23 @@ class Action(ShellAction):
     destination: str
     options: list[str]
     excludes: list[str] = Field(default_factory=list)
+    # number of rsync processes transferring the source tree at the same time
+    parallel: int = Field(1, ge=1)
 
     # _process: typing.Optional[pexpect.spawn] = PrivateAttr(None)
+    _summary: typing.Optional[dict] = PrivateAttr(None)
+    # shells of the running shards, interrupted by `abort`
+    _shards: set[ShellSession] = PrivateAttr(default_factory=set)
+    _shards_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _aborted: threading.Event = PrivateAttr(default_factory=threading.Event)
+
+    @validator("backend")
+    def _validate_backend(cls, v: str):
+        if v != "pty":
+            raise ValueError(
+                "rsync needs the 'pty' backend to answer the password prompt"
+            )
+        return v
 
     def line_callback(self, line: str):
         if isinstance(line, str) and "Permission denied, please try again." in line:
@@ -46,21 +173,204 @@ class Action(ShellAction):
 
         return options
 
+    def get_destination(self) -> str:
+        return f"{self.ssh_user.get_secret_value()}@{self.ssh_host.get_secret_value()}:{self.destination}"
+
+    def is_excluded(self, path: str) -> bool:
+        return is_excluded(path, self.excludes)
+
+    def scan_source(self) -> list[tuple[str, int]]:
+        """
+        List the files (relative to `source`) and their sizes, without the excluded ones.
+        """
+
+        root = os.path.join(self.cwd or os.getcwd(), self.source)
+        return [(path, st.st_size) for path, st in walk_files(root, self.excludes)]
+
+    def scan_empty_dirs(self, files: list[tuple[str, int]]) -> list[str]:
+        """
+        The directories (relative to `source`) that don't hold any of the `files`, rsync only creates
+        the parent directories of the files listed with `--files-from`.
+        """
+
+        root = os.path.join(self.cwd or os.getcwd(), self.source)
+        parents = {parent for path, _ in files for parent in _parents(path)}
+        return sorted(d for d in walk_dirs(root, self.excludes) if d not in parents)
+
+    def can_shard(self) -> bool:
+        """
+        Whether the transfer can be split with `--files-from`: the source is a directory and the paths
+        aren't sent relative to the working directory (`--relative`), which `--files-from` changes.
+        """
+
+        if not os.path.isdir(os.path.join(self.cwd or os.getcwd(), self.source)):
+            return False
+        for arg in self.build_args():
+            if arg in RELATIVE_OPTIONS or (
+                arg.startswith("-") and not arg.startswith("--") and "R" in arg
+            ):
+                return False
+        return True
+
+    def shard_layout(self) -> tuple[str, str]:
+        """
+        The source and destination of the shards. The `--files-from` paths are copied under the destination
+        like the content of `source/` would be. Without a trailing slash, a single rsync process copies
+        the directory itself (to `destination/<name>`), the shards have to do the same.
+        """
+
+        destination = self.get_destination()
+        name = os.path.basename(self.source)
+        if name in ("", ".", ".."):
+            return self.source, destination
+        if not destination.endswith((":", "/")):
+            destination += "/"
+        return self.source + "/", destination + name
+
+    def get_result(self) -> typing.Any:
+        return self._summary
+
+    def abort(self):
+        super().abort()
+        self._aborted.set()
+        with self._shards_lock:
+            shards = list(self._shards)
+        for session in shards:
+            session.interrupt()
+
+    def _run_shard(self, command: str, shard_id: int) -> dict:
+        if self._aborted.is_set():
+            raise RuntimeError(f"{__name__}: aborted")
+        spawned: list[ShellSession] = []
+        stats = {key: 0 for key in STATS_PATTERNS}
+
+        def on_output(line: str):
+            line = clean(line)
+            self.line_callback(line)
+            if self.debug:
+                print(f"[shard {shard_id}] {line}", end="")
+            self._output.write(line)
+            parse_stats(line, stats)
+
+        def on_spawn(session: ShellSession):
+            spawned.append(session)
+            with self._shards_lock:
+                self._shards.add(session)
+            if self._aborted.is_set():
+                session.interrupt()
+
+        try:
+            session = ShellSession(
+                self._command,
+                cwd=self.cwd,
+                env=os.environ,
+                timeout=self.timeout,
+                on_spawn=on_spawn,
+            )
+            log.debug("Executing command %r", command)
+            session.send(command)
+            session.expect("password:", on_output)
+            session.sendline(self.ssh_password.get_secret_value())
+            returncode = session.wait(on_output)
+        finally:
+            for session in spawned:
+                with self._shards_lock:
+                    self._shards.discard(session)
+                session.close()
+
+        if returncode != 0:
+            raise RuntimeError(f"cmd={command} returncode={returncode!r}")
+        return stats
+
+    def _run_sharded(self, command: str):
+        files = self.scan_source()
+        shards = shard_files(files, self.parallel) or [[]]
+        # listed without -r, a directory is created without its content
+        shards[0] = sorted(shards[0] + self.scan_empty_dirs(files))
+        args = self.build_args()
+        delete_args = [a for a in args if a.startswith(DELETE_OPTIONS)]
+        transfer_args = [a for a in args if not a.startswith(DELETE_OPTIONS)]
+        source, destination = self.shard_layout()
+        log.info("Transferring %s files in %s shards", len(files), len(shards))
+
+        with tempfile.TemporaryDirectory(prefix="vonzy-rsync-") as tmpdir:
+            commands = []
+            for idx, shard in enumerate(shards):
+                files_from = os.path.join(tmpdir, f"shard-{idx}.txt")
+                with open(files_from, "w") as f:
+                    f.write("\n".join(shard) + "\n")
+                shard_args = [
+                    *transfer_args,
+                    *STATS_ARGS,
+                    f"--files-from={files_from}",
+                    source,
+                    destination,
+                ]
+                commands.append(shlex.join([command, *shard_args]))
+
+            with ThreadPoolExecutor(
+                max_workers=self.parallel, thread_name_prefix="vonzy-rsync"
+            ) as executor:
+                results = list(
+                    executor.map(self._run_shard, commands, range(len(commands)))
+                )
+
+        summary = {"shards": len(shards)}
+        for key in STATS_PATTERNS:
+            summary[key] = sum(r[key] for r in results)
+
+        if delete_args:
+            # --files-from only knows about the listed files, so the deletions are applied by a last pass
+            # over the whole tree that doesn't transfer anything (with the arguments of a single process).
+            delete_command = shlex.join(
+                [
+                    command,
+                    *args,
+                    "--existing",
+                    "--ignore-existing",
+                    self.source,
+                    self.get_destination(),
+                ]
+            )
+            self._run_shard(delete_command, len(shards))
+
+        self._summary = summary
+
     def initialize(self) -> None:
-        super().initialize()
+        self._aborted.clear()
+        self._summary = None
         command = shutil.which("rsync")
         if not command:
             raise RuntimeError(f"{__name__}: rsync command not found")
 
+        if self.parallel > 1 and self.can_shard():
+            # every shard gets its own shell (see `_run_shard`)
+            self._run_sharded(command)
+            return
+        if self.parallel > 1:
+            log.info(
+                "Can't split the transfer of %r, using a single rsync", self.source
+            )
+
+        super().initialize()
+
         args = self.build_args()
+        args.extend(STATS_ARGS)
         args.append(self.source)
-        destination = f"{self.ssh_user.get_secret_value()}@{self.ssh_host.get_secret_value()}:{self.destination}"
-        args.append(destination)
+        args.append(self.get_destination())
         command = shlex.join([command, *args])
-        with self.control_output():
-            self.execute(command)
-            self.execute(
-                self.ssh_password.get_secret_value(),
-                expect="password:",
-                line_callback=self.line_callback,
-            )
+        log.debug("Executing command %r", command)
+        self._session.send(command)
+        # same summary as the sharded transfer
+        stats = {key: 0 for key in STATS_PATTERNS}
+
+        def on_line(line: str):
+            self.line_callback(line)
+            parse_stats(line, stats)
+
+        self.execute(
+            self.ssh_password.get_secret_value(),
+            expect="password:",
+            line_callback=on_line,
+        )
+        self._summary = {"shards": 1, **stats}
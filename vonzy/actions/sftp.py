@@ -0,0 +1,430 @@
+"""
+Sync a local tree to a remote directory over SFTP, without rsync.
+
+Both ends keep a manifest of the synced files, `{path: [size, mtime, sha256]}`:
+the local one under `CACHE_DIR/sftp` (so only the files whose size or mtime changed are hashed again)
+and the remote one in `destination/.vonzy-manifest.json`. The manifests are compared locally,
+so an unchanged tree costs one scan of the local tree and one read of the remote manifest.
+"""
+import hashlib
+import io
+import json
+import os
+import posixpath
+import stat
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import Field, PrivateAttr, SecretStr
+
+from ..cache import hash_file
+from ..constants import CACHE_DIR
+from ..logger import log
+from ..sshpool import ssh_pool
+from .base import BaseAction
+from .rsync import is_excluded, shard_files, walk_files
+
+try:
+    import paramiko
+except ImportError:
+    raise ImportError("paramiko module not found. try: pip install paramiko")
+
+MANIFEST_NAME = ".vonzy-manifest.json"
+MANIFEST_VERSION = 1
+
+T = typing.TypeVar("T")
+# path -> (size, mtime, sha256). The local manifest keeps the mtime in nanoseconds, the remote one
+# in seconds (the resolution of the SFTP attributes).
+Manifest = dict[str, tuple[int, int, typing.Optional[str]]]
+
+
+def _load_manifest(data: typing.Any) -> typing.Optional[Manifest]:
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return None
+    return {path: tuple(entry) for path, entry in data.get("files", {}).items()}
+
+
+def _dump_manifest(manifest: Manifest) -> bytes:
+    data = {"version": MANIFEST_VERSION, "files": manifest}
+    return json.dumps(data, separators=(",", ":"), sort_keys=True).encode()
+
+
+def scan_manifest(
+    root: str, excludes: list[str], previous: typing.Optional[Manifest] = None
+) -> Manifest:
+    """
+    Build the manifest of the local tree, the hashes of the files whose size and mtime didn't change
+    since `previous` are reused.
+    """
+
+    previous = previous or {}
+    manifest: Manifest = {}
+    hashed = 0
+    for path, st in walk_files(
+        root, [*excludes, "/" + MANIFEST_NAME], follow_symlinks=True
+    ):
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        entry = previous.get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            digest = entry[2]
+        else:
+            try:
+                digest = hash_file(os.path.join(root, path))
+            except OSError:
+                continue
+            hashed += 1
+        manifest[path] = (st.st_size, st.st_mtime_ns, digest)
+
+    log.debug("Scanned %s files in %r, %s hashed", len(manifest), root, hashed)
+    return manifest
+
+
+def diff_manifests(local: Manifest, remote: Manifest) -> tuple[list[str], list[str]]:
+    """
+    The files to upload (missing or different on the remote) and the remote files to delete.
+    Remote entries without a hash (see `Action.scan_remote`) are compared by size and mtime.
+    """
+
+    uploads = []
+    for path, (size, mtime_ns, digest) in local.items():
+        entry = remote.get(path)
+        if entry is None or entry[0] != size:
+            uploads.append(path)
+        elif entry[2] is not None:
+            if entry[2] != digest:
+                uploads.append(path)
+        elif entry[1] != mtime_ns // 1_000_000_000:
+            uploads.append(path)
+
+    deletes = [path for path in remote if path not in local]
+    return sorted(uploads), sorted(deletes)
+
+
+def _parents(path: str) -> typing.Iterator[str]:
+    path = posixpath.dirname(path)
+    while path:
+        yield path
+        path = posixpath.dirname(path)
+
+
+class Action(BaseAction):
+    ssh_host: SecretStr
+    ssh_user: typing.Optional[SecretStr] = None
+    ssh_port: typing.Optional[int] = 22
+    ssh_password: typing.Optional[SecretStr] = None
+    source: str
+    destination: str
+    cwd: typing.Optional[str] = None
+    excludes: list[str] = Field(default_factory=list)
+    # number of SFTP channels (on the same connection) uploading files at the same time
+    parallel: int = Field(4, ge=1)
+    # remove the remote files that were synced before and aren't in the source anymore
+    delete: bool = False
+    # check the remote manifest against the remote tree (size and mtime) for files changed by something else
+    verify: bool = False
+    # where the local manifests are kept (default: `CACHE_DIR/sftp`)
+    index_dir: typing.Optional[str] = None
+    debug: bool = False
+
+    _client: typing.Optional[paramiko.SSHClient] = PrivateAttr(None)
+    _summary: typing.Optional[dict] = PrivateAttr(None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # open SFTP channels, closed by `abort`
+    _channels: list[paramiko.SFTPClient] = PrivateAttr(default_factory=list)
+    _aborted: threading.Event = PrivateAttr(default_factory=threading.Event)
+
+    def get_source(self) -> str:
+        return os.path.join(self.cwd or os.getcwd(), self.source)
+
+    def _remote_path(self, path: str = "") -> str:
+        return posixpath.join(self.destination, path) if path else self.destination
+
+    def _index_path(self, root: str) -> str:
+        key = hashlib.sha256(os.path.abspath(root).encode()).hexdigest()
+        return os.path.join(
+            self.index_dir or os.path.join(CACHE_DIR, "sftp"), key + ".json"
+        )
+
+    def load_index(self, root: str) -> typing.Optional[Manifest]:
+        try:
+            with open(self._index_path(root), "rb") as f:
+                return _load_manifest(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, root: str, manifest: Manifest):
+        path = self._index_path(root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_dump_manifest(manifest))
+        os.replace(tmp, path)
+
+    def read_remote_manifest(
+        self, sftp: paramiko.SFTPClient
+    ) -> typing.Optional[Manifest]:
+        try:
+            with sftp.open(self._remote_path(MANIFEST_NAME), "rb") as f:
+                f.prefetch()
+                return _load_manifest(json.loads(f.read()))
+        except (IOError, ValueError):
+            return None
+
+    def write_remote_manifest(self, sftp: paramiko.SFTPClient, manifest: Manifest):
+        path = self._remote_path(MANIFEST_NAME)
+        tmp = path + ".tmp"
+        sftp.putfo(io.BytesIO(_dump_manifest(manifest)), tmp, confirm=False)
+        try:
+            sftp.posix_rename(tmp, path)
+        except IOError:
+            # the server doesn't support the posix-rename extension, a plain rename doesn't overwrite
+            try:
+                sftp.remove(path)
+            except IOError:
+                pass
+            sftp.rename(tmp, path)
+
+    def scan_remote(
+        self, sftp: paramiko.SFTPClient, manifest: typing.Optional[Manifest]
+    ) -> Manifest:
+        """
+        List the remote tree. The entries of `manifest` whose size and mtime still match are kept (with their hash),
+        the other files get an entry without a hash.
+        """
+
+        manifest = manifest or {}
+        remote: Manifest = {}
+        pending = [""]
+        while pending:
+            reldir = pending.pop()
+            try:
+                entries = sftp.listdir_attr(self._remote_path(reldir))
+            except IOError:
+                continue
+            for attr in entries:
+                path = posixpath.join(reldir, attr.filename)
+                if path == MANIFEST_NAME or is_excluded(path, self.excludes):
+                    continue
+                if stat.S_ISDIR(attr.st_mode):
+                    pending.append(path)
+                elif stat.S_ISREG(attr.st_mode):
+                    entry = manifest.get(path)
+                    if entry is None or entry[:2] != (attr.st_size, attr.st_mtime):
+                        entry = (attr.st_size, attr.st_mtime, None)
+                    remote[path] = entry
+        return remote
+
+    def _make_dirs(self, sftp: paramiko.SFTPClient, paths: list[str], remote: Manifest):
+        """
+        Create the remote directories of `paths` that don't hold any file of the `remote` manifest.
+        """
+
+        known = {parent for path in remote for parent in _parents(path)}
+        dirs = {parent for path in paths for parent in _parents(path)} - known
+        # parents first, the destination too when nothing was synced yet
+        ordered = sorted(dirs, key=lambda d: (d.count("/"), d))
+        if not remote:
+            ordered.insert(0, "")
+        for reldir in ordered:
+            try:
+                sftp.mkdir(self._remote_path(reldir))
+            except IOError:
+                # it already exists (or the upload fails with a clearer error)
+                pass
+
+    def _upload(self, sftp: paramiko.SFTPClient, root: str, paths: list[str]) -> int:
+        sent = 0
+        for path in paths:
+            local_path = os.path.join(root, path)
+            st = os.stat(local_path)
+            with open(local_path, "rb") as src, sftp.open(
+                self._remote_path(path), "wb"
+            ) as dst:
+                # the writes don't wait for the server's acknowledgement, the errors are raised on close
+                dst.set_pipelined(True)
+                for chunk in iter(lambda: src.read(32768), b""):
+                    dst.write(chunk)
+                    sent += len(chunk)
+                dst.chmod(stat.S_IMODE(st.st_mode))
+                dst.utime((st.st_atime, st.st_mtime))
+            if self.debug:
+                with self._lock:
+                    print(f"uploaded {path}")
+        return sent
+
+    def _remove(self, sftp: paramiko.SFTPClient, paths: list[str]) -> list[str]:
+        """
+        Remove `paths` and return the ones that are gone (removed or already missing).
+        """
+
+        removed = []
+        for path in paths:
+            try:
+                sftp.remove(self._remote_path(path))
+            except FileNotFoundError:
+                pass
+            except IOError as e:
+                log.warning("Can't delete %r on the remote host: %s", path, e)
+                continue
+            removed.append(path)
+        return removed
+
+    def _map_channels(
+        self,
+        sftp: paramiko.SFTPClient,
+        fn: typing.Callable[[paramiko.SFTPClient, list[str]], T],
+        batches: list[list[str]],
+    ) -> list[T]:
+        """
+        Call `fn` with every batch of paths, each batch on its own SFTP channel of the connection
+        (`sftp` is used for the first one).
+        """
+
+        if len(batches) <= 1:
+            return [fn(sftp, batch) for batch in batches]
+
+        clients = [sftp] + [self._open_sftp() for _ in batches[1:]]
+        try:
+            with ThreadPoolExecutor(
+                max_workers=len(batches), thread_name_prefix="vonzy-sftp"
+            ) as executor:
+                return list(executor.map(fn, clients, batches))
+        finally:
+            for client in clients[1:]:
+                self._close_sftp(client)
+
+    def _remove_empty_dirs(
+        self, sftp: paramiko.SFTPClient, deleted: set[str], local: Manifest
+    ):
+        local_dirs = {parent for path in local for parent in _parents(path)}
+        dirs = {parent for path in deleted for parent in _parents(path)} - local_dirs
+        # children first, a directory that still holds something isn't removed
+        for reldir in sorted(dirs, key=lambda d: (-d.count("/"), d)):
+            try:
+                sftp.rmdir(self._remote_path(reldir))
+            except IOError:
+                pass
+
+    def sync(self):
+        root = self.get_source()
+        if not os.path.isdir(root):
+            raise RuntimeError(f"{__name__}: {root!r} is not a directory")
+
+        local = scan_manifest(root, self.excludes, self.load_index(root))
+        self.save_index(root, local)
+
+        sftp = self._open_sftp()
+        try:
+            manifest = self.read_remote_manifest(sftp)
+            if manifest is None or self.verify:
+                log.info("Scanning the remote tree %r", self.destination)
+                remote = self.scan_remote(sftp, manifest)
+            else:
+                remote = manifest
+
+            uploads, deletes = diff_manifests(local, remote)
+            if not self.delete:
+                deletes = []
+            log.info(
+                "%s files, %s to upload, %s to delete",
+                len(local),
+                len(uploads),
+                len(deletes),
+            )
+
+            self._make_dirs(sftp, uploads, remote)
+            shards = shard_files(
+                [(path, local[path][0]) for path in uploads], self.parallel
+            )
+            sent = sum(
+                self._map_channels(
+                    sftp,
+                    lambda client, paths: self._upload(client, root, paths),
+                    shards,
+                )
+            )
+
+            # the deletes are split between the channels too, only the files that are confirmed gone
+            # leave the manifest, the others are deleted again by the next run
+            deleted: set[str] = set()
+            if deletes:
+                channels = min(self.parallel, len(deletes))
+                batches = [deletes[idx::channels] for idx in range(channels)]
+                for removed in self._map_channels(sftp, self._remove, batches):
+                    deleted.update(removed)
+                self._remove_empty_dirs(sftp, deleted, local)
+
+            # the remote files that aren't deleted stay in the manifest, so a later run with `delete` removes them
+            synced = {
+                path: entry for path, entry in remote.items() if path not in deleted
+            }
+            for path, entry in synced.items():
+                if entry[2] is None and path in local:
+                    # unchanged files found by `scan_remote`
+                    synced[path] = (entry[0], entry[1], local[path][2])
+            for path in uploads:
+                size, mtime_ns, digest = local[path]
+                synced[path] = (size, mtime_ns // 1_000_000_000, digest)
+            if uploads or deleted or synced != manifest:
+                self.write_remote_manifest(sftp, synced)
+        finally:
+            self._close_sftp(sftp)
+        if self._aborted.is_set():
+            # the channels were closed by `abort`, the errors of the transfer may have been ignored
+            raise RuntimeError(f"{__name__}: aborted")
+
+        self._summary = {
+            "files": len(local),
+            "files_transferred": len(uploads),
+            "bytes_transferred": sent,
+            "files_deleted": len(deleted),
+        }
+
+    def _open_sftp(self) -> paramiko.SFTPClient:
+        if self._aborted.is_set():
+            raise RuntimeError(f"{__name__}: aborted")
+        sftp = self._client.open_sftp()
+        with self._lock:
+            self._channels.append(sftp)
+        if self._aborted.is_set():
+            sftp.close()
+        return sftp
+
+    def _close_sftp(self, sftp: paramiko.SFTPClient):
+        with self._lock:
+            self._channels.remove(sftp)
+        sftp.close()
+
+    def abort(self):
+        self._aborted.set()
+        with self._lock:
+            channels = list(self._channels)
+        for sftp in channels:
+            sftp.close()
+
+    def initialize(self) -> None:
+        self._aborted.clear()
+        user = self.ssh_user.get_secret_value() if self.ssh_user else None
+        password = self.ssh_password.get_secret_value() if self.ssh_password else None
+        self._client = ssh_pool.acquire(
+            self.ssh_host.get_secret_value(),
+            self.ssh_port or 22,
+            user,
+            password=password,
+        )
+        self.sync()
+
+    def cleanup(self):
+        if self._client is not None:
+            ssh_pool.release(self._client)
+            self._client = None
+
+    def execute(
+        self, *args, context: typing.Optional[dict[typing.Any, typing.Any]] = None
+    ) -> None:
+        raise RuntimeError(f"{__name__}: the sftp action doesn't run commands")
+
+    def get_result(self) -> typing.Any:
+        return self._summary
@@ -1,17 +1,26 @@
-import ast
+import asyncio
+import atexit
 import contextlib
-import functools
+import hashlib
 import os
 import re
+import selectors
+import shlex
 import shutil
+import signal
+import subprocess
+import sys
+import threading
 import typing
+import uuid
 
 import pexpect
-from pydantic import PrivateAttr
+from pydantic import PrivateAttr, root_validator
 
 from ..logger import log
+from ..output import OutputBuffer
 from ..utils import render_step_context
-from .base import BaseAction
+from .base import BaseAction, on_step_tree_end, step_tree
 
 if typing.TYPE_CHECKING:
     from ..schema import StepContext
@@ -20,86 +29,522 @@ if os.name == "nt":
     raise RuntimeError("Windows is not supported.")
 
 DEFAULT_SHELL = shutil.which("bash")
+SENTINEL_PREFIX = "__VONZY_DONE_"
+ANSI_ESCAPE = re.compile(r"(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]")
 
 
 def clean(s):
     """
     Taken from: https://github.com/kennethreitz/crayons/blob/b1b78c9a357e0c348a1288ee5ef0318f08ccf257/crayons.py#L135C1-L139C15
     """
-    strip = re.compile(r"(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]")
-    txt = strip.sub("", s)
+    txt = ANSI_ESCAPE.sub("", s)
     return txt  # .replace("\r", "").replace("\n", "")
 
 
-def _validate_return_code(fn):
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        instance: Action = args[0]
-        rv = fn(*args, **kwargs)
-        if not instance.is_controlled:
-            log.debug(f"Getting return code for cmd={args[1]}")
-            results = fn(instance, cmd="echo $?", print_fn=None)
-            log.debug(f"cmd={args[1]} results={results!r}")
-            results = clean("".join(results))
-            returncode = None
+class ShellSession:
+    """
+    A shell running in the background on a pty.
+
+    After each command the shell prints a sentinel (unique per session) that carries the exit code,
+    so the end of a command is detected as soon as it's printed instead of waiting for a read timeout.
+    """
+
+    def __init__(
+        self,
+        command: str = DEFAULT_SHELL,
+        *,
+        cwd: typing.Optional[str] = None,
+        env: typing.Optional[typing.Mapping[str, str]] = None,
+        timeout: typing.Optional[float] = None,
+        on_spawn: typing.Optional[typing.Callable[["ShellSession"], None]] = None,
+    ):
+        self.command = command
+        self.cwd = cwd
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        # The format string is split from the token, so the echo of the command can't match the sentinel.
+        self._sentinel_cmd = f"printf '{SENTINEL_PREFIX}%s:%d\\n' {self.token} $?"
+        self._sentinel = re.compile(
+            rf"{re.escape(SENTINEL_PREFIX)}{self.token}:(\d+)\r?\n"
+        )
+        # `--noediting` turns off readline, so `stty -echo` hides the commands we send.
+        self._process = pexpect.spawn(
+            command,
+            ["--noediting"],
+            encoding="utf-8",
+            timeout=timeout,
+            cwd=cwd,
+            env=env if env is not None else os.environ,
+        )
+        self._process.delaybeforesend = None
+        self._process.delayafterread = None
+        if on_spawn is not None:
+            # the shell can be interrupted (see `interrupt`) while it starts
+            on_spawn(self)
+        self.run("stty -echo; PS1=''; PS2=''; unset PROMPT_COMMAND")
+        # remember the initial state, see `reset`
+        self.run('__VONZY_ENV="$(export -p)"; __VONZY_CWD="$PWD"')
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.isalive()
+
+    def send(self, cmd: str):
+        """
+        Send a command without waiting for it to finish.
+        The command is wrapped in a group with the sentinel, so bash parses both before running the command
+        and the sentinel can't be swallowed by a command that reads stdin.
+        """
+
+        self._process.sendline(f"{{ {cmd}\n}}; {self._sentinel_cmd}")
+
+    def sendline(self, text: str):
+        """
+        Write raw input to the running command (eg. answer a prompt).
+        """
+
+        self._process.sendline(text)
+
+    def expect(
+        self,
+        pattern: str,
+        on_output: typing.Optional[typing.Callable[[str], None]] = None,
+    ):
+        """
+        Wait until the running command prints `pattern`. Raises a `RuntimeError` if the command finishes first,
+        its sentinel is consumed so the session can still run the next command.
+        """
+
+        try:
+            idx = self._process.expect([pattern, self._sentinel])
+        except pexpect.EOF:
+            raise RuntimeError(
+                f"{__name__}: {self.command!r} exited unexpectedly"
+            ) from None
+        except pexpect.TIMEOUT:
+            self._abort()
+            raise RuntimeError(
+                f"{__name__}: {pattern!r} not printed in {self.timeout}s"
+            ) from None
+
+        if idx == 1:
+            if self._process.before and callable(on_output):
+                on_output(self._process.before)
+            raise RuntimeError(
+                f"{__name__}: the command exited with returncode={int(self._process.match.group(1))} "
+                f"before printing {pattern!r}"
+            )
+
+    def wait(
+        self, on_output: typing.Optional[typing.Callable[[str], None]] = None
+    ) -> int:
+        """
+        Read the output of the running command until its sentinel and return the exit code.
+        """
+
+        while True:
             try:
-                returncode = ast.literal_eval(results)
-            except Exception:
-                pass
+                idx = self._process.expect([self._sentinel, "\r\n"])
+            except pexpect.EOF:
+                raise RuntimeError(
+                    f"{__name__}: {self.command!r} exited unexpectedly"
+                ) from None
+            except pexpect.TIMEOUT:
+                self._abort()
+                raise RuntimeError(
+                    f"{__name__}: no output from {self.command!r} in {self.timeout}s"
+                ) from None
+
+            if idx == 0:
+                if self._process.before and callable(on_output):
+                    on_output(self._process.before)
+                return int(self._process.match.group(1))
+
+            if callable(on_output):
+                on_output(self._process.before + "\n")
+
+    def run(
+        self, cmd: str, on_output: typing.Optional[typing.Callable[[str], None]] = None
+    ) -> int:
+        self.send(cmd)
+        return self.wait(on_output)
+
+    def reset(self) -> bool:
+        """
+        Bring the shell back to its initial working directory, exported variables and shell options.
+        Returns `False` if the session can't be reused.
+        """
+
+        if not self.is_alive:
+            return False
+
+        try:
+            exit_code = self.run(
+                'for __v in $(compgen -e); do unset "$__v" 2>/dev/null; done; eval "$__VONZY_ENV"; '
+                'cd -- "$__VONZY_CWD" && set +euxo pipefail && trap - EXIT ERR'
+            )
+        except RuntimeError:
+            return False
+        return exit_code == 0
+
+    def _abort(self):
+        """
+        Kill the shell after a timeout: the command is still running, its sentinel would be read
+        as the end of the next command. The session isn't alive anymore, so it's not reused.
+        """
+
+        self._process.close(force=True)
+
+    def interrupt(self):
+        """
+        Stop the running command from another thread: the shell is hung up, it hangs up its jobs and exits,
+        so the blocked `wait`/`expect` raises. The session isn't alive anymore, so it's not reused.
+        """
+
+        process = self._process
+        if process is not None and process.pid:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(process.pid, signal.SIGHUP)
+
+    def close(self) -> typing.Optional[int]:
+        if self._process is None:
+            return None
+
+        self._process.close()
+        exit_code = self._process.exitstatus
+        self._process = None
+        return exit_code
+
+
+class SubprocessSession:
+    """
+    Runs every command in its own `<shell> -c` process with pipes instead of a pty.
+    The output is streamed as raw bytes and nothing (`cd`, `export`, ...) is kept between commands.
+    """
+
+    def __init__(
+        self,
+        command: str = DEFAULT_SHELL,
+        *,
+        cwd: typing.Optional[str] = None,
+        env: typing.Optional[typing.Mapping[str, str]] = None,
+        timeout: typing.Optional[float] = None,
+    ):
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+
+    def run(
+        self,
+        cmd: str,
+        on_output: typing.Optional[typing.Callable[[bytes, int], None]] = None,
+    ) -> int:
+        """
+        Run `cmd` and return its exit code.
+        `on_output` is called with every chunk read and the file descriptor it was written to (1 or 2).
+        """
+
+        process = subprocess.Popen(
+            [self.command, "-c", cmd],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+        )
+        streams = {process.stdout.fileno(): 1, process.stderr.fileno(): 2}
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+
+            while selector.get_map():
+                events = selector.select(self.timeout)
+                if not events:
+                    process.kill()
+                    process.wait()
+                    raise RuntimeError(
+                        f"{__name__}: no output from {cmd!r} in {self.timeout}s"
+                    )
+
+                for key, _ in events:
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fd)
+                    elif callable(on_output):
+                        on_output(chunk, streams[key.fd])
+
+        process.stdout.close()
+        process.stderr.close()
+        return process.wait()
+
+    def close(self) -> typing.Optional[int]:
+        return None
+
+
+SessionKey = tuple[str, typing.Optional[str], str]
+
+
+class _NamedSession:
+    __slots__ = ("session", "lock")
+
+    def __init__(self):
+        self.session: typing.Optional[ShellSession] = None
+        self.lock = threading.Lock()
+
+
+class ShellSessionPool:
+    """
+    Keeps shell sessions alive between steps.
+
+    Sessions are leased by (shell, cwd, environment) and reset (see `ShellSession.reset`) when released,
+    so a step never sees the `cd`/`export` of a previous one.
+    Named sessions are shared as-is (without reset) by the steps of a step tree (see `step_tree`) that use
+    the same name, one step at a time. They're closed when the tree finishes.
+    """
+
+    def __init__(self, *, max_idle: int = 4, reuse_by_default: bool = False):
+        self.max_idle = max_idle
+        # whether the actions that don't set `reuse_session` lease their shell (enabled by `vonzy serve`)
+        self.reuse_by_default = reuse_by_default
+        self._idle: dict[SessionKey, list[ShellSession]] = {}
+        self._keys: dict[int, SessionKey] = {}
+        self._named: dict[tuple[typing.Optional[str], str], _NamedSession] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        command: str, cwd: typing.Optional[str], env: typing.Mapping[str, str]
+    ) -> SessionKey:
+        env_hash = hashlib.sha256(repr(sorted(env.items())).encode()).hexdigest()
+        return (command, cwd, env_hash)
+
+    def lease(
+        self,
+        command: str,
+        *,
+        cwd: typing.Optional[str] = None,
+        env: typing.Mapping[str, str],
+        timeout: typing.Optional[float] = None,
+        on_spawn: typing.Optional[typing.Callable[[ShellSession], None]] = None,
+    ) -> ShellSession:
+        key = self.make_key(command, cwd, env)
+        session = None
+        with self._lock:
+            idle = self._idle.get(key) or []
+            while idle and session is None:
+                session = idle.pop()
+                if not session.is_alive:
+                    session = None
+
+        if session is None:
+            session = ShellSession(
+                command, cwd=cwd, env=env, timeout=timeout, on_spawn=on_spawn
+            )
+            log.debug("New pooled shell session %s", session.token)
+        else:
+            log.debug("Reusing shell session %s", session.token)
 
-            if isinstance(returncode, int) and returncode != 0:
-                raise RuntimeError(f"cmd={args[1]} returncode={returncode!r}")
-        return rv
+        session.timeout = timeout
+        with self._lock:
+            self._keys[id(session)] = key
+        return session
 
-    return wrapper
+    def release(self, session: ShellSession):
+        with self._lock:
+            key = self._keys.pop(id(session), None)
+
+        if key is None or not session.reset():
+            session.close()
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(session)
+                session = None
+
+        if session is not None:
+            session.close()
+
+    def acquire_named(
+        self,
+        name: str,
+        command: str,
+        *,
+        cwd: typing.Optional[str] = None,
+        env: typing.Mapping[str, str],
+        timeout: typing.Optional[float] = None,
+        on_spawn: typing.Optional[typing.Callable[[ShellSession], None]] = None,
+    ) -> ShellSession:
+        """
+        The session `name` of the current step tree, held by the caller until `release_named`.
+        """
+
+        scope = step_tree.get()
+        with self._lock:
+            named = self._named.get((scope, name))
+            if named is None:
+                named = self._named[(scope, name)] = _NamedSession()
+
+        # concurrent steps of the tree (--jobs, --async) wait for their turn
+        named.lock.acquire()
+        try:
+            if named.session is None or not named.session.is_alive:
+                named.session = ShellSession(
+                    command, cwd=cwd, env=env, timeout=timeout, on_spawn=on_spawn
+                )
+                log.debug("New shared shell session %r", name)
+            named.session.timeout = timeout
+        except BaseException:
+            named.lock.release()
+            raise
+        return named.session
+
+    def release_named(self, session: ShellSession):
+        with self._lock:
+            named = next(
+                (n for n in self._named.values() if n.session is session), None
+            )
+        if named is not None:
+            named.lock.release()
+        else:
+            # its shell failed to start (see `Action._on_spawn`)
+            session.close()
+
+    def close_scope(self, scope: str):
+        with self._lock:
+            keys = [key for key in self._named if key[0] == scope]
+            closing = [self._named.pop(key) for key in keys]
+
+        for named in closing:
+            if named.session is not None:
+                named.session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            sessions.extend(n.session for n in self._named.values() if n.session)
+            self._idle.clear()
+            self._named.clear()
+
+        for session in sessions:
+            session.close()
+
+
+session_pool = ShellSessionPool()
+atexit.register(session_pool.close_all)
+on_step_tree_end(session_pool.close_scope)
 
 
 class Action(BaseAction):
     cwd: typing.Optional[str] = None
     debug: typing.Optional[bool] = False
-    timeout: typing.Optional[float] = 5
+    timeout: typing.Optional[float] = None
+    # lease a warm shell from `session_pool` instead of spawning a new one (default: `session_pool.reuse_by_default`)
+    reuse_session: typing.Optional[bool] = None
+    # share one shell (and its state) between every step using the same session name
+    session: typing.Optional[str] = None
+    # `pty` runs the commands in one interactive shell, `subprocess` runs each command with pipes (for unattended runs)
+    backend: typing.Literal["pty", "subprocess"] = "pty"
     _command: str = PrivateAttr(DEFAULT_SHELL)
-    _process: typing.Optional[pexpect.pty_spawn.spawn] = PrivateAttr(None)
-    _control_output: bool = PrivateAttr(False)
-    _should_print: bool = PrivateAttr(False)
+    _session: typing.Optional[
+        typing.Union[ShellSession, SubprocessSession]
+    ] = PrivateAttr(None)
+    _output: OutputBuffer = PrivateAttr(default_factory=OutputBuffer)
+    _exit_code: typing.Optional[int] = PrivateAttr(None)
+
+    @root_validator(skip_on_failure=True)
+    def _validate_backend(cls, values: dict):
+        if values.get("backend") == "subprocess" and (
+            values.get("reuse_session") or values.get("session")
+        ):
+            raise ValueError(
+                "'reuse_session' and 'session' are not supported by the subprocess backend"
+            )
+        return values
+
+    @property
+    def reuses_session(self) -> bool:
+        if self.reuse_session is None:
+            return session_pool.reuse_by_default and self.backend == "pty"
+        return self.reuse_session
 
     def initialize(self) -> None:
-        log.debug(f"Launches the command {self._command!r} into a background process.")
-        if self._process is None:
-            self._process = pexpect.spawn(
+        if self._session is not None:
+            return
+
+        env = dict(os.environ)
+        if self.backend == "subprocess":
+            self._session = SubprocessSession(
+                self._command, cwd=self.cwd, env=env, timeout=self.timeout
+            )
+        elif self.session:
+            log.debug("Using the shared shell session %r", self.session)
+            self._session = session_pool.acquire_named(
+                self.session,
+                self._command,
+                cwd=self.cwd,
+                env=env,
+                timeout=self.timeout,
+                on_spawn=self._on_spawn,
+            )
+            if self.cwd:
+                try:
+                    self._session.run(f"cd -- {shlex.quote(self.cwd)}")
+                except BaseException:
+                    session_pool.release_named(self._session)
+                    self._session = None
+                    raise
+        elif self.reuses_session:
+            self._session = session_pool.lease(
                 self._command,
-                encoding="utf-8",
+                cwd=self.cwd,
+                env=env,
                 timeout=self.timeout,
+                on_spawn=self._on_spawn,
+            )
+        else:
+            log.debug(
+                "Launches the command %r into a background process.", self._command
+            )
+            self._session = ShellSession(
+                self._command,
                 cwd=self.cwd,
-                env=os.environ,
+                env=env,
+                timeout=self.timeout,
+                on_spawn=self._on_spawn,
             )
-            self._process.delaybeforesend = 0.1
-            self._process.delayafterread = 0.1
-            # self._process.logfile = sys.stdout
+
+    def _on_spawn(self, session: ShellSession):
+        # set before the shell started, so `abort` can interrupt it (and `cleanup` close it if it fails)
+        self._session = session
 
     def cleanup(self) -> typing.Optional[int]:
-        log.debug(f"Closing process {self._command!r}")
         exit_code = 0
-        if self._process:
-            self._process.close()
-            exit_code = self._process.exitstatus
-            self._process = None
-        log.debug(f"Process {self._command!r} exited with code {exit_code!r}")
+        if self._session:
+            if self.session:
+                session_pool.release_named(self._session)
+            elif self.reuses_session:
+                session_pool.release(self._session)
+            else:
+                log.debug("Closing process %r", self._command)
+                exit_code = self._session.close()
+                log.debug("Process %r exited with code %r", self._command, exit_code)
+            self._session = None
         return exit_code
 
-    @contextlib.contextmanager
-    def control_output(self):
-        self._control_output = True
-        try:
-            yield self
-        finally:
-            self._control_output = False
+    def abort(self):
+        # the subprocess backend runs on the event loop, its command is killed when the step is cancelled
+        if isinstance(self._session, ShellSession):
+            self._session.interrupt()
 
-    @property
-    def is_controlled(self) -> bool:
-        return self._control_output
+    def get_output(self) -> OutputBuffer:
+        return self._output
+
+    def get_exit_code(self) -> typing.Optional[int]:
+        return self._exit_code
 
-    @_validate_return_code
     def execute(
         self,
         cmd: str,
@@ -109,45 +554,154 @@ class Action(BaseAction):
         line_callback: typing.Optional[typing.Callable[[str], None]] = None,
         print_fn: typing.Optional[typing.Callable] = print,
     ):
+        """
+        Run `cmd` and wait for it to finish.
+        With `expect`, `cmd` is written as input to the command that is already running (see `ShellSession.send`)
+        once `expect` is printed, eg. to answer a password prompt.
+        The output is captured in `get_output()`, the exit code is returned.
+        """
+
         if not isinstance(cmd, str):
             raise RuntimeError(f"{__name__}: Command {cmd!r} is not a string.")
 
         if context is not None:
             cmd = render_step_context(cmd.strip(), context=context)
 
-        default_expect = ["\r\n", "\n"]
+        if isinstance(self._session, SubprocessSession):
+            if expect:
+                raise RuntimeError(
+                    f"{__name__}: 'expect' is not supported by the subprocess backend"
+                )
+            return self._execute_subprocess(cmd, print_fn=print_fn)
+
+        def on_output(line: str):
+            line = clean(line)
+            if self.debug and callable(print_fn):
+                print_fn(line, end="")
+            if callable(line_callback):
+                line_callback(line)
+            self._output.write(line)
+
         if expect:
-            log.debug(f"Expects {expect!r} on stdin")
-            self._process.expect(expect)
+            log.debug("Expects %r on stdin", expect)
+            self._session.expect(expect, on_output)
+            self._session.sendline(cmd)
         else:
             # Hide the log if it has the `expect` param. To prevent displaying unwanted text/data on the console.
-            log.debug(f"Executing command {cmd!r}")
+            log.debug("Executing command %r", cmd)
+            self._session.send(cmd)
 
-        self._process.sendline(cmd)
-        lines = []
-        _should_print = self._should_print if self.is_controlled else False
-        while True:
-            try:
-                self._process.expect(default_expect)
-                line = self._process.before + self._process.after
-                # print(f"should_print={_should_print} match_idx={match_idx!r} line={line!r}")
-                if _should_print:
-                    if isinstance(line, str):
-                        line = clean(line)
-                    if self.debug and callable(print_fn):
-                        print_fn(line, end="")
-                    if callable(line_callback):
-                        line_callback(line)
-                    lines.append(line)
-
-                if self._process.before and self._process.before.startswith(
-                    "\x1b[?2004h"
-                ):
-                    _should_print = True
-                    if self.is_controlled:
-                        self._should_print = _should_print
-            except (pexpect.TIMEOUT, pexpect.EOF) as e:
-                # log.error(f"Command {cmd!r} timed out/eof. {e}")
-                break
-
-        return lines
+        returncode = self._exit_code = self._session.wait(on_output)
+        if returncode != 0:
+            cmd_repr = "<input>" if expect else cmd
+            raise RuntimeError(f"cmd={cmd_repr} returncode={returncode!r}")
+
+        return returncode
+
+    def _write_chunk(
+        self, chunk: bytes, fd: int, print_fn: typing.Optional[typing.Callable]
+    ):
+        if self.debug and callable(print_fn):
+            stream = sys.stdout if fd == 1 else sys.stderr
+            stream.flush()
+            buffer = getattr(stream, "buffer", None)
+            if buffer is not None:
+                buffer.write(chunk)
+                buffer.flush()
+            else:
+                stream.write(chunk.decode(errors="replace"))
+        self._output.write(chunk)
+
+    def _execute_subprocess(
+        self, cmd: str, *, print_fn: typing.Optional[typing.Callable] = print
+    ) -> int:
+        log.debug("Executing command %r", cmd)
+        returncode = self._exit_code = self._session.run(
+            cmd, lambda chunk, fd: self._write_chunk(chunk, fd, print_fn)
+        )
+        if returncode != 0:
+            raise RuntimeError(f"cmd={cmd} returncode={returncode!r}")
+
+        return returncode
+
+    # The subprocess backend is async-native: the commands run with asyncio subprocesses
+    # instead of blocking a worker thread. The pty backend uses the default thread adapters.
+
+    async def ainitialize(self) -> None:
+        if self.backend == "subprocess":
+            return self.initialize()
+        return await super().ainitialize()
+
+    async def acleanup(self) -> typing.Optional[int]:
+        if self.backend == "subprocess":
+            return self.cleanup()
+        return await super().acleanup()
+
+    async def aexecute(
+        self,
+        cmd: str,
+        *,
+        context: typing.Optional["StepContext"] = None,
+        print_fn: typing.Optional[typing.Callable] = print,
+    ) -> int:
+        if self.backend != "subprocess":
+            return await super().aexecute(cmd, context=context)
+
+        if not isinstance(cmd, str):
+            raise RuntimeError(f"{__name__}: Command {cmd!r} is not a string.")
+
+        if context is not None:
+            cmd = render_step_context(cmd.strip(), context=context)
+
+        log.debug("Executing command %r", cmd)
+        loop = asyncio.get_running_loop()
+        last_output = loop.time()
+        process = await asyncio.create_subprocess_exec(
+            self._session.command,
+            "-c",
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self._session.cwd,
+            env=self._session.env,
+            # in its own process group, so a cancelled command is killed with its children (see below)
+            start_new_session=True,
+        )
+
+        async def pump(stream: asyncio.StreamReader, fd: int):
+            nonlocal last_output
+            while True:
+                chunk = await stream.read(65536)
+                if not chunk:
+                    return
+                last_output = loop.time()
+                self._write_chunk(chunk, fd, print_fn)
+
+        pending = {
+            asyncio.ensure_future(pump(process.stdout, 1)),
+            asyncio.ensure_future(pump(process.stderr, 2)),
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.timeout)
+                for task in done:
+                    task.result()
+                if pending and loop.time() - last_output >= self.timeout:
+                    raise RuntimeError(
+                        f"{__name__}: no output from {cmd!r} in {self.timeout}s"
+                    )
+            returncode = self._exit_code = await process.wait()
+        finally:
+            for task in pending:
+                task.cancel()
+            if process.returncode is None:
+                # the pipes stay open (and `wait` blocks) as long as any child of the shell is alive
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+
+        if returncode != 0:
+            raise RuntimeError(f"cmd={cmd} returncode={returncode!r}")
+
+        return returncode
@@ -1,12 +1,19 @@
+import threading
+import time
 import typing
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from pydantic import PrivateAttr, SecretStr
+from pydantic import BaseModel, Field, PrivateAttr, SecretStr, root_validator
 
 from .base import BaseAction
 
 if typing.TYPE_CHECKING:
     from ..schema import StepContext
 
+from ..errors import HostsError
+from ..logger import log
+from ..sshpool import ssh_pool
 from ..utils import render_step_context
 
 try:
@@ -14,14 +21,159 @@ try:
 except ImportError:
     raise ImportError("paramiko module not found. try: pip install paramiko")
 
+PIPELINE_MARKER = "__VONZY_END_"
 
-class Action(BaseAction):
+
+class Host(BaseModel):
+    """
+    An inventory entry. Unset connection settings fall back to the ones of the action.
+    """
+
+    name: typing.Optional[str] = None
     ssh_host: SecretStr
-    ssh_user: SecretStr
+    ssh_user: typing.Optional[SecretStr] = None
+    ssh_port: typing.Optional[int] = None
+    ssh_password: typing.Optional[SecretStr] = None
+
+    @property
+    def label(self) -> str:
+        return self.name or self.ssh_host.get_secret_value()
+
+
+class CommandResult(BaseModel):
+    cmd: str
+    status: typing.Literal["success", "error", "skipped"] = "skipped"
+    exit_code: typing.Optional[int] = None
+    # seconds, measured from the arrival of the output of the previous command
+    duration: typing.Optional[float] = None
+    output: str = ""
+
+
+class HostResult(BaseModel):
+    status: typing.Literal["success", "error"] = "success"
+    exit_code: typing.Optional[int] = None
+    error: typing.Optional[str] = None
+    output: list[str] = Field(default_factory=list)
+    # results of every command in pipeline mode
+    commands: list[CommandResult] = Field(default_factory=list)
+
+
+def build_pipeline(commands: list[str], token: str, *, fail_fast: bool) -> str:
+    """
+    Build one shell script running `commands`, each followed by a marker line with its index and exit code
+    (see `PIPELINE_MARKER`). The marker is preceded by a newline, so it's on its own line even if the output
+    of the command doesn't end with one.
+    """
+
+    lines = []
+    for idx, cmd in enumerate(commands):
+        lines.append(f"{{ {cmd}\n}}")
+        lines.append(
+            f"__vonzy_rc=$?; printf '\\n%s:{idx}:%d\\n' {PIPELINE_MARKER}{token} $__vonzy_rc"
+        )
+        if fail_fast:
+            lines.append('[ "$__vonzy_rc" -eq 0 ] || exit "$__vonzy_rc"')
+    return "\n".join(lines)
+
+
+def load_inventory(path: str) -> list[Host]:
+    """
+    Load hosts from an inventory file.
+    It's either a YAML list (of host names or `Host` mappings) or a plain text file with one host per line.
+    """
+
+    import yaml
+
+    with open(path) as f:
+        content = f.read()
+
+    # libyaml when available, like `Workflow.parse_config`
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        data = yaml.load(content, Loader=loader)
+    except yaml.YAMLError:
+        data = None
+
+    if not isinstance(data, list):
+        data = [
+            line.strip()
+            for line in content.splitlines()
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+    hosts = []
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {"ssh_host": entry}
+        hosts.append(Host(**entry))
+    check_labels(hosts, path)
+    return hosts
+
+
+def check_labels(hosts: list[Host], source: str):
+    """
+    The results are keyed by the host labels, two hosts with the same label would share one result.
+    """
+
+    seen = set()
+    for host in hosts:
+        if host.label in seen:
+            raise RuntimeError(
+                f"{__name__}: Duplicate host {host.label!r} in {source}, set a unique 'name'"
+            )
+        seen.add(host.label)
+
+
+class Action(BaseAction):
+    ssh_host: typing.Optional[SecretStr] = None
+    ssh_user: typing.Optional[SecretStr] = None
     ssh_port: typing.Optional[int] = 22
-    ssh_password: SecretStr
+    ssh_password: typing.Optional[SecretStr] = None
+    hosts: list[typing.Union[str, Host]] = Field(default_factory=list)
+    inventory: typing.Optional[str] = None
+    parallel: int = Field(1, ge=1)
+    # send all the commands in one batch and report the exit code, duration and output of each one
+    pipeline: bool = False
+    # pipeline mode: don't run the commands after the first one that fails
+    fail_fast: bool = False
+
+    _ssh_clients: dict[str, paramiko.SSHClient] = PrivateAttr(default_factory=dict)
+    _results: dict[str, HostResult] = PrivateAttr(default_factory=dict)
+    _print_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # channels of the running commands, closed by `abort`
+    _channels: set[paramiko.Channel] = PrivateAttr(default_factory=set)
+    _channels_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _aborted: threading.Event = PrivateAttr(default_factory=threading.Event)
+
+    @root_validator(skip_on_failure=True)
+    def _validate_hosts(cls, values: dict):
+        if (
+            not values.get("ssh_host")
+            and not values.get("hosts")
+            and not values.get("inventory")
+        ):
+            raise ValueError("one of 'ssh_host', 'hosts' or 'inventory' is required")
+        return values
+
+    def get_hosts(self) -> list[Host]:
+        hosts = []
+        if self.ssh_host is not None:
+            hosts.append(Host(ssh_host=self.ssh_host))
+
+        for host in self.hosts:
+            if isinstance(host, str):
+                host = Host(ssh_host=host)
+            hosts.append(host)
+
+        if self.inventory:
+            hosts.extend(load_inventory(self.inventory))
+
+        check_labels(hosts, "the hosts of the step")
+        return hosts
 
-    _ssh_client: typing.Optional[paramiko.SSHClient] = PrivateAttr(None)
+    @property
+    def is_fan_out(self) -> bool:
+        return len(self._results) > 1
 
     def handle_commands(
         self,
@@ -37,42 +189,211 @@ class Action(BaseAction):
             cmd = render_step_context(cmd.strip(), context=context)
             cmd_list.append(cmd)
 
+        if self.pipeline:
+            return [cmd_list]
         return [";".join(cmd_list)]
 
+    def _connect(self, host: Host) -> paramiko.SSHClient:
+        user = host.ssh_user or self.ssh_user
+        password = host.ssh_password or self.ssh_password
+        return ssh_pool.acquire(
+            host.ssh_host.get_secret_value(),
+            host.ssh_port or self.ssh_port,
+            user.get_secret_value() if user else None,
+            password=password.get_secret_value() if password else None,
+        )
+
+    def _map_hosts(self, fn: typing.Callable[[str], None], labels: list[str]):
+        if self.parallel == 1 or len(labels) == 1:
+            for label in labels:
+                fn(label)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=self.parallel, thread_name_prefix="vonzy-ssh"
+        ) as executor:
+            list(executor.map(fn, labels))
+
     def initialize(self) -> None:
-        self._ssh_client = paramiko.SSHClient()
-        self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self._aborted.clear()
+        hosts = {host.label: host for host in self.get_hosts()}
+        self._results = {label: HostResult() for label in hosts}
+
+        def connect(label: str):
+            try:
+                self._ssh_clients[label] = self._connect(hosts[label])
+            except Exception as e:
+                self._results[label] = HostResult(status="error", error=str(e))
+
+        self._map_hosts(connect, list(hosts))
+        if not self._ssh_clients:
+            errors = "; ".join(f"{k}: {v.error}" for k, v in self._results.items())
+            raise RuntimeError(f"{__name__}: {errors}")
+
+    def cleanup(self):
+        for client in self._ssh_clients.values():
+            ssh_pool.release(client)
+
+        self._ssh_clients = {}
+        self._channels.clear()
+
+    def abort(self):
+        self._aborted.set()
+        with self._channels_lock:
+            channels = list(self._channels)
+        for channel in channels:
+            channel.close()
+
+    def _exec(self, client: paramiko.SSHClient, cmd: str) -> paramiko.ChannelFile:
+        """
+        Start `cmd`, its output (with stderr) is read from the returned file until `_wait`.
+        """
+
+        if self._aborted.is_set():
+            raise RuntimeError(f"{__name__}: aborted")
+        stdin, stdout, stderr = client.exec_command(cmd)
+        stdin.close()
+        stdout.channel.set_combine_stderr(True)
+        with self._channels_lock:
+            self._channels.add(stdout.channel)
+        if self._aborted.is_set():
+            stdout.channel.close()
+        return stdout
+
+    def _wait(self, stdout: paramiko.ChannelFile) -> int:
+        exit_code = stdout.channel.recv_exit_status()
+        with self._channels_lock:
+            self._channels.discard(stdout.channel)
+        if self._aborted.is_set():
+            # the channel was closed by `abort`, the output and the exit code are incomplete
+            raise RuntimeError(f"{__name__}: aborted")
+        return exit_code
+
+    def get_result(self) -> typing.Any:
+        return {"hosts": {k: v.dict() for k, v in self._results.items()}}
+
+    def get_exit_code(self) -> typing.Optional[int]:
+        if len(self._results) == 1:
+            return next(iter(self._results.values())).exit_code
+        return None
+
+    def _print_output(self, label: str, result: HostResult):
+        if self.is_fan_out:
+            # print the output of each host as one block, so it doesn't interleave with the other hosts.
+            with self._print_lock:
+                for line in result.output:
+                    print(f"[{label}] {line}", end="")
+
+    def _run_on_host(self, label: str, cmd: str):
+        result = self._results[label]
+        client = self._ssh_clients[label]
         try:
-            self._ssh_client.connect(
-                hostname=self.ssh_host.get_secret_value(),
-                port=self.ssh_port,
-                username=self.ssh_user.get_secret_value(),
-                password=self.ssh_password.get_secret_value(),
-            )
+            stdout = self._exec(client, cmd)
+            for line in stdout:
+                result.output.append(line)
+                if not self.is_fan_out:
+                    print(line, end="")
+
+            result.exit_code = self._wait(stdout)
+            if result.exit_code != 0:
+                result.status = "error"
+                result.error = f"cmd={cmd!r} returncode={result.exit_code!r}"
         except Exception as e:
-            raise RuntimeError(f"{__name__}: {e}")
+            result.status = "error"
+            result.error = str(e)
 
-    def cleanup(self):
+        self._print_output(label, result)
+
+    def _run_pipeline_on_host(self, label: str, commands: list[str]):
+        """
+        Run `commands` with a single `exec_command` and split the output at the markers written after each command
+        (see `build_pipeline`).
+        """
+
+        result = self._results[label]
+        client = self._ssh_clients[label]
+        token = uuid.uuid4().hex
+        marker = f"{PIPELINE_MARKER}{token}:"
+        script = build_pipeline(commands, token, fail_fast=self.fail_fast)
+        cmd_results = [CommandResult(cmd=cmd) for cmd in commands]
+        result.commands.extend(cmd_results)
         try:
-            self._ssh_client.close()
-        except AttributeError as e:
-            if "'NoneType' object has no attribute 'time'" in str(e):
-                pass
+            stdout = self._exec(client, script)
+            idx = 0
+            lines: list[str] = []
+            started = time.perf_counter()
+            for line in stdout:
+                if line.startswith(marker):
+                    _, cmd_idx, exit_code = line.rstrip("\r\n").rsplit(":", 2)
+                    cmd_result = cmd_results[int(cmd_idx)]
+                    cmd_result.exit_code = int(exit_code)
+                    cmd_result.status = (
+                        "success" if cmd_result.exit_code == 0 else "error"
+                    )
+                    cmd_result.duration = time.perf_counter() - started
+                    # the last line ends with the newline written before the marker
+                    if lines:
+                        lines[-1] = lines[-1][:-1]
+                    self._add_output(result, lines[-1:])
+                    cmd_result.output = "".join(lines)
+                    started = time.perf_counter()
+                    idx, lines = int(cmd_idx) + 1, []
+                    continue
 
-        self._ssh_client = None
+                # hold back the last line until the next one, it might end with the newline of the marker
+                self._add_output(result, lines[-1:])
+                lines.append(line)
+
+            exit_code = self._wait(stdout)
+            stopped = self.fail_fast and idx > 0 and cmd_results[idx - 1].exit_code != 0
+            if idx < len(cmd_results) and not stopped:
+                # the script ended (`exit` in a command, or the connection was lost) before the marker
+                self._add_output(result, lines[-1:])
+                cmd_result = cmd_results[idx]
+                cmd_result.exit_code = exit_code
+                cmd_result.status = "success" if exit_code == 0 else "error"
+                cmd_result.duration = time.perf_counter() - started
+                cmd_result.output = "".join(lines)
+
+            failed = [c for c in cmd_results if c.status == "error"]
+            result.exit_code = failed[0].exit_code if failed else exit_code
+            if failed:
+                result.status = "error"
+                result.error = "; ".join(
+                    f"cmd={c.cmd!r} returncode={c.exit_code!r}" for c in failed
+                )
+        except Exception as e:
+            result.status = "error"
+            result.error = str(e)
+
+        self._print_output(label, result)
+
+    def _add_output(self, result: HostResult, lines: list[str]):
+        for line in lines:
+            if not line:
+                continue
+            result.output.append(line)
+            if not self.is_fan_out:
+                print(line, end="")
 
     def execute(
         self,
-        cmd: str,
+        cmd: typing.Union[str, list[str]],
         *,
         context: typing.Optional["StepContext"] = None,
     ) -> None:
-        stdin, stdout, stderr = self._ssh_client.exec_command(cmd)
-        stdin.close()
-        stdout.channel.set_combine_stderr(True)
-        for line in stdout:
-            print(line, end="")
+        """
+        Run `cmd` on every host. A list of commands is run in pipeline mode (see `_run_pipeline_on_host`).
+        """
 
-        returncode = stdout.channel.recv_exit_status()
-        if isinstance(returncode, int) and returncode != 0:
-            raise RuntimeError(f"{__name__}: cmd={cmd!r} returncode={returncode!r}")
+        labels = [k for k, v in self._results.items() if v.status == "success"]
+        if isinstance(cmd, list):
+            log.debug("Executing %s commands in one batch", len(cmd))
+            run_on_host = lambda label: self._run_pipeline_on_host(label, cmd)
+        else:
+            run_on_host = lambda label: self._run_on_host(label, cmd)
+        self._map_hosts(run_on_host, labels)
+        failed = {k: v.error for k, v in self._results.items() if v.status == "error"}
+        if failed:
+            errors = "; ".join(f"{k}: {v}" for k, v in failed.items())
+            raise HostsError(f"{__name__}: {errors}", hosts=self.get_result()["hosts"])
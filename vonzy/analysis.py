@@ -0,0 +1,254 @@
+"""
+Static analysis of the templates and rules of a workflow: the `steps.*`, `inputs.*` and `env.*` values
+they use, and the dependencies between the steps that follow from them (see `vonzy plan` and `run --with-deps`).
+"""
+import functools
+import re
+import string
+import typing
+
+from .constants import TEMPLATE_CACHE_SIZE
+from .logger import log
+from .scheduler import find_step, topological_order
+from .utils import get_jinja_env
+
+if typing.TYPE_CHECKING:
+    from jinja2 import nodes
+
+    from .schema import Step
+
+# eg. ("steps", "build", "result", "status")
+Reference = tuple[str, ...]
+
+ROOTS = frozenset({"steps", "inputs", "env"})
+
+_FIELD_PART = re.compile(r"\.([^.\[]+)|\[([^\]]*)\]")
+
+
+def _format_references(template: str) -> typing.Iterator[Reference]:
+    for _, field_name, format_spec, _ in string.Formatter().parse(template):
+        if field_name:
+            root = re.match(r"[^.\[]*", field_name).group()
+            if root in ROOTS:
+                parts = [root]
+                for match in _FIELD_PART.finditer(field_name, len(root)):
+                    parts.append(match.group(1) or match.group(2))
+                yield tuple(parts)
+        if format_spec:
+            yield from _format_references(format_spec)
+
+
+def _chain(node: "nodes.Node") -> tuple[typing.Optional[Reference], list["nodes.Node"]]:
+    """
+    The reference made by a chain of attribute/item lookups (eg. `steps.build["result"]`)
+    and the dynamic item keys of the chain, which can hold references too.
+    """
+
+    from jinja2 import nodes
+
+    parts: list[str] = []
+    dynamic: list["nodes.Node"] = []
+    while True:
+        if isinstance(node, nodes.Getattr):
+            parts.append(node.attr)
+            node = node.node
+        elif isinstance(node, nodes.Getitem):
+            if isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+                parts.append(node.arg.value)
+            else:
+                # only the part of the chain before a dynamic key is known
+                parts.clear()
+                dynamic.append(node.arg)
+            node = node.node
+        elif isinstance(node, nodes.Name) and node.name in ROOTS:
+            return (node.name, *reversed(parts)), dynamic
+        else:
+            return None, []
+
+
+def _jinja_references(node: "nodes.Node") -> typing.Iterator[Reference]:
+    from jinja2 import nodes
+
+    if isinstance(node, (nodes.Getattr, nodes.Getitem, nodes.Name)):
+        ref, dynamic = _chain(node)
+        if ref is not None:
+            yield ref
+            for key in dynamic:
+                yield from _jinja_references(key)
+            return
+
+    for child in node.iter_child_nodes():
+        yield from _jinja_references(child)
+
+
+def _parse_jinja(source: str) -> frozenset[Reference]:
+    from jinja2 import TemplateSyntaxError
+
+    try:
+        tree = get_jinja_env().parse(source)
+    except TemplateSyntaxError as e:
+        log.debug("Can't analyze template %r: %s", source, e)
+        return frozenset()
+    return frozenset(_jinja_references(tree))
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def template_references(template: str) -> frozenset[Reference]:
+    """
+    The references of a template, rendered like `render_step_context` does (jinja2 or `str.format`).
+    """
+
+    if template.startswith("{{") and template.endswith("}}"):
+        return _parse_jinja(template)
+    try:
+        return frozenset(_format_references(template))
+    except ValueError as e:
+        log.debug("Can't analyze template %r: %s", template, e)
+        return frozenset()
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def rule_references(expr: str) -> frozenset[Reference]:
+    return _parse_jinja("{{ " + expr + " }}")
+
+
+def step_path(ref: Reference) -> typing.Optional[tuple[str, ...]]:
+    """
+    The path of the step a `steps.*` reference points to, eg. `steps.build.test.result.status` -> ("build", "test").
+    """
+
+    if ref[0] != "steps" or len(ref) < 2:
+        return None
+    parts = ref[1:]
+    if "result" in parts:
+        parts = parts[: parts.index("result")]
+    return parts or None
+
+
+def step_references(step: "Step") -> set[Reference]:
+    """
+    The references of the name, rule, action params and commands of `step` (not of its child steps).
+    """
+
+    from .schema import CommandRule
+
+    refs = set(template_references(step.name))
+    if step.rule:
+        refs |= rule_references(step.rule)
+
+    def add_value(value: typing.Any):
+        if isinstance(value, str):
+            refs.update(template_references(value))
+        elif isinstance(value, list):
+            for item in value:
+                add_value(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                add_value(item)
+
+    add_value(step.get_action().params or {})
+    for cmd in step.commands:
+        if isinstance(cmd, CommandRule):
+            refs |= rule_references(cmd.rule)
+            cmd = cmd.cmd
+        if isinstance(cmd, str):
+            cmd = cmd.strip()
+        add_value(cmd)
+    return refs
+
+
+class StepAnalysis:
+    __slots__ = ("step", "references", "uses", "unknown")
+
+    def __init__(self, step: "Step"):
+        self.step = step
+        # references of the step and its child steps
+        self.references: set[Reference] = set()
+        # top-level steps whose results are used
+        self.uses: set[str] = set()
+        # steps referenced but not found in the workflow
+        self.unknown: set[tuple[str, ...]] = set()
+
+
+class DependencyGraph:
+    """
+    Dependencies between the top-level steps of a workflow: their `needs` and the steps whose results
+    their templates and rules use (including the templates of their child steps).
+
+    The graph of the child steps of a step is built with the path of that step as `prefix`,
+    only the references to its child steps are considered.
+    """
+
+    def __init__(self, steps: list["Step"], prefix: tuple[str, ...] = ()):
+        self.steps = steps
+        self.analyses: dict[str, StepAnalysis] = {}
+        for step in steps:
+            analysis = StepAnalysis(step)
+            self._collect(step, analysis)
+            for ref in analysis.references:
+                path = step_path(ref)
+                if path is None or path[: len(prefix)] != prefix:
+                    continue
+                path = path[len(prefix) :]
+                if not path:
+                    continue
+                if find_step(steps, path) is None:
+                    analysis.unknown.add(path)
+                elif path[0] != step.id:
+                    analysis.uses.add(path[0])
+            self.analyses[step.id] = analysis
+
+    def _collect(self, step: "Step", analysis: StepAnalysis):
+        analysis.references |= step_references(step)
+        for child in step.steps:
+            self._collect(child, analysis)
+
+    def dependencies(self, step_id: str) -> set[str]:
+        analysis = self.analyses[step_id]
+        return set(analysis.step.needs) | analysis.uses
+
+    def run_needs(self) -> dict[str, set[str]]:
+        """
+        The steps every step waits for when the steps run concurrently: its `needs` and the steps declared
+        before it whose results it uses. A step running one by one (in topological order) sees the results
+        of these steps, and nothing of the steps after it, so a concurrent run keeps the same results.
+        """
+
+        order = [s.id for s in topological_order(self.steps)]
+        needs = {}
+        for step_id, analysis in self.analyses.items():
+            index = order.index(step_id)
+            needs[step_id] = set(analysis.step.needs) | {
+                dep for dep in analysis.uses if order.index(dep) < index
+            }
+        return needs
+
+    def closure(self, step_ids: typing.Iterable[str]) -> list[str]:
+        """
+        The ids of `step_ids` and the steps they depend on (transitively), in the order they run.
+        """
+
+        selected = {step_id for step_id in step_ids if step_id in self.analyses}
+        pending = list(selected)
+        while pending:
+            for dep in self.dependencies(pending.pop()):
+                if dep not in selected:
+                    selected.add(dep)
+                    pending.append(dep)
+        return [s.id for s in topological_order(self.steps) if s.id in selected]
+
+    def warnings(self) -> list[str]:
+        order = [s.id for s in topological_order(self.steps)]
+        warnings = []
+        for step_id, analysis in self.analyses.items():
+            for path in sorted(analysis.unknown):
+                warnings.append(
+                    f"Step {step_id!r} refers to an unknown step {'.'.join(path)!r}"
+                )
+            for dep in sorted(analysis.uses - set(analysis.step.needs)):
+                # the steps declared before wait for it anyway (see `run_needs`)
+                if order.index(dep) > order.index(step_id):
+                    warnings.append(
+                        f"Step {step_id!r} uses the result of {dep!r}, which runs after it"
+                    )
+        return warnings
@@ -0,0 +1,117 @@
+"""
+`vonzy run-batch`: run one workflow many times, once per set of input values, on a pool of workers.
+"""
+import collections
+import csv
+import json
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .constants import BATCH_WORKERS
+from .errors import InvalidInput
+from .logger import log
+
+if typing.TYPE_CHECKING:
+    from .cache import StepCache
+    from .schema import Workflow
+
+
+def read_input_sets(path: str) -> list[dict[str, typing.Any]]:
+    """
+    Read the input sets from a CSV file (with a header line) or a JSON-lines file (one object per line).
+    """
+
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            return [dict(row) for row in csv.DictReader(f)]
+
+        input_sets = []
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                values = json.loads(line)
+            except ValueError as e:
+                raise InvalidInput(f"{path}:{lineno}: {e}") from None
+            if not isinstance(values, dict):
+                raise InvalidInput(f"{path}:{lineno}: expected an object")
+            input_sets.append(values)
+        return input_sets
+
+
+class InstanceSummary:
+    __slots__ = ("index", "inputs", "statuses", "duration", "error")
+
+    def __init__(self, index: int, inputs: dict[str, typing.Any]):
+        self.index = index
+        self.inputs = inputs
+        # number of steps by status
+        self.statuses: collections.Counter[str] = collections.Counter()
+        self.duration = 0.0
+        self.error: typing.Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.statuses["error"]
+
+
+def run_instance(
+    workflow: "Workflow",
+    index: int,
+    inputs: dict[str, typing.Any],
+    *,
+    step_ids: typing.Optional[list[str]] = None,
+    cache: typing.Optional["StepCache"] = None,
+) -> InstanceSummary:
+    summary = InstanceSummary(index, inputs)
+    start = time.perf_counter()
+    try:
+        # the inputs are checked and completed by the run (see `Workflow.resolve_inputs`)
+        for result in workflow.run(
+            step_ids, cache=cache, inputs=inputs, raise_errors=True
+        ):
+            if result is not None:
+                summary.statuses[result.status] += 1
+        if not summary.statuses and workflow.steps:
+            summary.error = "no step ran"
+    except Exception as e:
+        summary.error = str(e)
+        log.error("Instance #%s failed: %s", index, e)
+    summary.duration = time.perf_counter() - start
+    return summary
+
+
+def run_batch(
+    workflow: "Workflow",
+    input_sets: list[dict[str, typing.Any]],
+    *,
+    workers: int = BATCH_WORKERS,
+    step_ids: typing.Optional[list[str]] = None,
+    cache: typing.Optional["StepCache"] = None,
+) -> typing.Iterator[InstanceSummary]:
+    """
+    Run the workflow once per input set, `workers` instances at a time. Every instance has its own
+    context, the parsed workflow and the loaded actions are shared. Summaries are yielded as the instances finish.
+    """
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="vonzy-instance"
+    ) as executor:
+        futures = [
+            executor.submit(
+                run_instance,
+                workflow,
+                index,
+                inputs,
+                step_ids=step_ids,
+                cache=cache,
+            )
+            for index, inputs in enumerate(input_sets, 1)
+        ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,219 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import typing
+
+from .constants import (
+    CACHE_DIR,
+    STEP_CACHE_MAX_AGE,
+    STEP_CACHE_MAX_SIZE,
+    WORKFLOW_CACHE_MAX_ENTRIES,
+)
+from .logger import log
+
+if typing.TYPE_CHECKING:
+    from .schema import Step, StepContext, Workflow
+
+
+@functools.lru_cache(maxsize=None)
+def get_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("vonzy")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _json_safe(value: typing.Any) -> typing.Any:
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class StepCache:
+    """
+    On-disk record of successful steps, keyed by the fingerprint of their inputs
+    (rendered params and commands, input files and environment variables, see `Step.cache`).
+
+    With `refresh=True` every step runs and its record is replaced.
+    """
+
+    def __init__(
+        self,
+        directory: typing.Optional[str] = None,
+        *,
+        refresh: bool = False,
+        max_age: float = STEP_CACHE_MAX_AGE,
+        max_size: int = STEP_CACHE_MAX_SIZE,
+    ):
+        self.directory = directory or os.path.join(CACHE_DIR, "steps")
+        self.refresh = refresh
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def fingerprint(self, step: "Step", sc: "StepContext") -> str:
+        options = step.cache
+        action = step.get_action()
+        data = {
+            "workflow": sc.workflow,
+            "id": step.id,
+            "action": [action.name, action.klass],
+            "params": step.render_params(sc),
+            "commands": step.render_commands(sc),
+            "env": {key: sc.env.get(key) for key in sorted(options.env)},
+            "files": {},
+        }
+        for pattern in options.paths:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    data["files"][path] = hash_file(path)
+
+        raw = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def lookup(self, step: "Step", key: str) -> typing.Optional[dict]:
+        if self.refresh:
+            return None
+
+        try:
+            with open(self._path(key)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        max_age = step.cache.max_age or self.max_age
+        if (
+            record.get("status") != "success"
+            or time.time() - record["created"] > max_age
+        ):
+            return None
+        return record
+
+    def store(self, step: "Step", key: str, value: typing.Any):
+        os.makedirs(self.directory, exist_ok=True)
+        record = {
+            "step": step.id,
+            "status": "success",
+            "created": time.time(),
+            "value": _json_safe(value),
+        }
+        tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        """
+        Remove the records older than `max_age`, then the oldest ones until the cache fits in `max_size`.
+        """
+
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file()]
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        stats = sorted(
+            ((e.path, e.stat()) for e in entries), key=lambda item: item[1].st_mtime
+        )
+        total = sum(st.st_size for _, st in stats)
+        for path, st in stats:
+            if now - st.st_mtime <= self.max_age and total <= self.max_size:
+                continue
+            try:
+                os.remove(path)
+                total -= st.st_size
+            except OSError as e:
+                log.debug("Failed to remove cache entry %r: %s", path, e)
+
+
+class WorkflowCache:
+    """
+    On-disk cache of validated workflows, keyed by the content of the workflow file,
+    the versions of vonzy, pydantic and python and the workflow schema module.
+    """
+
+    def __init__(
+        self,
+        directory: typing.Optional[str] = None,
+        *,
+        max_entries: int = WORKFLOW_CACHE_MAX_ENTRIES,
+    ):
+        self.directory = directory or os.path.join(CACHE_DIR, "workflows")
+        self.max_entries = max_entries
+
+    def make_key(self, content: bytes) -> str:
+        import pydantic
+
+        from . import schema
+
+        h = hashlib.sha256(content)
+        h.update(get_version().encode())
+        h.update(pydantic.VERSION.encode())
+        h.update(sys.version.encode())
+        # the pickled models are only valid for the schema they were created with, even on a development install
+        st = os.stat(schema.__file__)
+        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pickle")
+
+    def load(self, key: str) -> typing.Optional["Workflow"]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug("Ignoring unreadable workflow cache entry %r: %s", key, e)
+            return None
+
+    def store(self, key: str, workflow: "Workflow"):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(workflow, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            log.debug("Failed to cache the workflow: %s", e)
+            return
+
+        self.evict()
+
+    def evict(self):
+        try:
+            entries = sorted(
+                (e for e in os.scandir(self.directory) if e.is_file()),
+                key=lambda e: e.stat().st_mtime,
+                reverse=True,
+            )
+        except FileNotFoundError:
+            return
+
+        for entry in entries[self.max_entries :]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
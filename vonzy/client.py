@@ -0,0 +1,126 @@
+"""
+Thin client of `vonzy serve`. It only imports the standard library, so it starts in a few milliseconds.
+
+    python -m vonzy.client -c workflow.yml [-s STEP ...] [-e ENV_FILE ...] [-j JOBS] [--async]
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import typing
+
+from .constants import SOCKET_PATH
+
+
+def request(
+    message: dict[str, typing.Any], *, socket_path: str = SOCKET_PATH
+) -> typing.Iterator[dict[str, typing.Any]]:
+    """
+    Send one request to the server and yield the messages it answers with (see `vonzy.server`).
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def parse_input(value: str) -> tuple[str, str]:
+    key, sep, val = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {value!r}")
+    return key, val
+
+
+def run(args: argparse.Namespace) -> int:
+    message = {
+        "command": "run",
+        "config": os.path.abspath(args.config),
+        "step_ids": args.step or None,
+        "inputs": dict(args.input or []),
+        "env_files": [os.path.abspath(f) for f in args.env or []],
+        "jobs": args.jobs,
+        "async": args.use_async,
+        "no_cache": args.no_cache,
+        "refresh": args.refresh,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+    }
+    exit_code = 0
+    for msg in request(message, socket_path=args.socket):
+        if msg["type"] == "output":
+            stream = sys.stderr if msg["stream"] == "stderr" else sys.stdout
+            stream.write(msg["data"])
+            stream.flush()
+        elif msg["type"] == "result":
+            if args.json:
+                print(json.dumps(msg))
+            if msg["status"] == "error":
+                exit_code = 1
+        elif msg["type"] == "error":
+            print(f"Error: {msg['message']}", file=sys.stderr)
+            exit_code = 1
+        elif msg["type"] == "done" and not msg["ok"]:
+            exit_code = 1
+    return exit_code
+
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="vonzy-client", description="Run a workflow on the vonzy server"
+    )
+    parser.add_argument("-c", "--config", help="Configuration file")
+    parser.add_argument("-s", "--step", action="append", help="Step IDs to run")
+    parser.add_argument(
+        "-i",
+        "--input",
+        action="append",
+        type=parse_input,
+        help="Value of a workflow input, as KEY=VALUE",
+    )
+    parser.add_argument(
+        "-e", "--env", action="append", help="Environment variables file"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Maximum number of steps to run concurrently"
+    )
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="Use the asyncio engine"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the step cache")
+    parser.add_argument(
+        "--refresh", action="store_true", help="Replace the cached step results"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the step results as JSON lines"
+    )
+    parser.add_argument(
+        "--socket", default=SOCKET_PATH, help=f"Server socket [default: {SOCKET_PATH}]"
+    )
+    parser.add_argument("--shutdown", action="store_true", help="Stop the server")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.shutdown:
+            for _ in request({"command": "shutdown"}, socket_path=args.socket):
+                pass
+            return 0
+
+        if not args.config:
+            parser.error("the -c/--config option is required")
+        return run(args)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(
+            f"Error: the vonzy server is not running on {args.socket!r}",
+            file=sys.stderr,
+        )
+        return 2
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
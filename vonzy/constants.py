@@ -1 +1,43 @@
-BASE_RULE_JINJA_TEMPLATE = "{{ True if $expr else False }}"
+import os
+
+# Maximum number of compiled templates (and rules) kept in memory.
+TEMPLATE_CACHE_SIZE = 1024
+
+# Where vonzy keeps its caches (step results, parsed workflows, ...)
+CACHE_DIR = os.environ.get(
+    "VONZY_CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "vonzy"
+    ),
+)
+# Step cache eviction limits
+STEP_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+STEP_CACHE_MAX_SIZE = 64 * 1024 * 1024
+# Number of parsed workflows kept on disk
+WORKFLOW_CACHE_MAX_ENTRIES = 64
+# Number of run journals kept on disk (see `vonzy run --resume`)
+JOURNAL_MAX_RUNS = 100
+# Output of a step kept in memory, the rest is written to a temporary file
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Output of a finished step kept in memory (see `OutputBuffer.freeze`), the rest is read back from its file
+OUTPUT_TAIL_SIZE = 64 * 1024
+# Worker processes of the python action's process pool (None: one per CPU)
+PYTHON_POOL_SIZE = None
+# Workflow instances run at the same time by `vonzy run-batch`
+BATCH_WORKERS = 8
+# Shown instead of the value of a password input
+MASKED_VALUE = "***"
+# Unix socket of `vonzy serve`
+SOCKET_PATH = os.environ.get(
+    "VONZY_SOCKET",
+    os.path.join(os.environ.get("XDG_RUNTIME_DIR") or CACHE_DIR, "vonzy.sock"),
+)
+# `vonzy watch`: quiet period (in seconds) before the changes are handled, and interval of the polling fallback
+WATCH_DEBOUNCE = 0.2
+WATCH_POLL_INTERVAL = 0.5
+# Logging: JSON-lines log file, Rich console and number of records handled per batch by the logging thread
+LOG_FILE = os.environ.get("VONZY_LOG_FILE")
+LOG_CONSOLE = os.environ.get("VONZY_LOG_CONSOLE", "1") != "0"
+LOG_BATCH_SIZE = 512
+# maximum wait (in seconds) for the queued console records before something else is written to stdout/stderr
+LOG_FLUSH_TIMEOUT = 1.0
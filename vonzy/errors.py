@@ -8,3 +8,22 @@ class InvalidAction(Exception):
 
 class InvalidStep(Exception):
     pass
+
+
+class InvalidJournal(Exception):
+    pass
+
+
+class InvalidInput(Exception):
+    pass
+
+
+class HostsError(RuntimeError):
+    """
+    Raised when a command failed on one or more hosts.
+    The result of every host is available in `hosts`.
+    """
+
+    def __init__(self, message: str, hosts: dict):
+        super().__init__(message)
+        self.hosts = hosts
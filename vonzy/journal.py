@@ -0,0 +1,251 @@
+import json
+import os
+import secrets
+import threading
+import time
+import typing
+
+from .cache import _json_safe, hash_file
+from .constants import CACHE_DIR, JOURNAL_MAX_RUNS
+from .errors import InvalidJournal
+from .logger import log
+from .results import StepPath
+from .scheduler import find_step
+
+if typing.TYPE_CHECKING:
+    from .schema import Step, StepContext, StepResult, Workflow
+
+# statuses of the steps that completed, a run is complete when all its steps have one
+COMPLETED = frozenset({"success", "skipped"})
+# statuses of the steps that don't run again when the run is resumed. The rules of the skipped steps
+# are checked again, they can depend on steps that failed in the previous run.
+RESTORED = frozenset({"success"})
+
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S-") + secrets.token_hex(3)
+
+
+class RunJournal:
+    """
+    Append-only record of a workflow run (one JSON object per line, fsync'd after every write)
+    under `CACHE_DIR/runs`, used to resume the run from the steps that didn't complete.
+
+    The first line describes the run (workflow file, inputs), then every step result is appended
+    with the full path of the step. A resumed run appends to the same journal.
+    The values of the password inputs aren't written, they're prompted for again when the run is resumed.
+    """
+
+    def __init__(self, run_id: str, *, directory: typing.Optional[str] = None):
+        self.run_id = run_id
+        self.directory = directory or os.path.join(CACHE_DIR, "runs")
+        self.path = os.path.join(self.directory, run_id + ".jsonl")
+        self.header: typing.Optional[dict[str, typing.Any]] = None
+        self.records: list[dict[str, typing.Any]] = []
+        # last status of every step of this run (including the restored ones)
+        self._statuses: dict[StepPath, str] = {}
+        # loaded from the journal of a previous run, see `load`
+        self.resumed = False
+        self._file: typing.Optional[typing.TextIO] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, *, directory: typing.Optional[str] = None) -> "RunJournal":
+        journal = cls(new_run_id(), directory=directory)
+        journal.evict()
+        return journal
+
+    @classmethod
+    def load(
+        cls, run_id: str, *, directory: typing.Optional[str] = None
+    ) -> "RunJournal":
+        journal = cls(run_id, directory=directory)
+        try:
+            with open(journal.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            raise InvalidJournal(f"Run {run_id!r} not found") from None
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line is incomplete when the run was killed while writing it
+                log.debug("Ignoring a truncated record in %r", journal.path)
+                continue
+            if record.get("type") == "run":
+                journal.header = record
+            elif record.get("type") == "result":
+                journal.records.append(record)
+
+        if journal.header is None:
+            raise InvalidJournal(f"The journal of the run {run_id!r} has no header")
+        journal.resumed = True
+        return journal
+
+    @classmethod
+    def latest(
+        cls, source: str, *, directory: typing.Optional[str] = None
+    ) -> typing.Optional[str]:
+        """
+        The id of the most recent run of the workflow file `source`.
+        """
+
+        directory = directory or os.path.join(CACHE_DIR, "runs")
+        source = os.path.abspath(source)
+        try:
+            entries = sorted(
+                (e for e in os.scandir(directory) if e.name.endswith(".jsonl")),
+                key=lambda e: e.stat().st_mtime,
+                reverse=True,
+            )
+        except FileNotFoundError:
+            return None
+
+        for entry in entries:
+            try:
+                with open(entry.path) as f:
+                    header = json.loads(f.readline())
+            except (OSError, ValueError):
+                continue
+            if header.get("source") == source:
+                return header["run_id"]
+        return None
+
+    @property
+    def inputs(self) -> typing.Optional[dict[str, typing.Any]]:
+        return self.header.get("inputs") if self.header else None
+
+    @property
+    def secret_inputs(self) -> list[str]:
+        """
+        The keys of the inputs left out of the journal (see `start`).
+        """
+
+        return self.header.get("secret_inputs", []) if self.header else []
+
+    def start(self, workflow: "Workflow", sc: "StepContext"):
+        """
+        Open the journal for writing. A resumed run restores the results of the completed steps into `sc.steps`.
+        """
+
+        source = workflow._source_file and os.path.abspath(workflow._source_file)
+        digest = hash_file(source) if source else None
+        if self.resumed:
+            if self.header.get("source") != source:
+                raise InvalidJournal(
+                    f"Run {self.run_id!r} is a run of {self.header.get('source')!r}, not {source!r}"
+                )
+            if self.header.get("digest") != digest:
+                log.warning(
+                    "The workflow changed since run %r, its steps may not match the journal",
+                    self.run_id,
+                )
+            self.restore(workflow, sc)
+
+        # the journals hold the inputs and results of the runs, only the user can read them
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        os.chmod(self.directory, 0o700)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        os.fchmod(fd, 0o600)
+        self._file = os.fdopen(fd, "a")
+        if self.resumed:
+            self._write({"type": "resume", "created": time.time()})
+        else:
+            secrets = {
+                input.key for input in workflow.inputs if input.type == "password"
+            }
+            inputs = dict(sc.inputs or {})
+            self.header = {
+                "type": "run",
+                "run_id": self.run_id,
+                "workflow": workflow.name,
+                "source": source,
+                "digest": digest,
+                "inputs": _json_safe(
+                    {k: v for k, v in inputs.items() if k not in secrets}
+                ),
+                "secret_inputs": sorted(secrets & set(inputs)),
+                "created": time.time(),
+            }
+            self._write(self.header)
+
+    def restore(self, workflow: "Workflow", sc: "StepContext"):
+        from .schema import StepResult
+
+        latest: dict[StepPath, dict[str, typing.Any]] = {}
+        for record in self.records:
+            latest[tuple(record["path"])] = record
+
+        restored = 0
+        for path, record in latest.items():
+            step = find_step(workflow.steps, path)
+            if (
+                record["status"] not in RESTORED
+                or step is None
+                or (path[:-1] and path[:-1] not in sc.steps)
+            ):
+                continue
+            result = StepResult(
+                step=step,
+                status=record["status"],
+                value=record.get("value"),
+                exit_code=record.get("exit_code"),
+                cached=record.get("cached", False),
+            )
+            sc.steps.restore(path, result)
+            self._statuses[path] = result.status
+            restored += 1
+
+        log.info("Resuming run %r, %s steps already completed", self.run_id, restored)
+
+    def completed(self, step_ids: list[str]) -> bool:
+        """
+        Whether the top-level steps `step_ids` and all their child steps completed.
+        """
+
+        return all(
+            self._statuses.get((step_id,)) in COMPLETED for step_id in step_ids
+        ) and all(status in COMPLETED for status in self._statuses.values())
+
+    def append(self, path: StepPath, result: "StepResult"):
+        self._statuses[tuple(path)] = result.status
+        self._write(
+            {
+                "type": "result",
+                "path": list(path),
+                "status": result.status,
+                "value": _json_safe(result.value),
+                "exit_code": result.exit_code,
+                "cached": result.cached,
+                "time": time.time(),
+            }
+        )
+
+    def _write(self, record: dict[str, typing.Any]):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def evict(self, max_runs: int = JOURNAL_MAX_RUNS):
+        try:
+            entries = sorted(
+                (e for e in os.scandir(self.directory) if e.is_file()),
+                key=lambda e: e.stat().st_mtime,
+                reverse=True,
+            )
+        except FileNotFoundError:
+            return
+
+        for entry in entries[max_runs:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
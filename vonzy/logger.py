@@ -1,8 +1,273 @@
+import atexit
+import contextvars
+import datetime
+import json
 import logging
+import queue
+import sys
+import threading
+import traceback
+import typing
 
-from rich.logging import RichHandler
+from .constants import LOG_BATCH_SIZE, LOG_CONSOLE, LOG_FILE, LOG_FLUSH_TIMEOUT
 
 log = logging.getLogger("vonzy")
-log.addHandler(RichHandler(rich_tracebacks=True, show_path=False))
 log.setLevel(logging.NOTSET)
-log.info("Starting vonzy")
+
+# path of the running step (eg. "build.test") and index of the running command, added to every record
+current_step: contextvars.ContextVar[typing.Optional[str]] = contextvars.ContextVar(
+    "vonzy_step", default=None
+)
+current_command: contextvars.ContextVar[typing.Optional[int]] = contextvars.ContextVar(
+    "vonzy_command", default=None
+)
+
+_STOP = object()
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.step = current_step.get()
+        record.command = current_command.get()
+        return True
+
+
+class _QueueHandler(logging.Handler):
+    """
+    Puts the records on the queue of the `LogPipeline`, the handlers run on its thread.
+    """
+
+    def __init__(self, pipeline: "LogPipeline"):
+        # the records no handler of the pipeline takes aren't formatted nor queued
+        super().__init__(
+            min((h.level for h in pipeline.handlers), default=logging.CRITICAL + 1)
+        )
+        self.pipeline = pipeline
+        self.addFilter(_ContextFilter())
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            # the arguments can change once the call returns, but the exception info stays
+            # on the record so the console can still render the traceback
+            record.msg = record.getMessage()
+            record.args = None
+            self.pipeline.put(record)
+        except Exception:
+            self.handleError(record)
+
+
+class JsonLinesHandler(logging.Handler):
+    """
+    Writes the records as JSON lines (with the step and command fields), the records are buffered
+    and written at once on `flush` (after each batch handled by the `LogPipeline`).
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._file = open(path, "a")
+        self._buffer: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "step": getattr(record, "step", None),
+            "command": getattr(record, "command", None),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            data["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        self._buffer.append(json.dumps(data, default=str) + "\n")
+
+    def flush(self):
+        if self._buffer and self._file is not None:
+            self._file.write("".join(self._buffer))
+            self._file.flush()
+            self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+class LogPipeline:
+    """
+    Handles the records of the `vonzy` logger on a background thread, so rendering the console
+    and writing the log file don't slow down the steps. Records are handled in batches
+    (up to `LOG_BATCH_SIZE`) and the handlers are flushed after each batch.
+    """
+
+    def __init__(self, handlers: list[logging.Handler]):
+        self.handlers = handlers
+        self.queue: "queue.SimpleQueue[typing.Any]" = queue.SimpleQueue()
+        self._thread: typing.Optional[threading.Thread] = None
+        # number of records queued and not handled yet
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vonzy-log", daemon=True)
+        self._thread.start()
+
+    def put(self, record: logging.LogRecord):
+        with self._pending_lock:
+            self._pending += 1
+        self.queue.put_nowait(record)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            handled = 0
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    # see `flush`, set once the records before it are handled
+                    self._flush_handlers()
+                    item.set()
+                else:
+                    self._handle(item)
+                    handled += 1
+            self._flush_handlers()
+            with self._pending_lock:
+                self._pending -= handled
+            if stop:
+                return
+
+    def _handle(self, record: logging.LogRecord):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def _flush_handlers(self):
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+    def flush(self, timeout: typing.Optional[float] = None):
+        """
+        Wait until the records logged so far are handled.
+        """
+
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put_nowait(done)
+        done.wait(timeout)
+
+    def wait_pending(self):
+        """
+        Wait (up to `LOG_FLUSH_TIMEOUT`) until the records logged so far are handled, if there are any.
+        Doesn't wait on the logging thread, eg. when the console writes a record.
+        """
+
+        if self._pending and threading.current_thread() is not self._thread:
+            self.flush(LOG_FLUSH_TIMEOUT)
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put_nowait(_STOP)
+            self._thread.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+class _OrderedStream:
+    """
+    Replaces stdout/stderr while the console is rendered by the `LogPipeline`: the records logged
+    before something is written are rendered first, so the logs stay in order with the output of the actions.
+    """
+
+    def __init__(self, stream: typing.TextIO, pipeline: LogPipeline):
+        self.stream = stream
+        self.pipeline = pipeline
+
+    def write(self, data: str) -> int:
+        self.pipeline.wait_pending()
+        return self.stream.write(data)
+
+    def flush(self):
+        # called before writing to the underlying binary buffer too (eg. the output of the shell action)
+        self.pipeline.wait_pending()
+        self.stream.flush()
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self.stream, name)
+
+
+_pipeline: typing.Optional[LogPipeline] = None
+
+
+def setup_logging(
+    *, console: bool = LOG_CONSOLE, log_file: typing.Optional[str] = LOG_FILE
+):
+    """
+    Install the logging pipeline: the Rich console (unless `console` is false) and the JSON-lines `log_file`.
+    With the console, stdout and stderr wait for the records logged before anything is written to them
+    (see `_OrderedStream`). rich is only imported once something is going to be logged.
+    """
+
+    global _pipeline
+
+    if log.handlers:
+        return
+
+    handlers: list[logging.Handler] = []
+    if console:
+        from rich.console import Console
+        from rich.logging import RichHandler
+
+        # not the global console: printing with it waits for the records (see `_OrderedStream`)
+        # and would hold the lock the pipeline needs to render them
+        handlers.append(
+            RichHandler(console=Console(), rich_tracebacks=True, show_path=False)
+        )
+    if log_file:
+        handlers.append(JsonLinesHandler(log_file))
+
+    _pipeline = LogPipeline(handlers)
+    _pipeline.start()
+    log.addHandler(_QueueHandler(_pipeline))
+    if console:
+        sys.stdout = _OrderedStream(sys.stdout, _pipeline)
+        sys.stderr = _OrderedStream(sys.stderr, _pipeline)
+    log.info("Starting vonzy")
+
+
+def flush_logging():
+    if _pipeline is not None:
+        _pipeline.flush()
+
+
+@atexit.register
+def shutdown_logging():
+    global _pipeline
+
+    if _pipeline is None:
+        return
+    for handler in list(log.handlers):
+        if isinstance(handler, _QueueHandler):
+            log.removeHandler(handler)
+    if isinstance(sys.stdout, _OrderedStream):
+        sys.stdout = sys.stdout.stream
+    if isinstance(sys.stderr, _OrderedStream):
+        sys.stderr = sys.stderr.stream
+    _pipeline.stop()
+    _pipeline = None
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import threading
+import typing
+import weakref
+
+from .constants import OUTPUT_BUFFER_SIZE, OUTPUT_TAIL_SIZE
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class OutputBuffer:
+    """
+    Captured output of an action.
+
+    Up to `max_memory` bytes are kept in memory. Past that, the whole output goes to a temporary file
+    and only the last `max_memory` bytes stay in memory (for `tail`),
+    so the memory used doesn't depend on how much the commands print.
+
+    Once the step finished, `freeze` closes the file and keeps `tail_size` bytes in memory,
+    the file is only opened again to read the whole output.
+    """
+
+    def __init__(
+        self, max_memory: int = OUTPUT_BUFFER_SIZE, tail_size: int = OUTPUT_TAIL_SIZE
+    ):
+        self.max_memory = max_memory
+        self.tail_size = min(tail_size, max_memory)
+        self.size = 0
+        self._memory = bytearray()
+        self._path: typing.Optional[str] = None
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._finalizer: typing.Optional[weakref.finalize] = None
+        self._lock = threading.Lock()
+
+    @property
+    def spilled(self) -> bool:
+        return self._path is not None
+
+    def _spill(self):
+        fd, self._path = tempfile.mkstemp(prefix="vonzy-output-")
+        self._file = os.fdopen(fd, "wb")
+        # removed with the buffer (or at exit), the results outlive the step
+        self._finalizer = weakref.finalize(self, _remove, self._path)
+        self._file.write(self._memory)
+
+    def write(self, data: typing.Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode(errors="replace")
+
+        with self._lock:
+            self.size += len(data)
+            if self._path is None and len(self._memory) + len(data) > self.max_memory:
+                self._spill()
+            elif self._path is not None and self._file is None:
+                # written again after `freeze`
+                self._file = open(self._path, "ab")
+
+            if self._file is not None:
+                self._file.write(data)
+
+            self._memory += data
+            # trim the ring lazily, so a stream of small writes doesn't move the buffer on every write
+            if len(self._memory) > 2 * self.max_memory:
+                del self._memory[: -self.max_memory]
+
+    def freeze(self):
+        """
+        Called when the step finished: closes the temporary file and keeps the last `tail_size` bytes
+        in memory, so the finished steps don't hold a file descriptor and `max_memory` bytes each.
+        """
+
+        with self._lock:
+            if self._path is None and len(self._memory) > self.tail_size:
+                self._spill()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if len(self._memory) > self.tail_size:
+                del self._memory[: -self.tail_size]
+
+    def _read(self, offset: int = 0) -> bytes:
+        if self._file is not None:
+            self._file.flush()
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            return f.read()
+
+    def tail(self, size: typing.Optional[int] = None) -> str:
+        """
+        The last `size` bytes (at most `max_memory`) of the output.
+        """
+
+        size = min(size or self.max_memory, self.max_memory)
+        with self._lock:
+            if self._path is None or size <= len(self._memory):
+                return bytes(self._memory[-size:]).decode(errors="replace")
+            return self._read(max(self.size - size, 0)).decode(errors="replace")
+
+    def getvalue(self) -> str:
+        with self._lock:
+            if self._path is None:
+                return self._memory.decode(errors="replace")
+            return self._read().decode(errors="replace")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self._path = None
+            self._memory = bytearray()
+
+    def __str__(self) -> str:
+        return self.getvalue()
+
+    def __repr__(self) -> str:
+        return f"<OutputBuffer size={self.size} spilled={self.spilled}>"
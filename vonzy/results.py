@@ -0,0 +1,162 @@
+import typing
+
+if typing.TYPE_CHECKING:
+    from .schema import StepResult
+
+StepPath = tuple[str, ...]
+
+
+class StepRecord:
+    """
+    The result of one step and the records of its child steps, by id.
+    """
+
+    __slots__ = ("path", "result", "children")
+
+    def __init__(self, path: StepPath, result: typing.Optional["StepResult"] = None):
+        self.path = path
+        self.result = result
+        self.children: dict[str, "StepRecord"] = {}
+
+
+class StepsView:
+    """
+    Read-only access to the step results for templates and rules, eg. `steps.build.test.result.status`.
+
+    Every attribute (or item) lookup is a single dict lookup. Unknown steps raise `AttributeError`
+    (or `KeyError` for item access), `result` is the `StepResult` of the step.
+    """
+
+    __slots__ = ("_record",)
+
+    def __init__(self, record: StepRecord):
+        object.__setattr__(self, "_record", record)
+
+    def _child(self, key: str) -> "StepsView":
+        try:
+            return StepsView(self._record.children[key])
+        except KeyError:
+            path = ".".join((*self._record.path, key))
+            raise KeyError(f"step {path!r} has no result") from None
+
+    def __getattr__(self, name: str) -> typing.Any:
+        if name == "result" and self._record.path:
+            return self._record.result
+        try:
+            return self._child(name)
+        except KeyError as e:
+            raise AttributeError(*e.args) from None
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key == "result" and self._record.path:
+            return self._record.result
+        return self._child(key)
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setattr__(self, name: str, value: typing.Any):
+        raise TypeError("step results are read-only")
+
+    __setitem__ = __setattr__
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._record.children
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(list(self._record.children))
+
+    def __len__(self) -> int:
+        return len(self._record.children)
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """
+        The results as nested dicts, eg. `{'result': StepResult(...), 'test': {'result': StepResult(...)}}`.
+        """
+
+        data: dict[str, typing.Any] = {}
+        if self._record.path:
+            data["result"] = self._record.result
+        for key, child in self._record.children.items():
+            data[key] = StepsView(child).to_dict()
+        return data
+
+    # rendered like the nested dicts the step results used to be stored in (eg. `{{ steps.build }}`)
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class ResultStore:
+    """
+    The results of a workflow run, indexed by the full path of the step (its id, preceded by the ids of its parents).
+    """
+
+    def __init__(self):
+        self._root = StepRecord(())
+        self._records: dict[StepPath, StepRecord] = {(): self._root}
+        # results restored from the journal of a previous run, not taken by their step yet
+        self._restored: set[StepPath] = set()
+
+    def set(self, path: StepPath, result: "StepResult") -> StepRecord:
+        path = tuple(path)
+        parent = self._records.get(path[:-1])
+        if parent is None:
+            raise KeyError(f"parent step {'.'.join(path[:-1])!r} has no result")
+
+        record = self._records.get(path)
+        if record is None:
+            record = StepRecord(path, result)
+            self._records[path] = record
+            parent.children[path[-1]] = record
+        else:
+            record.result = result
+        return record
+
+    def restore(self, path: StepPath, result: "StepResult") -> StepRecord:
+        """
+        Set the result of a step that completed in a previous run, the step won't run again (see `take_restored`).
+        """
+
+        record = self.set(path, result)
+        self._restored.add(tuple(path))
+        return record
+
+    def take_restored(self, path: StepPath) -> typing.Optional["StepResult"]:
+        if not self._restored:
+            return None
+        try:
+            self._restored.remove(tuple(path))
+        except KeyError:
+            return None
+        return self.get(path)
+
+    def get(self, path: StepPath) -> typing.Optional["StepResult"]:
+        record = self._records.get(tuple(path))
+        return record.result if record is not None else None
+
+    def __contains__(self, path: typing.Union[str, StepPath]) -> bool:
+        if isinstance(path, str):
+            path = (path,)
+        return tuple(path) in self._records and bool(path)
+
+    # Top-level steps are also available as attributes/items like in templates (eg. `context.steps.build.result`).
+
+    def __getattr__(self, name: str) -> typing.Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.view(), name)
+
+    def __getitem__(self, key: str) -> typing.Any:
+        return self.view()[key]
+
+    def __len__(self) -> int:
+        return len(self._records) - 1
+
+    def view(self) -> StepsView:
+        return StepsView(self._root)
+
+    def __repr__(self) -> str:
+        return f"<ResultStore {len(self)} results>"
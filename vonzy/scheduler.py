@@ -0,0 +1,170 @@
+import asyncio
+import queue
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .errors import InvalidStep
+
+if typing.TYPE_CHECKING:
+    from .schema import Step, StepResult
+
+_DONE = object()
+
+
+def validate_needs(steps: list["Step"]) -> list["Step"]:
+    """
+    Make sure the `needs` of every step point to a sibling step and don't form a cycle.
+    """
+
+    step_ids = set()
+    for step in steps:
+        if step.id in step_ids:
+            raise InvalidStep(f"Duplicate step id {step.id!r}")
+        step_ids.add(step.id)
+
+    for step in steps:
+        for dep in step.needs:
+            if dep not in step_ids:
+                raise InvalidStep(f"Step {step.id!r} needs an unknown step {dep!r}")
+
+    topological_order(steps)
+    return steps
+
+
+def find_step(
+    steps: list["Step"], path: typing.Sequence[str]
+) -> typing.Optional["Step"]:
+    """
+    The step at `path` (its id, preceded by the ids of its parents) in the tree of `steps`.
+    """
+
+    step = None
+    for step_id in path:
+        step = next((s for s in steps if s.id == step_id), None)
+        if step is None:
+            return None
+        steps = step.steps
+    return step
+
+
+def topological_order(steps: list["Step"]) -> list["Step"]:
+    """
+    Order the steps so that every step comes after the steps it needs.
+    Steps that don't depend on each other keep their declaration order.
+    """
+
+    pending = list(steps)
+    done: set[str] = set()
+    ordered = []
+    while pending:
+        for idx, step in enumerate(pending):
+            if done.issuperset(step.needs):
+                break
+        else:
+            cycle = ", ".join(repr(s.id) for s in pending)
+            raise InvalidStep(f"Dependency cycle detected between steps {cycle}")
+
+        pending.pop(idx)
+        done.add(step.id)
+        ordered.append(step)
+
+    return ordered
+
+
+def _needs(
+    step: "Step", needs: typing.Optional[typing.Mapping[str, typing.Iterable[str]]]
+) -> typing.Iterable[str]:
+    return step.needs if needs is None else needs[step.id]
+
+
+def run_steps(
+    steps: list["Step"],
+    run_step: typing.Callable[["Step"], typing.Iterable[typing.Optional["StepResult"]]],
+    *,
+    jobs: int = 1,
+    needs: typing.Optional[typing.Mapping[str, typing.Iterable[str]]] = None,
+) -> typing.Iterator[typing.Optional["StepResult"]]:
+    """
+    Run the steps following their `needs` dependencies.
+
+    With `jobs=1` the steps run one by one (in topological order) on the calling thread.
+    Otherwise, steps whose dependencies have finished run concurrently on a pool of `jobs` workers
+    and the results are yielded as soon as they are produced. `needs` replaces the `needs` of the steps
+    (see `DependencyGraph.run_needs`), it must keep their topological order.
+    """
+
+    if jobs <= 1:
+        for step in topological_order(steps):
+            yield from run_step(step)
+        return
+
+    results: "queue.Queue[tuple[Step, typing.Any]]" = queue.Queue()
+
+    def worker(step: "Step"):
+        try:
+            for result in run_step(step):
+                results.put((step, result))
+        except BaseException as e:
+            results.put((step, e))
+        finally:
+            results.put((step, _DONE))
+
+    pending = list(steps)
+    done: set[str] = set()
+    futures: list[Future] = []
+    running = 0
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="vonzy-step")
+    try:
+        while pending or running:
+            ready = [s for s in pending if done.issuperset(_needs(s, needs))]
+            for step in ready:
+                pending.remove(step)
+                futures.append(executor.submit(worker, step))
+                running += 1
+
+            step, item = results.get()
+            if item is _DONE:
+                done.add(step.id)
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        for fut in futures:
+            fut.cancel()
+        executor.shutdown(wait=True)
+
+
+async def arun_steps(
+    steps: list["Step"],
+    run_step: typing.Callable[["Step"], typing.Awaitable[None]],
+    *,
+    needs: typing.Optional[typing.Mapping[str, typing.Iterable[str]]] = None,
+):
+    """
+    Async version of `run_steps`: every step runs in its own task as soon as its dependencies have finished.
+    Returns when all the steps are done, the steps still running are cancelled if one of them fails
+    or if this coroutine is cancelled.
+    """
+
+    pending = list(steps)
+    done: set[str] = set()
+    tasks: dict[asyncio.Task, "Step"] = {}
+    try:
+        while pending or tasks:
+            ready = [s for s in pending if done.issuperset(_needs(s, needs))]
+            for step in ready:
+                pending.remove(step)
+                task = asyncio.create_task(run_step(step), name=f"step-{step.id}")
+                tasks[task] = step
+
+            finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                step = tasks.pop(task)
+                task.result()
+                done.add(step.id)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
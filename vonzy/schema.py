@@ -1,25 +1,38 @@
+import asyncio
 import logging
 import os
-import string
-from ast import literal_eval
+import time
 from enum import Enum
 from importlib import import_module
 from io import BufferedReader
-from typing import Any, Callable, Literal, Optional, Type, TypeVar, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Literal,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+)
 
-import oyaml as yaml
-from inquirer import Checkbox, List, Password, Text, prompt
-from inquirer.questions import Question
-from jinja2 import Template
 from pydantic import BaseModel, Field, PrivateAttr, validator
 
 from . import actions
-from .actions.base import BaseAction
-from .constants import BASE_RULE_JINJA_TEMPLATE
+from .actions.base import BaseAction, step_tree_scope
+from .analysis import DependencyGraph
+from .cache import StepCache, WorkflowCache
+from .constants import MASKED_VALUE
 from .datatype import AttrDict
-from .errors import InvalidAction, InvalidStep, MissingDependency
-from .logger import log
-from .utils import render_step_context
+from .errors import InvalidAction, InvalidInput, InvalidStep, MissingDependency
+from .journal import RunJournal
+from .logger import current_command, current_step, log, setup_logging
+from .output import OutputBuffer
+from .results import ResultStore
+from .scheduler import arun_steps, run_steps, validate_needs
+from .tracing import tracer
+from .utils import evaluate_rule, render_step_context
 
 try:
     from dotenv import load_dotenv
@@ -31,6 +44,9 @@ try:
 except ImportError:
     EmailStr = None  # type: ignore[assignment, misc]
 
+if TYPE_CHECKING:
+    from inquirer.questions import Question
+
 T = TypeVar("T")
 
 
@@ -78,7 +94,9 @@ class Input(BaseModel):
             v = self.default
         return v
 
-    def get_widget(self) -> tuple[Type[Question], dict]:
+    def get_widget(self) -> tuple[Type["Question"], dict]:
+        from inquirer import Checkbox, List, Password, Text
+
         widget_obj = Text
         widget_params = {
             "name": self.key,
@@ -117,14 +135,33 @@ class CommandRule(BaseModel):
     cmd: Union[str, dict]
 
 
+class CacheOptions(BaseModel):
+    # glob patterns of the input files of the step
+    paths: list[str] = Field(default_factory=list)
+    # environment variables the step depends on
+    env: list[str] = Field(default_factory=list)
+    # maximum age (in seconds) of a cached result
+    max_age: Optional[int] = None
+
+
 class Step(BaseModel):
     id: str
     name: str
     use: Union[Action, str]
     rule: Optional[str]
     commands: list[Union[str, CommandRule]] = Field(default_factory=list)
+    needs: list[str] = Field(default_factory=list)
+    cache: Optional[CacheOptions] = None
+    # maximum duration (in seconds) of the action, only enforced by the async engine (see `Workflow.arun`).
+    # The blocking call of an action running in a worker thread is aborted (see `BaseAction.abort`), the actions
+    # that can't abort it (eg. a python function) time out once it returned.
+    timeout: Optional[float] = Field(None, gt=0)
+    # glob patterns of the files the step depends on, `vonzy watch` reruns the step when they change
+    watch: list[str] = Field(default_factory=list)
     steps: list["Step"] = Field(default_factory=list)
 
+    _graph: Optional[DependencyGraph] = PrivateAttr(None)
+
     @validator("id", always=True)
     def validate_id(cls, v: str):
         if v == "result":
@@ -133,12 +170,75 @@ class Step(BaseModel):
             )
         return v
 
-    def load_action(self, sc: "StepContext") -> Action:
+    @validator("cache", pre=True)
+    def validate_cache(cls, v: Any):
+        # `cache: true` enables the cache without any input files or environment variables.
+        if v is True:
+            v = CacheOptions()
+        elif v is False:
+            v = None
+        return v
+
+    @validator("steps")
+    def validate_steps(cls, v: list["Step"]):
+        return validate_needs(v)
+
+    def dependency_graph(self, path: tuple[str, ...]) -> DependencyGraph:
+        """
+        The dependencies between the child steps of this step, `path` is the path of this step.
+        """
+
+        if self._graph is None:
+            self._graph = DependencyGraph(self.steps, prefix=path)
+        return self._graph
+
+    def get_action(self) -> Action:
         use_action = self.use
         if isinstance(use_action, str):
             use_action = Action(name=use_action)
+        return use_action
+
+    def render_params(self, sc: "StepContext") -> dict[str, Any]:
+        action_params = {}
+        for k, v in (self.get_action().params or {}).items():
+            if isinstance(v, str):
+                v = render_step_context(v, context=sc)
+            if isinstance(v, list):
+                nv = []
+                for vv in v:
+                    if isinstance(vv, str):
+                        vv = render_step_context(vv, context=sc)
+                    nv.append(vv)
+                v = nv
+            if isinstance(v, dict):
+                v = {
+                    kk: render_step_context(vv, context=sc)
+                    if isinstance(vv, str)
+                    else vv
+                    for kk, vv in v.items()
+                }
+            action_params[k] = v
+        return action_params
+
+    def render_commands(self, sc: "StepContext") -> list[Any]:
+        commands = []
+        for cmd in self.commands:
+            if isinstance(cmd, CommandRule):
+                cmd = {"rule": cmd.rule, "cmd": cmd.cmd}
+            elif isinstance(cmd, str):
+                cmd = render_step_context(cmd.strip(), context=sc)
+            commands.append(cmd)
+        return commands
 
-        log.info(f"Loading action {use_action.name!r}")
+    def load_action(self, sc: "StepContext") -> Action:
+        with tracer.span("action.load", step=self.id):
+            return self._load_action(sc)
+
+    def _load_action(self, sc: "StepContext") -> Action:
+        # the step (and its `use`) is shared by every run of the workflow, the instance is kept on a copy
+        use_action = self.get_action().copy()
+
+        log.info("Loading action %r", use_action.name)
         try:
             action_name = use_action.name.lstrip(".")
             action_class = actions.__cached_actions__.get(action_name)
@@ -152,22 +252,10 @@ class Step(BaseModel):
                 else:
                     actions.__cached_actions__[action_name] = action_class
 
-            log.info(f"Action {action_name!r} loaded")
-            action_params = {}
-            for k, v in (use_action.params or {}).items():
-                if isinstance(v, str):
-                    v = render_step_context(v, context=sc)
-                if isinstance(v, list):
-                    nv = []
-                    for vv in v:
-                        if isinstance(vv, str):
-                            vv = render_step_context(vv, context=sc)
-                        nv.append(vv)
-                    v = nv
-                action_params[k] = v
-
+            log.info("Action %r loaded", action_name)
+            action_params = self.render_params(sc)
             action_instance = action_class(**action_params)
-            log.debug(f"Action {action_instance} initialized")
+            log.debug("Action %s initialized", action_instance)
             use_action._instance = action_instance
             return use_action
 
@@ -175,105 +263,298 @@ class Step(BaseModel):
             raise InvalidAction(f"Action {action_name!r} not found")
 
     def _validate_rule(self, expr: str, sc: "StepContext") -> bool:
-        rule_expr = string.Template(BASE_RULE_JINJA_TEMPLATE).substitute(expr=expr)
-        result = Template(rule_expr).render(sc.to_context())
-        rv = literal_eval(result)
-        return rv
+        return evaluate_rule(expr, context=sc)
+
+    def run(
+        self,
+        sc: "StepContext",
+        *,
+        parent_step_ids: Optional[list[str]] = None,
+        cache: Optional[StepCache] = None,
+    ):
+        previous = current_step.get()
+        current_step.set(".".join((*(parent_step_ids or []), self.id)))
+        try:
+            with tracer.span(f"step.{self.id}", parents=parent_step_ids or []):
+                yield from self._run(sc, parent_step_ids=parent_step_ids, cache=cache)
+        finally:
+            current_step.set(previous)
 
-    def run(self, sc: "StepContext", *, parent_step_ids: Optional[list[str]] = None):
+    def _start(
+        self, sc: "StepContext", parent_step_ids: Optional[list[str]]
+    ) -> tuple[str, ...]:
         step_id = self.id
-        steps_ctx = sc.steps
-        if not isinstance(steps_ctx, AttrDict):
-            steps_ctx = AttrDict()
-            sc.steps = steps_ctx
-
-        sc.steps = steps_ctx
-        _current_step_data: Optional[AttrDict] = None
-        if parent_step_ids:
-            for sid in parent_step_ids:
-                if _current_step_data:
-                    _current_step_data = _current_step_data.get(sid)
-                else:
-                    _current_step_data = steps_ctx.get(sid)
-
-                if _current_step_data is None:
-                    raise InvalidStep(f"Step {sid!r} not found -> {parent_step_ids}")
-
-        if not _current_step_data:
-            _current_step_data = steps_ctx
+        if sc.steps is None:
+            sc.steps = ResultStore()
+        path = (*(parent_step_ids or []), step_id)
+        if path[:-1] and path[:-1] not in sc.steps:
+            raise InvalidStep(f"Step {path[-2]!r} not found -> {parent_step_ids}")
 
         realname = render_step_context(self.name, context=sc)
-        self.name = realname
-        log.info(f"Running step {self.name!r} #{step_id}")
-        result_class = StepResult
+        log.info("Running step %r #%s", realname, step_id)
+        return path
+
+    def _lookup(
+        self, sc: "StepContext", path: tuple[str, ...], cache: Optional[StepCache]
+    ) -> tuple[Optional["StepResult"], Optional[str]]:
+        """
+        Returns the result of the step if it doesn't have to run (completed in the resumed run,
+        skipped by its rule or cached) and the cache key of the step.
+        """
+
+        restored = sc.steps.take_restored(path)
+        if restored is not None:
+            log.info(
+                "Step %r already completed with status=%s", self.id, restored.status
+            )
+            return restored, None
+
         if self.rule:
             rule_passed = self._validate_rule(self.rule, sc)
             if not rule_passed:
-                log.info(f"Step {self.id!r} skipped")
-                result = result_class(step=self, status="skipped", value=None)
-                _current_step_data[step_id] = AttrDict(result=result)
-                yield result
-                return
+                log.info("Step %r skipped", self.id)
+                return StepResult(step=self, status="skipped", value=None), None
+
+        if self.cache and cache is not None:
+            cache_key = cache.fingerprint(self, sc)
+            record = cache.lookup(self, cache_key)
+            if record is not None:
+                log.info("Step %r is up to date, using the cached result", self.id)
+                result = StepResult(
+                    step=self, status="success", value=record["value"], cached=True
+                )
+                return result, cache_key
+            return None, cache_key
+
+        return None, None
+
+    def _finish(
+        self,
+        sc: "StepContext",
+        path: tuple[str, ...],
+        result: "StepResult",
+        *,
+        cache: Optional[StepCache] = None,
+        cache_key: Optional[str] = None,
+    ):
+        if cache_key is not None and result.status == "success" and not result.cached:
+            cache.store(self, cache_key, result.value)
+
+        log.info("Step %r finished with status=%s", self.id, result.status)
+        if log.isEnabledFor(logging.DEBUG):
+            _R = result.dict(exclude={"step", "output"})
+            log.debug("Result %s for step %r", _R, self.id)
+        self._set_result(sc, path, result)
+
+    def _set_result(
+        self, sc: "StepContext", path: tuple[str, ...], result: "StepResult"
+    ):
+        sc.steps.set(path, result)
+        if sc.journal is not None:
+            sc.journal.append(path, result)
+
+    def _run(
+        self,
+        sc: "StepContext",
+        *,
+        parent_step_ids: Optional[list[str]] = None,
+        cache: Optional[StepCache] = None,
+    ):
+        path = self._start(sc, parent_step_ids)
+        result, cache_key = self._lookup(sc, path, cache)
+        if result is not None and result.status == "skipped":
+            self._set_result(sc, path, result)
+            yield result
+            return
+
+        if result is None:
+            result = self._run_action(sc)
+
+        self._finish(sc, path, result, cache=cache, cache_key=cache_key)
+        yield result
+        yield from run_steps(
+            self.steps,
+            lambda step: step.run(sc, parent_step_ids=list(path), cache=cache),
+        )
 
+    def _run_action(self, sc: "StepContext") -> "StepResult":
         action_obj = self.load_action(sc)
-        result = None
         try:
-            action_obj._instance.initialize()
-            commands = action_obj._instance.handle_commands(self.commands, context=sc)
-            for cmd in commands:
-                if isinstance(cmd, CommandRule):
-                    if not self._validate_rule(cmd.rule, sc):
-                        log.debug(f"Command {cmd.cmd!r} skipped.")
-                        continue
-                    cmd = cmd.cmd
-
-                kwargs = {}
-                args = (cmd,)
-                kwargs["context"] = sc
-                action_obj._instance.execute(*args, **kwargs)
-            result = result_class(step=self, status="success", value=None)
+            with tracer.span("action.initialize", step=self.id):
+                action_obj._instance.initialize()
+            for cmd in self._iter_commands(action_obj._instance, sc):
+                with tracer.span("action.execute", step=self.id, cmd=cmd):
+                    action_obj._instance.execute(cmd, context=sc)
+            status, value = "success", action_obj._instance.get_result()
         except Exception as e:
-            result = result_class(step=self, status="error", value=e)
+            status, value = "error", e
         finally:
             try:
-                action_obj._instance.cleanup()
+                with tracer.span("action.cleanup", step=self.id):
+                    action_obj._instance.cleanup()
             except Exception as e:
                 log.error(
-                    f"Error cleaning up action {action_obj.name!r} on step {self.id!r}: {e}"
+                    "Error cleaning up action %r on step %r: %s",
+                    action_obj.name,
+                    self.id,
+                    e,
                 )
-                result = result_class(step=self, status="error", value=e)
+                status, value = "error", e
 
-        _R = result.dict(exclude={"step"})
-        log.info(f"Step {self.id!r} finished with status={_R['status']}")
-        log.debug(f"Result {_R} for step {self.id!r}")
-        _current_step_data[step_id] = AttrDict(result=result)
-        yield result
-        for child_step in self.steps:
-            if parent_step_ids is None:
-                parent_step_ids = [self.id]
+        return self._make_result(action_obj._instance, status, value)
+
+    def _iter_commands(self, instance: BaseAction, sc: "StepContext"):
+        commands = instance.handle_commands(self.commands, context=sc)
+        for idx, cmd in enumerate(commands):
+            if isinstance(cmd, CommandRule):
+                if not self._validate_rule(cmd.rule, sc):
+                    log.debug("Command %r skipped.", cmd.cmd)
+                    continue
+                cmd = cmd.cmd
+            current_command.set(idx)
+            yield cmd
+        current_command.set(None)
+
+    def _make_result(
+        self, instance: BaseAction, status: str, value: Any
+    ) -> "StepResult":
+        output = instance.get_output()
+        if output is not None:
+            # the step is done writing, don't keep its spill file open until the end of the run
+            output.freeze()
+        return StepResult(
+            step=self,
+            status=status,
+            value=value,
+            exit_code=instance.get_exit_code(),
+            output=output,
+        )
+
+    async def arun(
+        self,
+        sc: "StepContext",
+        *,
+        on_result: Callable[["StepResult"], None],
+        parent_step_ids: Optional[list[str]] = None,
+        cache: Optional[StepCache] = None,
+        limit: Optional[asyncio.Semaphore] = None,
+    ):
+        """
+        Async version of `run`, the results are passed to `on_result` as soon as they are produced.
+        The child steps run concurrently (following their `needs`),
+        `limit` bounds the number of actions running at the same time.
+        """
+
+        # every step runs in its own task, so the step field of the log records doesn't leak to other steps
+        current_step.set(".".join((*(parent_step_ids or []), self.id)))
+        path = self._start(sc, parent_step_ids)
+        result, cache_key = self._lookup(sc, path, cache)
+        if result is not None and result.status == "skipped":
+            self._set_result(sc, path, result)
+            on_result(result)
+            return
+
+        if result is None:
+            if limit is not None:
+                async with limit:
+                    result = await self._arun_action(sc)
             else:
-                parent_step_ids.append(self.id)
+                result = await self._arun_action(sc)
+
+        self._finish(sc, path, result, cache=cache, cache_key=cache_key)
+        on_result(result)
+        await arun_steps(
+            self.steps,
+            lambda step: step.arun(
+                sc,
+                on_result=on_result,
+                parent_step_ids=list(path),
+                cache=cache,
+                limit=limit,
+            ),
+            needs=self.dependency_graph(path).run_needs() if self.steps else None,
+        )
+
+    async def _arun_action(self, sc: "StepContext") -> "StepResult":
+        action_obj = self.load_action(sc)
+        instance = action_obj._instance
+        try:
+            await asyncio.wait_for(self._aexecute(instance, sc), self.timeout)
+            status, value = "success", instance.get_result()
+        except asyncio.TimeoutError:
+            log.error("Step %r timed out after %ss", self.id, self.timeout)
+            status, value = "error", TimeoutError(
+                f"Step {self.id!r} timed out after {self.timeout}s"
+            )
+        except Exception as e:
+            status, value = "error", e
+        finally:
+            # also runs when the step is cancelled (eg. Ctrl-C), so the action can stop its processes.
+            try:
+                await instance.acleanup()
+            except Exception as e:
+                log.error(
+                    "Error cleaning up action %r on step %r: %s",
+                    action_obj.name,
+                    self.id,
+                    e,
+                )
+                status, value = "error", e
 
-            for child_result in child_step.run(sc, parent_step_ids=parent_step_ids):
-                yield child_result
+        return self._make_result(instance, status, value)
+
+    async def _aexecute(self, instance: BaseAction, sc: "StepContext"):
+        await instance.ainitialize()
+        for cmd in self._iter_commands(instance, sc):
+            await instance.aexecute(cmd, context=sc)
 
 
 class StepResult(BaseModel):
     step: Step
     status: Literal["success", "error", "skipped"]
     value: Optional[Any]
+    exit_code: Optional[int] = None
+    output: Optional[OutputBuffer] = None
+    # the step didn't run, its successful result was taken from the step cache
+    cached: bool = False
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def stdout(self) -> Optional[str]:
+        """
+        The captured output of the step, read (from the spill file, see `OutputBuffer`) on access.
+        """
+
+        if self.output is None:
+            return None
+        return self.output.getvalue()
 
 
 class StepContext(BaseModel):
     env: AttrDict
     inputs: Optional[AttrDict]
-    steps: Optional[AttrDict[str, StepResult]]
+    steps: Optional[ResultStore]
+    journal: Optional[RunJournal] = None
+    # path of the workflow file (or the name of the workflow), keeps the step cache keys of workflows apart
+    workflow: Optional[str] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @validator("env", "inputs", pre=True)
+    def _validate_attrdict(cls, v: Any):
+        # templates are rendered with attribute access (eg. `{inputs.key}`), so the mappings must be `AttrDict`.
+        if v is not None and not isinstance(v, AttrDict):
+            v = AttrDict(v)
+        return v
 
     def to_context(self) -> dict[str, Any]:
         return {
             "env": self.env,
             "inputs": self.inputs,
-            "steps": self.steps,
+            "steps": self.steps.view() if self.steps is not None else None,
         }
 
 
@@ -285,6 +566,7 @@ class Workflow(BaseModel):
     steps: list[Step] = Field(default_factory=list)
 
     _source_file: Optional[str] = PrivateAttr(None)
+    _graph: Optional[DependencyGraph] = PrivateAttr(None)
 
     @validator("log_level")
     def _validate_and_set_log_level(cls, v: str):
@@ -294,9 +576,32 @@ class Workflow(BaseModel):
         log.setLevel(v)
         return v
 
+    @validator("steps")
+    def _validate_steps(cls, v: list[Step]):
+        return validate_needs(v)
+
+    def dependency_graph(self) -> DependencyGraph:
+        """
+        The dependencies between the top-level steps, from their `needs` and the step results
+        used by their templates and rules (analyzed on first use).
+        """
+
+        if self._graph is None:
+            self._graph = DependencyGraph(self.steps)
+        return self._graph
+
     def before_run(self, sc: StepContext):
-        questions: list[Question] = []
-        for input in self.inputs:
+        if not self.inputs:
+            return {}
+
+        with tracer.span("inputs.prompt"):
+            return self._prompt_inputs(sc)
+
+    def _prompt_inputs(self, sc: StepContext, inputs: Optional[list[Input]] = None):
+        from inquirer import prompt
+
+        questions: list["Question"] = []
+        for input in self.inputs if inputs is None else inputs:
             widget_class, widget_params = input.get_widget()
             default = widget_params["default"]
             if isinstance(default, str):
@@ -319,10 +624,42 @@ class Workflow(BaseModel):
                 load_dotenv(f)
 
     @classmethod
-    def parse_config(cls, config: BufferedReader):
-        data = yaml.safe_load(config)
-        instance = cls(**data)
+    def parse_config(cls, config: BufferedReader, *, use_cache: bool = True):
+        """
+        Parse and validate a workflow file.
+        With `use_cache`, a workflow that was already validated is loaded from the `WorkflowCache`
+        without parsing the YAML or running the validators again.
+        """
+
+        start = time.perf_counter_ns()
+        content = config.read()
+        if isinstance(content, str):
+            content = content.encode()
+
+        cache = WorkflowCache() if use_cache else None
+        key = cache.make_key(content) if cache else None
+        instance = cache.load(key) if cache else None
+        cache_hit = instance is not None
+        if cache_hit:
+            log.setLevel(instance.log_level)
+        else:
+            import yaml
+
+            # libyaml is much faster than the pure python loader, use it when available.
+            loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            data = yaml.load(content, Loader=loader)
+            instance = cls(**data)
+            if cache:
+                cache.store(key, instance)
+
         instance._source_file = config.name
+        tracer.add(
+            "workflow.load",
+            start,
+            time.perf_counter_ns(),
+            source=config.name,
+            cached=cache_hit,
+        )
         return instance
 
     @classmethod
@@ -330,29 +667,216 @@ class Workflow(BaseModel):
         with open(src, "rb") as f:
             return cls.parse_config(f)
 
-    def run(self, step_ids: Optional[list[str]] = None):
-        self.load_env_file()
-        try:
-            ctx = StepContext(
-                env=AttrDict(**os.environ),
-            )
+    def resolve_inputs(
+        self, values: dict[str, Any], sc: Optional[StepContext] = None
+    ) -> dict[str, Any]:
+        """
+        Check the input `values` of a non-interactive run and complete them with the defaults of the inputs.
+        """
+
+        if sc is None:
+            sc = StepContext(env=AttrDict(**os.environ))
+
+        unknown = set(values) - {input.key for input in self.inputs}
+        if unknown:
+            raise InvalidInput(f"Unknown inputs {', '.join(sorted(unknown))}")
+
+        resolved = {}
+        for input in self.inputs:
+            value = values.get(input.key)
+            if value is None or value == "":
+                value = input.get_real_value()
+                if isinstance(value, str):
+                    value = render_step_context(value, context=sc)
+            if value is None or value == "":
+                if input.required:
+                    raise InvalidInput(f"Input {input.key!r} is required")
+                resolved[input.key] = value
+                continue
+
+            if input.type == Input.Types.checkbox:
+                if isinstance(value, str):
+                    value = [v.strip() for v in value.split(",") if v.strip()]
+                choices = value
+            else:
+                choices = [value]
+            # the errors don't show the values of the password inputs
+            shown = MASKED_VALUE if input.type == Input.Types.password else repr(value)
+            if input.choices and any(v not in input.choices for v in choices):
+                raise InvalidInput(
+                    f"Invalid value {shown} for input {input.key!r}, expected one of {input.choices}"
+                )
+
+            validator = input.get_value_validator()
+            if validator is not None and not validator(None, value):
+                raise InvalidInput(
+                    f"Invalid value {shown} for the {input.type.value} input {input.key!r}"
+                )
+            resolved[input.key] = value
+        return resolved
+
+    def mask_inputs(self, values: dict[str, Any]) -> dict[str, Any]:
+        """
+        The input `values` to show, the values of the password inputs are masked.
+        """
+
+        secrets = {
+            input.key for input in self.inputs if input.type == Input.Types.password
+        }
+        return {k: MASKED_VALUE if k in secrets else v for k, v in values.items()}
+
+    def _make_context(
+        self,
+        journal: Optional[RunJournal] = None,
+        inputs: Optional[dict[str, Any]] = None,
+    ) -> StepContext:
+        ctx = StepContext(
+            env=AttrDict(**os.environ),
+            workflow=(
+                os.path.abspath(self._source_file) if self._source_file else self.name
+            ),
+        )
+        # a resumed run keeps the inputs of the run, the password inputs (not in the journal) are asked again
+        if journal is not None and journal.resumed:
+            inputs_ctx = dict(journal.inputs or {})
+            secrets = [i for i in self.inputs if i.key in journal.secret_inputs]
+            if secrets and inputs is not None:
+                inputs_ctx.update(
+                    {i.key: inputs.get(i.key) for i in secrets if i.key in inputs}
+                )
+            elif secrets:
+                inputs_ctx.update(self._prompt_inputs(ctx, secrets))
+        elif inputs is not None:
+            inputs_ctx = self.resolve_inputs(inputs, ctx)
+        else:
             inputs_ctx = self.before_run(ctx)
-            if inputs_ctx:
-                ctx.inputs = inputs_ctx
+        if inputs_ctx:
+            ctx.inputs = AttrDict(inputs_ctx)
+
+        ctx.steps = ResultStore()
+        if journal is not None:
+            ctx.journal = journal
+            journal.start(self, ctx)
+        return ctx
+
+    @staticmethod
+    def _skip_step(ctx: StepContext, step: Step):
+        if (step.id,) not in ctx.steps:
+            ctx.steps.set(
+                (step.id,), StepResult(step=step, status="skipped", value=None)
+            )
 
-            ctx.steps = AttrDict()
+    def run(
+        self,
+        step_ids: Optional[list[str]] = None,
+        *,
+        jobs: int = 1,
+        cache: Optional[StepCache] = None,
+        context: Optional[StepContext] = None,
+        journal: Optional[RunJournal] = None,
+        inputs: Optional[dict[str, Any]] = None,
+        raise_errors: bool = False,
+    ):
+        """
+        Run the workflow steps. Steps that don't depend on each other (see `Step.needs`
+        and `DependencyGraph.run_needs`) are run concurrently when `jobs` is greater than 1.
+        Steps with a `cache` block are looked up in `cache` (if given) before they run.
+        With the `context` of a previous run, the steps that are not in `step_ids` keep their previous result.
+        Every step result is appended to `journal`, when the journal was loaded from a previous run
+        (see `RunJournal.load`) the steps that completed in that run don't run again.
+        The values of the workflow inputs are prompted for, unless they are given in `inputs`.
+        The workflow isn't modified by a run, so several runs can share it (even concurrently).
+        An error that aborts the run is logged, or raised when `raise_errors` is set.
+        """
+
+        setup_logging()
+        self.load_env_file()
+        try:
+            ctx = context or self._make_context(journal, inputs)
             have_steps_ids = isinstance(step_ids, list)
-            for step in self.steps:
+
+            def run_step(step: Step):
                 if have_steps_ids and step.id not in step_ids:
-                    ctx.steps[step.id] = AttrDict(
-                        result=StepResult(step=step, status="skipped", value=None)
-                    )
-                    continue
-                for result in step.run(ctx):
-                    yield result
+                    self._skip_step(ctx, step)
+                    return
+                # the actions of the step tree share their state (eg. named shell sessions) until it finishes
+                with step_tree_scope():
+                    yield from step.run(ctx, cache=cache)
+
+            with tracer.span("workflow.run", workflow=self.name):
+                # concurrent steps also wait for the earlier steps whose results they use
+                needs = self.dependency_graph().run_needs() if jobs > 1 else None
+                yield from run_steps(self.steps, run_step, jobs=jobs, needs=needs)
+            if cache is not None:
+                cache.evict()
         except KeyboardInterrupt:
             log.info("Cancelled by user.")
         except Exception as e:
-            log.error(f"Error: {e}", exc_info=True)
+            if raise_errors:
+                raise
+            log.error("Error: %s", e, exc_info=True)
 
         yield
+
+    async def arun(
+        self,
+        step_ids: Optional[list[str]] = None,
+        *,
+        jobs: Optional[int] = None,
+        cache: Optional[StepCache] = None,
+        context: Optional[StepContext] = None,
+        journal: Optional[RunJournal] = None,
+        inputs: Optional[dict[str, Any]] = None,
+    ) -> AsyncIterator[StepResult]:
+        """
+        Run the workflow steps on the running event loop.
+
+        Every step runs in its own task as soon as the steps it needs have finished,
+        `jobs` (unlimited by default) bounds the number of actions running at the same time.
+        Actions run through their async methods (see `BaseAction.aexecute`), `Step.timeout` is enforced
+        and cancelling the iteration (eg. Ctrl-C in `asyncio.run`) cancels the running steps, their actions
+        are cleaned up once the call they were running returned. `context`, `journal` and `inputs` work like in `run`.
+        """
+
+        setup_logging()
+        self.load_env_file()
+        try:
+            ctx = context or self._make_context(journal, inputs)
+            have_steps_ids = isinstance(step_ids, list)
+            limit = asyncio.Semaphore(jobs) if jobs else None
+
+            results: "asyncio.Queue[Optional[StepResult]]" = asyncio.Queue()
+
+            async def run_step(step: Step):
+                if have_steps_ids and step.id not in step_ids:
+                    self._skip_step(ctx, step)
+                    return
+                with step_tree_scope():
+                    await step.arun(
+                        ctx, on_result=results.put_nowait, cache=cache, limit=limit
+                    )
+
+            async def run_all():
+                try:
+                    await arun_steps(
+                        self.steps, run_step, needs=self.dependency_graph().run_needs()
+                    )
+                finally:
+                    results.put_nowait(None)
+
+            with tracer.span("workflow.run", workflow=self.name):
+                task = asyncio.create_task(run_all())
+                try:
+                    while (result := await results.get()) is not None:
+                        yield result
+                    await task
+                finally:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if cache is not None:
+                cache.evict()
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            log.info("Cancelled by user.")
+            raise
+        except Exception as e:
+            log.error("Error: %s", e, exc_info=True)
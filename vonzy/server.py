@@ -0,0 +1,280 @@
+"""
+`vonzy serve`: a long-running process that keeps the parsed workflows, the imported actions,
+the SSH connections and warm shells in memory and runs workflows for clients (see `vonzy.client`).
+
+The protocol is JSON lines over a Unix socket. The client sends one request:
+
+    {"command": "run", "config": "/abs/workflow.yml", "step_ids": null, "inputs": {...}, "env": {...}, "cwd": "...", ...}
+    {"command": "shutdown"}
+
+and the server answers with a stream of messages, ending with a `done` message:
+
+    {"type": "output", "stream": "stdout", "data": "..."}
+    {"type": "result", "step": "build", "status": "success", "exit_code": 0}
+    {"type": "error", "message": "..."}
+    {"type": "done", "ok": true}
+
+Runs are serialized: the environment, the working directory and stdout/stderr of the server
+are switched to the ones of the client for the duration of a run.
+"""
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+import socket
+import sys
+import typing
+
+from .actions.shell import session_pool
+from .cache import StepCache
+from .constants import SOCKET_PATH
+from .errors import InvalidInput
+from .logger import flush_logging, log, setup_logging
+from .schema import StepResult, Workflow
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+Send = typing.Callable[[dict[str, typing.Any]], None]
+
+
+class _ClientStream(io.TextIOBase):
+    """
+    Replaces stdout/stderr during a run, everything written is forwarded to the client.
+    """
+
+    def __init__(self, send: Send, name: str):
+        self._send = send
+        self.name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return False
+
+    def write(self, data: str) -> int:
+        if data:
+            self._send({"type": "output", "stream": self.name, "data": data})
+        return len(data)
+
+
+@contextlib.contextmanager
+def client_context(
+    send: Send, env: typing.Optional[dict[str, str]], cwd: typing.Optional[str]
+):
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_streams = sys.stdout, sys.stderr
+    try:
+        if env is not None:
+            os.environ.clear()
+            os.environ.update(env)
+        if cwd:
+            os.chdir(cwd)
+        sys.stdout = _ClientStream(send, "stdout")
+        sys.stderr = _ClientStream(send, "stderr")
+        yield
+    finally:
+        sys.stdout, sys.stderr = saved_streams
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+class Server:
+    def __init__(self, socket_path: str = SOCKET_PATH):
+        self.socket_path = socket_path
+        # path -> ((size, mtime), workflow)
+        self._workflows: dict[str, tuple[tuple[int, int], Workflow]] = {}
+        self._run_lock: typing.Optional[asyncio.Lock] = None
+        self._stopped: typing.Optional[asyncio.Event] = None
+
+    def load_workflow(self, path: str) -> Workflow:
+        """
+        Parse the workflow at `path`, unless it was already parsed and didn't change since.
+        """
+
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self._workflows.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        log.info("Loading workflow %r", path)
+        workflow = Workflow.load_config(path)
+        self._workflows[path] = (stamp, workflow)
+        return workflow
+
+    def add_workflow(self, workflow: Workflow):
+        path = os.path.abspath(workflow._source_file)
+        st = os.stat(path)
+        self._workflows[path] = ((st.st_size, st.st_mtime_ns), workflow)
+
+    def _check_socket(self):
+        if not os.path.exists(self.socket_path):
+            os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                # left over by a server that didn't exit cleanly
+                os.unlink(self.socket_path)
+                return
+        raise RuntimeError(f"A vonzy server is already running on {self.socket_path!r}")
+
+    async def serve(self):
+        setup_logging()
+        self._check_socket()
+        self._run_lock = asyncio.Lock()
+        self._stopped = asyncio.Event()
+        # every shell action leases a warm shell unless it sets `reuse_session: false`
+        session_pool.reuse_by_default = True
+
+        # the socket is created without access for the other users, a chmod after `bind()` would leave
+        # a window where they can connect
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(
+                self._handle, path=self.socket_path
+            )
+        finally:
+            os.umask(umask)
+        log.info("Listening on %r", self.socket_path)
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+            session_pool.close_all()
+            log.info("Server stopped")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+
+        def send(message: dict[str, typing.Any]):
+            # called from the worker threads of the actions too
+            data = (json.dumps(message, default=str) + "\n").encode()
+            loop.call_soon_threadsafe(writer.write, data)
+
+        ok = False
+        command = None
+        try:
+            line = await reader.readline()
+            request = json.loads(line or b"{}")
+            command = request.get("command")
+            if command == "shutdown":
+                ok = True
+            elif command == "run":
+                async with self._run_lock:
+                    ok = await self._run(request, send, reader)
+            else:
+                send({"type": "error", "message": f"Unknown command {command!r}"})
+        except Exception as e:
+            log.error("Error handling a request: %s", e, exc_info=True)
+            send({"type": "error", "message": str(e)})
+        finally:
+            send({"type": "done", "ok": ok})
+            await asyncio.sleep(0)
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            if command == "shutdown":
+                # stop once the reply is sent, stopping closes the connections
+                self._stopped.set()
+
+    async def _run(
+        self, request: dict[str, typing.Any], send: Send, reader: asyncio.StreamReader
+    ) -> bool:
+        try:
+            workflow = self.load_workflow(request["config"])
+        except Exception as e:
+            send({"type": "error", "message": f"Can't load the workflow: {e}"})
+            return False
+
+        log.setLevel(workflow.log_level)
+        cache = (
+            None
+            if request.get("no_cache")
+            else StepCache(refresh=request.get("refresh", False))
+        )
+        kwargs = {
+            "step_ids": request.get("step_ids"),
+            "jobs": request.get("jobs"),
+            "cache": cache,
+        }
+        errors = 0
+
+        def on_result(result: typing.Optional[StepResult]):
+            nonlocal errors
+            if result is None:
+                return
+            errors += result.status == "error"
+            send(
+                {
+                    "type": "result",
+                    "step": result.step.id,
+                    "status": result.status,
+                    "exit_code": result.exit_code,
+                }
+            )
+
+        env_files = request.get("env_files") or []
+        if env_files and load_dotenv is None:
+            send(
+                {
+                    "type": "error",
+                    "message": "the server can't load env files, python-dotenv is not installed",
+                }
+            )
+            return False
+
+        with client_context(send, request.get("env"), request.get("cwd")):
+            for env_file in env_files:
+                load_dotenv(env_file, override=True)
+
+            # there's no terminal to prompt for the inputs, they come with the request
+            try:
+                kwargs["inputs"] = workflow.resolve_inputs(request.get("inputs") or {})
+            except InvalidInput as e:
+                send({"type": "error", "message": str(e)})
+                return False
+
+            if request.get("async"):
+                run = asyncio.create_task(self._arun(workflow, kwargs, on_result))
+                disconnected = asyncio.create_task(reader.read())
+                done, _ = await asyncio.wait(
+                    {run, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if run not in done:
+                    log.info("Client disconnected, cancelling the run")
+                    run.cancel()
+                disconnected.cancel()
+                await asyncio.gather(run, disconnected, return_exceptions=True)
+            else:
+                kwargs["jobs"] = kwargs["jobs"] or 1
+                await asyncio.to_thread(
+                    functools.partial(self._run_sync, workflow, kwargs, on_result)
+                )
+            # the logs of the run are rendered to the client's stderr
+            await asyncio.to_thread(flush_logging)
+
+        return errors == 0
+
+    @staticmethod
+    def _run_sync(workflow: Workflow, kwargs: dict, on_result: Send):
+        for result in workflow.run(**kwargs):
+            on_result(result)
+
+    @staticmethod
+    async def _arun(workflow: Workflow, kwargs: dict, on_result: Send):
+        async for result in workflow.arun(**kwargs):
+            on_result(result)
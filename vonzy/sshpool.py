@@ -0,0 +1,174 @@
+import atexit
+import contextlib
+import hashlib
+import threading
+import time
+import typing
+
+from .logger import log
+
+if typing.TYPE_CHECKING:
+    import paramiko
+
+PoolKey = tuple[str, int, typing.Optional[str], str]
+
+
+class _Connection:
+    __slots__ = ("client", "leases", "last_used")
+
+    def __init__(self, client: "paramiko.SSHClient"):
+        self.client = client
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHConnectionPool:
+    """
+    Process-wide pool of authenticated SSH connections keyed by (host, port, user).
+    The credentials are part of the key too, so a connection is never handed out to a caller with a different password.
+
+    A leased `paramiko.SSHClient` can be shared by several actions at the same time,
+    every `exec_command`/`open_sftp` call opens a new channel on the same transport.
+    Released connections stay open (with keepalives) until they are idle for longer than
+    `idle_timeout` seconds or more than `max_idle` idle connections are kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        keepalive: int = 30,
+        max_idle: int = 8,
+        idle_timeout: float = 300,
+    ):
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._connections: dict[PoolKey, _Connection] = {}
+        self._key_locks: dict[PoolKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: PoolKey) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _connect(
+        self, host: str, port: int, username: typing.Optional[str], **kwargs
+    ) -> "paramiko.SSHClient":
+        import paramiko
+
+        log.debug("Opening SSH connection to %s@%s:%s", username, host, port)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=host, port=port, username=username, **kwargs)
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def acquire(
+        self,
+        host: str,
+        port: int = 22,
+        username: typing.Optional[str] = None,
+        **kwargs,
+    ) -> "paramiko.SSHClient":
+        """
+        Lease a connection, reconnecting if the pooled one is dead.
+        Extra keyword arguments (eg. `password`) are passed to `paramiko.SSHClient.connect`.
+        """
+
+        credentials = hashlib.sha256(repr(sorted(kwargs.items())).encode()).hexdigest()
+        key = (host, port, username, credentials)
+        with self._key_lock(key):
+            conn = self._connections.get(key)
+            if conn is not None and not conn.is_alive:
+                log.debug("SSH connection to %s@%s:%s is dead", username, host, port)
+                with self._lock:
+                    self._connections.pop(key, None)
+                if conn.leases == 0:
+                    conn.close()
+                conn = None
+
+            if conn is None:
+                conn = _Connection(self._connect(host, port, username, **kwargs))
+                with self._lock:
+                    self._connections[key] = conn
+
+            with self._lock:
+                conn.leases += 1
+                conn.last_used = time.monotonic()
+            return conn.client
+
+    def release(self, client: "paramiko.SSHClient"):
+        with self._lock:
+            for key, conn in self._connections.items():
+                if conn.client is client:
+                    conn.leases = max(conn.leases - 1, 0)
+                    conn.last_used = time.monotonic()
+                    break
+            else:
+                # the connection was replaced (it died) while leased
+                conn = None
+
+        if conn is None:
+            with contextlib.suppress(Exception):
+                client.close()
+
+        self.evict()
+
+    @contextlib.contextmanager
+    def lease(self, *args, **kwargs) -> typing.Iterator["paramiko.SSHClient"]:
+        client = self.acquire(*args, **kwargs)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def evict(self):
+        """
+        Close the idle connections that are expired, dead or above the `max_idle` limit.
+        """
+
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            idle = sorted(
+                (
+                    (key, conn)
+                    for key, conn in self._connections.items()
+                    if conn.leases == 0
+                ),
+                key=lambda item: item[1].last_used,
+                reverse=True,
+            )
+            for idx, (key, conn) in enumerate(idle):
+                if (
+                    idx >= self.max_idle
+                    or now - conn.last_used > self.idle_timeout
+                    or not conn.is_alive
+                ):
+                    expired.append(self._connections.pop(key))
+
+        for conn in expired:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+
+        for conn in connections:
+            conn.close()
+
+
+ssh_pool = SSHConnectionPool()
+atexit.register(ssh_pool.close_all)
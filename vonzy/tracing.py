@@ -0,0 +1,87 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import typing
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict[str, typing.Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.add(self.name, self.start, time.perf_counter_ns(), **self.args)
+
+
+class Tracer:
+    """
+    Records timing spans and exports them in the Chrome trace-event format
+    (open the file in chrome://tracing or https://ui.perfetto.dev).
+
+    Spans are nested by the viewer from their start/end times on each thread.
+    While the tracer is disabled `span` returns a shared no-op context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events: list[dict[str, typing.Any]] = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, **args: typing.Any) -> typing.ContextManager:
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add(self, name: str, start_ns: int, end_ns: int, **args: typing.Any):
+        """
+        Record a span that already happened, timestamps are from `time.perf_counter_ns`.
+        """
+
+        if not self.enabled:
+            return
+
+        event = {
+            "name": name,
+            "cat": name.split(".", 1)[0],
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {k: str(v) for k, v in args.items()},
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def export(self, path: str):
+        with self._lock:
+            events = list(self._events)
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+
+tracer = Tracer()
@@ -1,29 +1,74 @@
+import functools
 import typing
 
-import jinja2
-
 from vonzy.logger import log
 
-from .datatype import AttrDict
+from .constants import TEMPLATE_CACHE_SIZE
+from .tracing import tracer
 
 if typing.TYPE_CHECKING:
+    import jinja2
+
     from .schema import StepContext
 
 
+@functools.lru_cache(maxsize=None)
+def get_jinja_env() -> "jinja2.Environment":
+    """
+    Shared environment for every template and rule, so compiled templates can be reused between renders.
+    jinja2 is imported on first use.
+    """
+
+    import jinja2
+
+    return jinja2.Environment()
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source: str) -> "jinja2.Template":
+    return get_jinja_env().from_string(source)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_rule(expr: str) -> typing.Callable[..., bool]:
+    """
+    Compile a rule expression (e.g. `steps.upload.result.status == "success"`) into a boolean evaluator.
+    """
+
+    evaluate = get_jinja_env().compile_expression(expr)
+
+    def rule(**context: typing.Any) -> bool:
+        return bool(evaluate(**context))
+
+    return rule
+
+
 def render_step_context(template: str, context: "StepContext") -> str:
     try:
-        if template.startswith("{{") and template.endswith("}}"):
-            rv = jinja2.Template(template).render(context.to_context())
-        else:
-            # use built-in str.format instead of string.Template.
-            # By default python's str.format supports attribute fetching styles (aka, `getattr`) eg `obj.attr`.
-            # While string.Template is not #cmiiw.
-            # see: https://peps.python.org/pep-3101/#simple-and-compound-field-names
-            kwargs = context.to_context()
-            rv = template.format(**AttrDict(kwargs))
+        with tracer.span("template.render", template=template):
+            if template.startswith("{{") and template.endswith("}}"):
+                rv = compile_template(template).render(context.to_context())
+            else:
+                # use built-in str.format instead of string.Template.
+                # By default python's str.format supports attribute fetching styles (aka, `getattr`) eg `obj.attr`.
+                # While string.Template is not #cmiiw.
+                # see: https://peps.python.org/pep-3101/#simple-and-compound-field-names
+                rv = template.format_map(context.to_context())
+    except Exception as e:
+        log.error("Error rendering template %r: %s", template, e)
+        log.debug("Step context: %s", context)
+        raise
+
+    return rv
+
+
+def evaluate_rule(expr: str, context: "StepContext") -> bool:
+    try:
+        with tracer.span("rule.evaluate", rule=expr):
+            rv = compile_rule(expr)(**context.to_context())
     except Exception as e:
-        log.error(f"Error rendering template {template!r}: {e}")
-        log.debug(f"Step context: {context}")
+        log.error("Error evaluating rule %r: %s", expr, e)
+        log.debug("Step context: %s", context)
         raise
 
     return rv
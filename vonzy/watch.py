@@ -0,0 +1,409 @@
+"""
+`vonzy watch`: rerun the steps whose `watch` paths changed, and the steps that depend on them.
+
+Changes are read from inotify on Linux (through ctypes), other platforms (or when inotify is not available)
+fall back to polling the modification times of the watched files.
+"""
+import ctypes
+import ctypes.util
+import glob
+import os
+import re
+import select
+import struct
+import time
+import typing
+from abc import ABC, abstractmethod
+
+from .constants import WATCH_DEBOUNCE, WATCH_POLL_INTERVAL
+from .logger import log
+from .scheduler import topological_order
+
+if typing.TYPE_CHECKING:
+    from .analysis import DependencyGraph
+    from .schema import Step, StepContext, Workflow
+
+# directory -> watch its subdirectories too
+Roots = dict[str, bool]
+
+IGNORED_DIRS = frozenset({".git", "__pycache__"})
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+
+def compile_pattern(pattern: str) -> "re.Pattern[str]":
+    """
+    Compile a glob pattern (with `**` for any number of directories) into a regex matching
+    the absolute paths of the files it covers. The files under a matched directory are covered too.
+    """
+
+    pattern = os.path.abspath(pattern)
+    regex = []
+    idx = 0
+    while idx < len(pattern):
+        c = pattern[idx]
+        if pattern.startswith("**/", idx):
+            regex.append("(?:.*/)?")
+            idx += 3
+            continue
+        if pattern.startswith("**", idx):
+            regex.append(".*")
+            idx += 2
+            continue
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[" and (end := pattern.find("]", idx + 2)) != -1:
+            chars = pattern[idx + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex.append(f"[{chars}]")
+            idx = end
+        else:
+            regex.append(re.escape(c))
+        idx += 1
+    return re.compile("".join(regex) + "(?:/.*)?")
+
+
+def pattern_root(pattern: str) -> tuple[str, bool]:
+    """
+    The directory to watch for `pattern`, and whether its subdirectories must be watched too.
+    """
+
+    pattern = os.path.abspath(pattern)
+    if not glob.has_magic(pattern):
+        if os.path.isdir(pattern):
+            return pattern, True
+        return os.path.dirname(pattern), False
+
+    parts = pattern.split(os.sep)
+    base = []
+    for part in parts:
+        if glob.has_magic(part):
+            break
+        base.append(part)
+    return os.sep.join(base) or os.sep, True
+
+
+def _walk_dirs(root: str, recursive: bool) -> typing.Iterator[str]:
+    if not os.path.isdir(root):
+        return
+    yield root
+    if not recursive:
+        return
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+        for d in dirnames:
+            yield os.path.join(dirpath, d)
+
+
+class Watcher(ABC):
+    """
+    Reports the paths changed under the watched directories.
+    `read` returns `None` when the changes are unknown (eg. events were lost) and everything must be considered changed.
+    """
+
+    def __init__(self, roots: Roots):
+        self.roots = roots
+
+    @abstractmethod
+    def read(self, timeout: typing.Optional[float]) -> typing.Optional[set[str]]:
+        pass
+
+    def close(self):
+        pass
+
+    def discard(self):
+        """
+        Drop the changes seen so far (eg. the files written by the steps while they ran).
+        """
+
+        while self.read(0) != set():
+            pass
+
+    def wait(self, debounce: float = WATCH_DEBOUNCE) -> typing.Optional[set[str]]:
+        """
+        Block until something changes, then collect the changes until nothing changed for `debounce` seconds.
+        """
+
+        changed: typing.Optional[set[str]] = set()
+        while not changed:
+            changed = self.read(None)
+            if changed is None:
+                break
+
+        while True:
+            more = self.read(debounce)
+            if more is None:
+                changed = None
+            elif not more:
+                return changed
+            elif changed is not None:
+                changed |= more
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, roots: Roots):
+        super().__init__(roots)
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # watch descriptor -> (directory, recursive)
+        self._watches: dict[int, tuple[str, bool]] = {}
+        for root, recursive in roots.items():
+            for path in _walk_dirs(root, recursive):
+                self._add_watch(path, recursive)
+
+    def _add_watch(self, path: str, recursive: bool):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            log.warning("Can't watch %r: %s", path, os.strerror(errno))
+            return
+        self._watches[wd] = (path, recursive)
+
+    def read(self, timeout: typing.Optional[float]) -> typing.Optional[set[str]]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: set[str] = set()
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + size].rstrip(b"\0"))
+            offset += size
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+
+            directory, recursive = watch
+            path = os.path.join(directory, name) if name else directory
+            changed.add(path)
+            if (
+                recursive
+                and mask & IN_ISDIR
+                and mask & (IN_CREATE | IN_MOVED_TO)
+                and name not in IGNORED_DIRS
+            ):
+                # files created in the new directory before its watch is added are found by walking it
+                for subdir in _walk_dirs(path, True):
+                    self._add_watch(subdir, True)
+                    changed.update(
+                        entry.path for entry in os.scandir(subdir) if entry.is_file()
+                    )
+
+        return None if overflow else changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, roots: Roots, *, interval: float = WATCH_POLL_INTERVAL):
+        super().__init__(roots)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for root, recursive in self.roots.items():
+            for directory in _walk_dirs(root, recursive):
+                try:
+                    entries = list(os.scandir(directory))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        continue
+        return snapshot
+
+    def read(self, timeout: typing.Optional[float]) -> typing.Optional[set[str]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+
+            snapshot = self._scan()
+            previous, self._snapshot = self._snapshot, snapshot
+            changed = {
+                path
+                for path in previous.keys() | snapshot.keys()
+                if previous.get(path) != snapshot.get(path)
+            }
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def discard(self):
+        self._snapshot = self._scan()
+
+
+def make_watcher(roots: Roots, *, polling: bool = False) -> Watcher:
+    if not polling:
+        try:
+            return InotifyWatcher(roots)
+        except OSError as e:
+            log.warning("inotify is not available (%s), polling the files instead", e)
+    return PollingWatcher(roots)
+
+
+class WatchPlan:
+    """
+    The watched paths of the top-level steps of a workflow (including the paths of their child steps)
+    and the steps depending on them (from the dependency `graph`: their `needs` and the step results
+    used by their templates and rules).
+    """
+
+    def __init__(self, steps: list["Step"], graph: "DependencyGraph"):
+        self.steps = steps
+        self.patterns: dict[str, list["re.Pattern[str]"]] = {}
+        self.roots: Roots = {}
+        self.dependents: dict[str, set[str]] = {step.id: set() for step in steps}
+
+        for step in steps:
+            for dep in graph.dependencies(step.id):
+                self.dependents[dep].add(step.id)
+            for pattern in self._watched(step):
+                self.patterns.setdefault(step.id, []).append(compile_pattern(pattern))
+                root, recursive = pattern_root(pattern)
+                self.roots[root] = self.roots.get(root, False) or recursive
+
+    @classmethod
+    def _watched(cls, step: "Step") -> typing.Iterator[str]:
+        yield from step.watch
+        for child in step.steps:
+            yield from cls._watched(child)
+
+    def affected(self, changed: typing.Optional[set[str]]) -> list[str]:
+        """
+        The ids of the steps to rerun for the `changed` paths (`None`: every watched step),
+        in the order they run.
+        """
+
+        if changed is None:
+            step_ids = set(self.patterns)
+        else:
+            step_ids = {
+                step_id
+                for step_id, patterns in self.patterns.items()
+                if any(p.fullmatch(path) for p in patterns for path in changed)
+            }
+
+        pending = list(step_ids)
+        while pending:
+            for dependent in self.dependents[pending.pop()]:
+                if dependent not in step_ids:
+                    step_ids.add(dependent)
+                    pending.append(dependent)
+
+        return [s.id for s in topological_order(self.steps) if s.id in step_ids]
+
+
+def watch(
+    workflow: "Workflow",
+    step_ids: typing.Optional[list[str]] = None,
+    *,
+    run: typing.Callable[["Workflow", list[str], "StepContext"], None],
+    debounce: float = WATCH_DEBOUNCE,
+    polling: bool = False,
+):
+    """
+    Run the steps (all of them, or `step_ids`), then rerun the affected ones each time their watched files change.
+
+    The workflow is parsed once, every cycle runs it with `run(workflow, step_ids, context)`.
+    The context (inputs and results) is kept between the cycles so the steps that don't rerun
+    keep their previous result.
+
+    The watcher is started before the first run, so the files changed during a run aren't missed,
+    but the changes seen while a run is in progress are dropped: they are mostly written by the steps
+    themselves (eg. build outputs under a watched directory) and would trigger the same steps again.
+    """
+
+    plan = WatchPlan(workflow.steps, workflow.dependency_graph())
+    if not plan.patterns:
+        raise ValueError("No step has `watch` paths")
+
+    selected = set(step_ids or [step.id for step in workflow.steps])
+    context = workflow._make_context()
+
+    watcher = make_watcher(plan.roots, polling=polling)
+    log.info("Watching %s directories for changes", len(plan.roots))
+    try:
+        run(workflow, step_ids or None, context)
+        watcher.discard()
+        while True:
+            changed = watcher.wait(debounce)
+            rerun = [
+                step_id for step_id in plan.affected(changed) if step_id in selected
+            ]
+            if not rerun:
+                continue
+
+            if changed is None:
+                log.info("Lost track of the changes, rerunning %s", ", ".join(rerun))
+            else:
+                log.info(
+                    "%s paths changed, rerunning %s", len(changed), ", ".join(rerun)
+                )
+            run(workflow, rerun, context)
+            watcher.discard()
+    finally:
+        watcher.close()